@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Block-compressed storage format for recorded market data
+Records are grouped into independently compressed blocks so any message
+or time point can be reached by decompressing a single block
+"""
+
+import bisect
+import struct
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+
+FILE_MAGIC = b'MTRS'
+BLOCK_MAGIC = b'MTRB'
+DIRECTORY_MAGIC = b'MTRD'
+FORMAT_VERSION = 1
+
+# Record encodings stored in the block header
+RECORD_JSONL = 0           # Newline-terminated JSON messages
+RECORD_RAW = 1             # Length-prefixed original ZeroMQ frames
+RECORD_RAW_SOURCE = 2      # Raw frames tagged with the endpoint they came from
+
+# File layout:
+#   file header | block header + compressed payload | ... | directory | footer
+FILE_HEADER = struct.Struct('<4sB3x')
+# magic, version, record format, flags, compressed size, raw size,
+# record count, crc32 of compressed payload, first timestamp, last timestamp
+BLOCK_HEADER = struct.Struct('<4sBBHIIIIdd')
+# block offset, compressed size, record count, record format, first/last timestamp
+DIRECTORY_ENTRY = struct.Struct('<QIIBdd')
+# magic, directory offset, block count
+FOOTER = struct.Struct('<4sQI')
+# receive timestamp, topic length, payload length
+RAW_RECORD_HEADER = struct.Struct('<dHI')
+# receive timestamp, source length, topic length, payload length
+SOURCE_RECORD_HEADER = struct.Struct('<dBHI')
+RAW_HEADERS = {RECORD_RAW: RAW_RECORD_HEADER, RECORD_RAW_SOURCE: SOURCE_RECORD_HEADER}
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # uncompressed bytes per block
+DEFAULT_BLOCK_RECORDS = 10000
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_READ_SIZE = 8 * 1024 * 1024  # bytes per read during sequential scans
+
+
+class BlockFormatError(Exception):
+    """Raised when a recording file is not a valid block file"""
+
+
+@dataclass
+class BlockInfo:
+    """Location and summary of a single compressed block"""
+    offset: int
+    compressed_size: int
+    message_count: int
+    first_timestamp: float
+    last_timestamp: float
+    record_format: int = RECORD_JSONL
+
+    @property
+    def end_offset(self) -> int:
+        """Offset of the first byte after this block"""
+        return self.offset + BLOCK_HEADER.size + self.compressed_size
+
+
+def is_block_file(path: Union[str, Path]) -> bool:
+    """Check whether a file uses the block-compressed format"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+def pack_raw_record(timestamp: float, topic: bytes, payload: bytes) -> bytes:
+    """Encode a received topic/payload frame pair as a raw record"""
+    return RAW_RECORD_HEADER.pack(timestamp, len(topic), len(payload)) + topic + payload
+
+
+def unpack_raw_record(record: bytes) -> Tuple[float, bytes, bytes]:
+    """Decode a raw record into its timestamp, topic and payload"""
+    timestamp, topic_len, payload_len = RAW_RECORD_HEADER.unpack_from(record)
+    start = RAW_RECORD_HEADER.size
+    return timestamp, record[start:start + topic_len], record[start + topic_len:start + topic_len + payload_len]
+
+
+def pack_source_record(timestamp: float, source: bytes, topic: bytes, payload: bytes) -> bytes:
+    """Encode a received frame pair and the name of its endpoint as a raw record"""
+    return SOURCE_RECORD_HEADER.pack(timestamp, len(source), len(topic), len(payload)) + source + topic + payload
+
+
+def unpack_source_record(record: bytes) -> Tuple[float, bytes, bytes, bytes]:
+    """Decode a tagged raw record into its timestamp, source, topic and payload"""
+    timestamp, source_len, topic_len, payload_len = SOURCE_RECORD_HEADER.unpack_from(record)
+    start = SOURCE_RECORD_HEADER.size
+    topic_start = start + source_len
+    payload_start = topic_start + topic_len
+    return (timestamp, record[start:topic_start], record[topic_start:payload_start],
+            record[payload_start:payload_start + payload_len])
+
+
+def encode_records(records: Sequence[bytes], record_format: int = RECORD_JSONL) -> bytes:
+    """Join records into an uncompressed block payload"""
+    if record_format in RAW_HEADERS:
+        # Raw records carry their own lengths
+        return b''.join(records)
+    return b''.join(record + b'\n' for record in records)
+
+
+def decode_records(payload: bytes, record_format: int = RECORD_JSONL) -> List[bytes]:
+    """Split an uncompressed block payload into records"""
+    header = RAW_HEADERS.get(record_format)
+    if header:
+        records = []
+        offset = 0
+        while offset < len(payload):
+            lengths = header.unpack_from(payload, offset)[1:]
+            end = offset + header.size + sum(lengths)
+            records.append(payload[offset:end])
+            offset = end
+        return records
+    return payload.split(b'\n')[:-1]
+
+
+class BlockWriter:
+    """Writes records to a block-compressed recording file"""
+
+    def __init__(self, path: Union[str, Path],
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                 block_size: int = DEFAULT_BLOCK_SIZE,
+                 block_records: int = DEFAULT_BLOCK_RECORDS):
+        """
+        Initialize writer
+
+        Args:
+            path: Path of the recording file to create
+            compression_level: zlib compression level (1-9)
+            block_size: Maximum uncompressed bytes per block
+            block_records: Maximum records per block
+        """
+        self.path = Path(path)
+        self.compression_level = compression_level
+        self.block_size = block_size
+        self.block_records = block_records
+        self.blocks: List[BlockInfo] = []
+
+        self.file = open(self.path, 'wb')
+        self.file.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION))
+        self.offset = FILE_HEADER.size
+
+    def write_records(self, records: Sequence[bytes], timestamps: Sequence[float],
+                      record_format: int = RECORD_JSONL) -> List[BlockInfo]:
+        """
+        Write records, splitting them into blocks by size and count
+
+        Returns:
+            The blocks written, in file order
+        """
+        written = []
+        start = 0
+        size = 0
+
+        for i, record in enumerate(records):
+            size += len(record) + 1
+            if i + 1 - start >= self.block_records or size >= self.block_size:
+                written.append(self.write_block(records[start:i + 1], timestamps[start:i + 1], record_format))
+                start = i + 1
+                size = 0
+
+        if start < len(records):
+            written.append(self.write_block(records[start:], timestamps[start:], record_format))
+
+        return written
+
+    def write_block(self, records: Sequence[bytes], timestamps: Sequence[float],
+                    record_format: int = RECORD_JSONL) -> BlockInfo:
+        """Compress and write a single block"""
+        return self.append_block(records, timestamps[0], timestamps[-1], record_format)
+
+    def append_block(self, records: Sequence[bytes], first_timestamp: float, last_timestamp: float,
+                     record_format: int = RECORD_JSONL) -> BlockInfo:
+        """Compress and write a single block whose time span is already known"""
+        payload = encode_records(records, record_format)
+        compressed = zlib.compress(payload, self.compression_level)
+
+        info = BlockInfo(
+            offset=self.offset,
+            compressed_size=len(compressed),
+            message_count=len(records),
+            first_timestamp=first_timestamp,
+            last_timestamp=last_timestamp,
+            record_format=record_format
+        )
+
+        self.file.write(BLOCK_HEADER.pack(
+            BLOCK_MAGIC, FORMAT_VERSION, record_format, 0,
+            len(compressed), len(payload), len(records),
+            zlib.crc32(compressed), info.first_timestamp, info.last_timestamp
+        ))
+        self.file.write(compressed)
+
+        self.offset = info.end_offset
+        self.blocks.append(info)
+        return info
+
+    def flush(self):
+        """Flush written blocks to disk"""
+        self.file.flush()
+
+    def close(self):
+        """Write the block directory and close the file"""
+        if self.file.closed:
+            return
+
+        write_directory(self.file, self.offset, self.blocks)
+        self.file.close()
+
+
+def write_directory(file, directory_offset: int, blocks: Sequence[BlockInfo]):
+    """Write the block directory and footer at directory_offset"""
+    file.seek(directory_offset)
+    file.write(DIRECTORY_MAGIC)
+    for info in blocks:
+        file.write(DIRECTORY_ENTRY.pack(
+            info.offset, info.compressed_size, info.message_count,
+            info.record_format, info.first_timestamp, info.last_timestamp
+        ))
+    file.write(FOOTER.pack(DIRECTORY_MAGIC, directory_offset, len(blocks)))
+
+
+def seal_block_file(path: Union[str, Path], blocks: Sequence[BlockInfo]) -> int:
+    """
+    Cut a file after its last complete block and write the missing directory
+
+    Used to recover files left behind by a writer that never closed them.
+
+    Returns:
+        The number of bytes truncated
+    """
+    end = blocks[-1].end_offset if blocks else FILE_HEADER.size
+    with open(path, 'r+b') as f:
+        size = f.seek(0, 2)
+        f.truncate(end)
+        write_directory(f, end, blocks)
+    return size - end
+
+
+class BlockReader:
+    """Random and sequential access to a block-compressed recording file"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.file = open(self.path, 'rb')
+
+        header = self.file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != FILE_MAGIC:
+            self.file.close()
+            raise BlockFormatError(f"Not a block recording file: {self.path}")
+
+        self._blocks: Optional[List[BlockInfo]] = None
+        self._cached_offset: Optional[int] = None
+        self._cached_format = RECORD_JSONL
+        self._cached_records: List[bytes] = []
+
+    def blocks(self) -> List[BlockInfo]:
+        """Get the block directory, scanning block headers if the file has none"""
+        if self._blocks is None:
+            self._blocks = self._read_directory()
+            if self._blocks is None:
+                self._blocks = list(self.scan_blocks())
+        return self._blocks
+
+    def is_sealed(self) -> bool:
+        """Whether the file ends with the directory written on close"""
+        return self._read_directory() is not None
+
+    def _read_directory(self) -> Optional[List[BlockInfo]]:
+        """Read the directory written on close, if present"""
+        self.file.seek(0, 2)
+        file_size = self.file.tell()
+        if file_size < FILE_HEADER.size + FOOTER.size:
+            return None
+
+        self.file.seek(file_size - FOOTER.size)
+        magic, directory_offset, count = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != DIRECTORY_MAGIC:
+            return None
+
+        self.file.seek(directory_offset)
+        if self.file.read(len(DIRECTORY_MAGIC)) != DIRECTORY_MAGIC:
+            return None
+
+        data = self.file.read(DIRECTORY_ENTRY.size * count)
+        blocks = []
+        for entry in DIRECTORY_ENTRY.iter_unpack(data):
+            offset, compressed_size, message_count, record_format, first_ts, last_ts = entry
+            blocks.append(BlockInfo(offset, compressed_size, message_count, first_ts, last_ts, record_format))
+        return blocks
+
+    def read_header(self, offset: int) -> Optional[BlockInfo]:
+        """Read the header of the block at offset, None if there is no complete block"""
+        self.file.seek(offset)
+        data = self.file.read(BLOCK_HEADER.size)
+        if len(data) < BLOCK_HEADER.size:
+            return None
+
+        (magic, _version, record_format, _flags, compressed_size, _raw_size,
+         count, _crc, first_ts, last_ts) = BLOCK_HEADER.unpack(data)
+        if magic != BLOCK_MAGIC:
+            return None
+
+        return BlockInfo(offset, compressed_size, count, first_ts, last_ts, record_format)
+
+    def scan_blocks(self, start_offset: int = FILE_HEADER.size) -> Iterator[BlockInfo]:
+        """Walk block headers from start_offset, stopping at the directory or a torn block"""
+        self.file.seek(0, 2)
+        file_size = self.file.tell()
+        offset = start_offset
+
+        while True:
+            info = self.read_header(offset)
+            if info is None or info.end_offset > file_size:
+                return
+            yield info
+            offset = info.end_offset
+
+    def read_block(self, offset: int) -> List[bytes]:
+        """Decompress the block at offset and return its records"""
+        return self.read_block_records(offset)[1]
+
+    def read_block_records(self, offset: int) -> Tuple[int, List[bytes]]:
+        """Decompress the block at offset and return its record format and records"""
+        if offset == self._cached_offset:
+            return self._cached_format, self._cached_records
+
+        self.file.seek(offset)
+        header = self.file.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            raise BlockFormatError(f"No block at offset {offset} in {self.path}")
+
+        compressed_size = BLOCK_HEADER.unpack(header)[4]
+        record_format, records = self._decode_block(offset, header, self.file.read(compressed_size))
+
+        self._cached_offset = offset
+        self._cached_format = record_format
+        self._cached_records = records
+        return record_format, records
+
+    def _decode_block(self, offset: int, header: bytes, compressed: bytes) -> Tuple[int, List[bytes]]:
+        """Verify and decompress a block read from offset"""
+        (magic, _version, record_format, _flags, compressed_size, raw_size,
+         _count, crc, _first_ts, _last_ts) = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            raise BlockFormatError(f"No block at offset {offset} in {self.path}")
+
+        if len(compressed) < compressed_size or zlib.crc32(compressed) != crc:
+            raise BlockFormatError(f"Corrupt block at offset {offset} in {self.path}")
+
+        return record_format, decode_records(zlib.decompress(compressed, bufsize=raw_size), record_format)
+
+    def read_sequential(self, offsets: Sequence[int],
+                        read_size: int = DEFAULT_READ_SIZE) -> Iterator[Tuple[int, int, List[bytes]]]:
+        """
+        Read blocks in file order with large reads instead of a seek per block
+
+        Consecutive offsets are read as one run: the reader seeks once to
+        the start of the run and then consumes the file in read_size chunks.
+
+        Yields:
+            (offset, record format, records) for each requested block
+        """
+        offsets = sorted(offsets)
+        i = 0
+
+        while i < len(offsets):
+            offset = offsets[i]
+            self.file.seek(offset)
+            buffer = b''
+            pos = 0
+
+            while True:
+                # Make sure the buffer holds the whole block
+                header_end = pos + BLOCK_HEADER.size
+                if len(buffer) < header_end:
+                    buffer = buffer[pos:] + self._read_at_least(header_end - len(buffer), read_size, offset)
+                    pos = 0
+                    header_end = BLOCK_HEADER.size
+
+                header = buffer[pos:header_end]
+                end = header_end + BLOCK_HEADER.unpack(header)[4]
+                if len(buffer) < end:
+                    buffer = buffer[pos:] + self._read_at_least(end - len(buffer), read_size, offset)
+                    end -= pos
+                    header_end -= pos
+                    pos = 0
+
+                record_format, records = self._decode_block(offset, header, buffer[header_end:end])
+                yield offset, record_format, records
+
+                offset += end - pos
+                pos = end
+                i += 1
+
+                # Continue the run only while the next block follows directly
+                if i >= len(offsets) or offsets[i] != offset:
+                    break
+
+    def _read_at_least(self, size: int, read_size: int, offset: int) -> bytes:
+        """Read at least size bytes in chunks of read_size"""
+        data = self.file.read(max(size, read_size))
+        if len(data) < size:
+            raise BlockFormatError(f"Truncated block at offset {offset} in {self.path}")
+        return data
+
+    def read_record(self, offset: int, index: int) -> bytes:
+        """Read a single record by block offset and position within the block"""
+        return self.read_block(offset)[index]
+
+    def find_block(self, timestamp: float) -> int:
+        """Index of the first block that may contain messages at or after timestamp"""
+        last_timestamps = [info.last_timestamp for info in self.blocks()]
+        return bisect.bisect_left(last_timestamps, timestamp)
+
+    def iter_records(self, start_block: int = 0) -> Iterator[Tuple[BlockInfo, List[bytes]]]:
+        """Iterate over blocks in file order, yielding each block with its records"""
+        for info in self.blocks()[start_block:]:
+            yield info, self.read_block(info.offset)
+
+    def close(self):
+        """Close the file"""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -9,10 +9,21 @@ import zmq
 import zmq.asyncio
 import json
 import time
+import itertools
+import heapq
+import bisect
+import random
 import gzip
 import sqlite3
 import logging
-from typing import Dict, List, Optional, Any, Generator, Tuple
+import queue
+import struct
+import threading
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from operator import attrgetter, itemgetter
+from typing import Dict, List, Optional, Any, Generator, Iterable, Iterator, Tuple, Union
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -23,6 +34,19 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+from services.replay.block_storage import (
+    BlockWriter, BlockReader, BlockInfo, BlockFormatError, is_block_file, seal_block_file,
+    FILE_HEADER, RECORD_JSONL, RECORD_RAW, RECORD_RAW_SOURCE,
+    pack_raw_record, unpack_raw_record, pack_source_record, unpack_source_record
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    USE_PYARROW = True
+except ImportError:
+    USE_PYARROW = False
+
 
 class ReplayMode(Enum):
     """Replay modes"""
@@ -32,6 +56,12 @@ class ReplayMode(Enum):
     ACCELERATED = "accelerated" # Replay at Nx speed
 
 
+class IndexMode(Enum):
+    """Recording index modes"""
+    FULL = "full"              # One index row per message plus block summaries
+    SPARSE = "sparse"          # Block summaries only
+
+
 @dataclass
 class MarketMessage:
     """Market data message"""
@@ -39,9 +69,13 @@ class MarketMessage:
     topic: str
     symbol: str
     data: Dict[str, Any]
+    source: Optional[str] = None  # Endpoint name when recorded from several feeds
     
     def to_json(self) -> str:
-        return json.dumps(asdict(self))
+        message = asdict(self)
+        if self.source is None:
+            del message['source']
+        return json.dumps(message)
     
     @staticmethod
     def from_json(json_str: str) -> 'MarketMessage':
@@ -49,64 +83,958 @@ class MarketMessage:
         return MarketMessage(**data)
 
 
+def symbol_from_topic(topic: str) -> str:
+    """Extract the symbol from a topic (e.g., "tick.EURUSD" -> "EURUSD")"""
+    if topic.startswith("tick."):
+        return topic[5:]
+    return ""
+
+
+@dataclass
+class RawMessage:
+    """Market data message kept as the original ZeroMQ frames"""
+    timestamp: float
+    topic: str
+    symbol: str
+    raw_topic: bytes
+    payload: bytes
+    source: Optional[str] = None
+    
+    @property
+    def data(self) -> Dict[str, Any]:
+        """Decoded payload"""
+        return json.loads(self.payload)
+    
+    @staticmethod
+    def from_frame(timestamp: float, topic: bytes, payload: bytes,
+                   source: Optional[str] = None) -> 'RawMessage':
+        topic_str = topic.decode()
+        return RawMessage(timestamp, topic_str, symbol_from_topic(topic_str), topic, payload, source)
+    
+    @staticmethod
+    def from_record(record: bytes) -> 'RawMessage':
+        return RawMessage.from_frame(*unpack_raw_record(record))
+    
+    @staticmethod
+    def from_source_record(record: bytes) -> 'RawMessage':
+        timestamp, source, topic, payload = unpack_source_record(record)
+        return RawMessage.from_frame(timestamp, topic, payload, source.decode())
+
+
+class RecordingFile:
+    """Random access to the messages of a recording file"""
+    
+    def __init__(self, file_path: str):
+        """
+        Open a recording file
+        
+        Block files are read one block at a time; legacy ``.jsonl.gz``
+        recordings fall back to seeking in the gzip stream.
+        """
+        self.file_path = Path(file_path)
+        self.block_reader = None
+        self.gzip_handle = None
+        
+        if is_block_file(self.file_path):
+            self.block_reader = BlockReader(self.file_path)
+        else:
+            self.gzip_handle = gzip.open(self.file_path, 'rt')
+    
+    def read_message(self, file_offset: int, record_index: int = 0) -> MarketMessage:
+        """Read the message stored at an index position"""
+        if self.block_reader:
+            record_format, records = self.block_reader.read_block_records(file_offset)
+            return self._decode(records[record_index], record_format)
+        
+        self.gzip_handle.seek(file_offset)
+        return MarketMessage.from_json(self.gzip_handle.readline())
+    
+    def read_block(self, file_offset: int) -> List[MarketMessage]:
+        """Read all messages of the block at file_offset"""
+        record_format, records = self.block_reader.read_block_records(file_offset)
+        return [self._decode(record, record_format) for record in records]
+    
+    def scan_blocks(self, file_offsets: List[int]) -> Iterator[List[MarketMessage]]:
+        """Read the messages of several blocks in file order using large sequential reads"""
+        for _offset, record_format, records in self.block_reader.read_sequential(file_offsets):
+            yield [self._decode(record, record_format) for record in records]
+    
+    @staticmethod
+    def _decode(record: bytes, record_format: int):
+        """Decode a record into a MarketMessage, or a RawMessage for raw blocks"""
+        if record_format == RECORD_RAW:
+            return RawMessage.from_record(record)
+        if record_format == RECORD_RAW_SOURCE:
+            return RawMessage.from_source_record(record)
+        return MarketMessage.from_json(record.decode())
+    
+    def close(self):
+        """Close the underlying file"""
+        if self.block_reader:
+            self.block_reader.close()
+        if self.gzip_handle:
+            self.gzip_handle.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def init_database(db_conn: sqlite3.Connection):
+    """Create the recording tables and migrate databases from older versions"""
+    # Create tables
+    db_conn.executescript("""
+        CREATE TABLE IF NOT EXISTS recording_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            start_time REAL NOT NULL,
+            end_time REAL,
+            file_path TEXT NOT NULL,
+            message_count INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'recording',
+            metadata TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS message_index (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            topic TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            file_offset INTEGER NOT NULL,
+            record_index INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_timestamp ON message_index(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_symbol ON message_index(symbol);
+        CREATE INDEX IF NOT EXISTS idx_session_symbol ON message_index(session_id, symbol);
+        CREATE INDEX IF NOT EXISTS idx_session_time ON message_index(session_id, timestamp);
+
+        CREATE TABLE IF NOT EXISTS block_index (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            file_offset INTEGER NOT NULL,
+            first_timestamp REAL NOT NULL,
+            last_timestamp REAL NOT NULL,
+            message_count INTEGER NOT NULL,
+            symbols TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_block_session_time ON block_index(session_id, first_timestamp);
+
+        CREATE TABLE IF NOT EXISTS rollups (
+            session_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            first_timestamp REAL NOT NULL,
+            last_timestamp REAL NOT NULL,
+            bid_open REAL,
+            bid_high REAL,
+            bid_low REAL,
+            bid_close REAL,
+            ask_open REAL,
+            ask_high REAL,
+            ask_low REAL,
+            ask_close REAL,
+            spread_min REAL,
+            spread_max REAL,
+            PRIMARY KEY (session_id, resolution, symbol, bucket),
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS session_catalog (
+            session_id INTEGER PRIMARY KEY,
+            first_timestamp REAL,
+            last_timestamp REAL,
+            message_count INTEGER NOT NULL,
+            symbol_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS symbol_catalog (
+            session_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            first_timestamp REAL NOT NULL,
+            last_timestamp REAL NOT NULL,
+            message_count INTEGER NOT NULL,
+            PRIMARY KEY (session_id, symbol),
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_symbol_catalog_time ON symbol_catalog(symbol, first_timestamp);
+
+        CREATE TABLE IF NOT EXISTS segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            first_timestamp REAL,
+            last_timestamp REAL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            compression_level INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at REAL NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_segment_session ON segments(session_id, seq);
+
+        CREATE TABLE IF NOT EXISTS session_shards (
+            session_id INTEGER NOT NULL,
+            shard INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL,
+            shard_session_id INTEGER NOT NULL,
+            PRIMARY KEY (session_id, shard),
+            FOREIGN KEY (session_id) REFERENCES recording_sessions(id),
+            FOREIGN KEY (shard_session_id) REFERENCES recording_sessions(id)
+        );
+    """)
+
+    # Databases created before block storage lack the in-block position
+    columns = {row[1] for row in db_conn.execute("PRAGMA table_info(message_index)")}
+    if 'record_index' not in columns:
+        db_conn.execute(
+            "ALTER TABLE message_index ADD COLUMN record_index INTEGER NOT NULL DEFAULT 0"
+        )
+
+    # Rows written before segment rotation point into the session's file
+    for table in ('message_index', 'block_index'):
+        columns = {row[1] for row in db_conn.execute(f"PRAGMA table_info({table})")}
+        if 'segment_id' not in columns:
+            db_conn.execute(f"ALTER TABLE {table} ADD COLUMN segment_id INTEGER")
+
+    db_conn.commit()
+
+
+def session_index_mode(session: Dict[str, Any]) -> IndexMode:
+    """Get the index mode a session was recorded with"""
+    metadata = json.loads(session['metadata']) if session.get('metadata') else {}
+    return IndexMode(metadata.get('index_mode', IndexMode.FULL.value))
+
+
+def query_blocks(db_conn: sqlite3.Connection, session_id: int,
+                 start_time: Optional[float] = None, end_time: Optional[float] = None,
+                 symbols: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Get the block summaries of a session that may hold matching messages
+    
+    Blocks are pruned by time range in SQLite and by symbol using the
+    per-block symbol summary. They are returned in recording order across
+    the session's segments.
+    """
+    query = """
+        SELECT b.file_offset, b.first_timestamp, b.last_timestamp, b.message_count, b.symbols,
+               b.segment_id
+        FROM block_index b
+        LEFT JOIN segments g ON g.id = b.segment_id
+        WHERE b.session_id = ?
+    """
+    params = [session_id]
+    
+    if start_time is not None:
+        query += " AND b.last_timestamp >= ?"
+        params.append(start_time)
+    
+    if end_time is not None:
+        query += " AND b.first_timestamp <= ?"
+        params.append(end_time)
+    
+    query += " ORDER BY COALESCE(g.seq, 0), b.file_offset"
+    
+    blocks = []
+    for row in db_conn.execute(query, params):
+        block = {
+            'file_offset': row[0],
+            'first_timestamp': row[1],
+            'last_timestamp': row[2],
+            'message_count': row[3],
+            'symbols': json.loads(row[4]),
+            'segment_id': row[5]
+        }
+        if symbols and not any(symbol in block['symbols'] for symbol in symbols):
+            continue
+        blocks.append(block)
+    
+    return blocks
+
+
+def session_segments(db_conn: sqlite3.Connection, session: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Get the segments of a session in recording order
+    
+    Sessions recorded before segment rotation have a single implicit
+    segment with ID None stored at the session's file_path.
+    """
+    columns = ('id', 'session_id', 'seq', 'file_path', 'first_timestamp', 'last_timestamp',
+               'message_count', 'size_bytes', 'compression_level', 'status', 'created_at')
+    rows = db_conn.execute(f"""
+        SELECT {', '.join(columns)} FROM segments
+        WHERE session_id = ?
+        ORDER BY seq
+    """, (session['id'],)).fetchall()
+    
+    if not rows:
+        return [{'id': None, 'session_id': session['id'], 'seq': 0, 'file_path': session['file_path'],
+                 'status': 'closed'}]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+class SegmentFiles:
+    """Opens the recording files of a session's segments on demand"""
+    
+    def __init__(self, db_conn: sqlite3.Connection, session: Dict[str, Any]):
+        self.paths = {segment['id']: segment['file_path']
+                      for segment in session_segments(db_conn, session)}
+        self.files: Dict[Optional[int], RecordingFile] = {}
+    
+    def get(self, segment_id: Optional[int]) -> RecordingFile:
+        """Recording file of a segment"""
+        f = self.files.get(segment_id)
+        if f is None:
+            f = self.files[segment_id] = RecordingFile(self.paths[segment_id])
+        return f
+    
+    def close(self):
+        """Close every opened file"""
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def expand_shards(db_conn: sqlite3.Connection, sessions: List[Dict[str, Any]],
+                  symbols: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Replace sharded sessions by the shard sessions holding their messages
+    
+    With a symbol filter only the shards the symbols hash to are kept.
+    Sessions reached more than once are returned once.
+    """
+    expanded: Dict[int, Dict[str, Any]] = {}
+    for session in sessions:
+        cursor = db_conn.execute("""
+            SELECT l.shard, l.shard_count, s.* FROM session_shards l
+            JOIN recording_sessions s ON s.id = l.shard_session_id
+            WHERE l.session_id = ?
+            ORDER BY l.shard
+        """, (session['id'],))
+        columns = [column[0] for column in cursor.description]
+        shards = [dict(zip(columns, row)) for row in cursor]
+        
+        if not shards:
+            expanded.setdefault(session['id'], session)
+            continue
+        
+        wanted = None
+        if symbols:
+            wanted = {symbol_shard(symbol.encode(), shards[0]['shard_count']) for symbol in symbols}
+        for shard in shards:
+            number = shard.pop('shard')
+            del shard['shard_count']
+            if wanted is None or number in wanted:
+                expanded.setdefault(shard['id'], shard)
+    
+    return list(expanded.values())
+
+
+def shard_session_ids(db_conn: sqlite3.Connection, session_id: int) -> List[int]:
+    """Shard sessions of a sharded session, empty for an ordinary session"""
+    return [row[0] for row in db_conn.execute(
+        "SELECT shard_session_id FROM session_shards WHERE session_id = ? ORDER BY shard", (session_id,))]
+
+
+def update_catalog(db_conn: sqlite3.Connection, session_id: int):
+    """
+    Refresh the catalog rows of a session
+    
+    Coverage comes from the session's minute rollups when it has them,
+    otherwise from its block index or message index. A sharded session
+    covers what its shard sessions recorded.
+    """
+    shards = shard_session_ids(db_conn, session_id)
+    if shards:
+        for shard in shards:
+            update_catalog(db_conn, shard)
+        placeholders = ','.join(['?' for _ in shards])
+        coverage = db_conn.execute(f"""
+            SELECT symbol, MIN(first_timestamp), MAX(last_timestamp), SUM(message_count)
+            FROM symbol_catalog
+            WHERE session_id IN ({placeholders})
+            GROUP BY symbol
+        """, shards).fetchall()
+    else:
+        coverage = _session_coverage(db_conn, session_id)
+    
+    db_conn.execute("DELETE FROM symbol_catalog WHERE session_id = ?", (session_id,))
+    db_conn.executemany("""
+        INSERT INTO symbol_catalog (session_id, symbol, first_timestamp, last_timestamp, message_count)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(session_id,) + tuple(row) for row in coverage])
+    
+    db_conn.execute("""
+        INSERT OR REPLACE INTO session_catalog
+            (session_id, first_timestamp, last_timestamp, message_count, symbol_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (session_id,
+          min((row[1] for row in coverage), default=None),
+          max((row[2] for row in coverage), default=None),
+          sum(row[3] for row in coverage),
+          len(coverage),
+          time.time()))
+    db_conn.commit()
+
+
+def _session_coverage(db_conn: sqlite3.Connection, session_id: int) -> List[Tuple]:
+    """Per-symbol (symbol, first, last, count) coverage of an ordinary session"""
+    coverage = db_conn.execute("""
+        SELECT symbol, MIN(first_timestamp), MAX(last_timestamp), SUM(message_count)
+        FROM rollups
+        WHERE session_id = ? AND resolution = 60
+        GROUP BY symbol
+    """, (session_id,)).fetchall()
+    
+    if not coverage:
+        summary: Dict[str, List] = {}
+        for block in query_blocks(db_conn, session_id):
+            for symbol, (count, first, last) in block['symbols'].items():
+                stats = summary.setdefault(symbol, [first, last, 0])
+                stats[0] = min(stats[0], first)
+                stats[1] = max(stats[1], last)
+                stats[2] += count
+        coverage = [(symbol, *stats) for symbol, stats in summary.items()]
+    
+    if not coverage:
+        coverage = db_conn.execute("""
+            SELECT symbol, MIN(timestamp), MAX(timestamp), COUNT(*)
+            FROM message_index
+            WHERE session_id = ?
+            GROUP BY symbol
+        """, (session_id,)).fetchall()
+    
+    return coverage
+
+
+def summarize_symbols(messages: List[MarketMessage]) -> Dict[str, List]:
+    """Per-symbol [count, first_timestamp, last_timestamp] for a block of messages"""
+    summary = {}
+    for msg in messages:
+        stats = summary.get(msg.symbol)
+        if stats is None:
+            summary[msg.symbol] = [1, msg.timestamp, msg.timestamp]
+        else:
+            stats[0] += 1
+            stats[1] = min(stats[1], msg.timestamp)
+            stats[2] = max(stats[2], msg.timestamp)
+    return summary
+
+
+ROLLUP_RESOLUTIONS = (1, 60)  # Seconds per rollup bucket
+
+ROLLUP_COLUMNS = ('message_count', 'first_timestamp', 'last_timestamp',
+                  'bid_open', 'bid_high', 'bid_low', 'bid_close',
+                  'ask_open', 'ask_high', 'ask_low', 'ask_close',
+                  'spread_min', 'spread_max')
+
+
+def _price(data: Any, field: str) -> Optional[float]:
+    """Numeric price field of a message payload, None if absent"""
+    value = data.get(field) if isinstance(data, dict) else None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _update_ohlc(values: List, start: int, price: Optional[float]):
+    """Fold a price into the open/high/low/close values at values[start:start + 4]"""
+    if price is None:
+        return
+    if values[start] is None:
+        values[start:start + 4] = [price] * 4
+    else:
+        values[start + 1] = max(values[start + 1], price)
+        values[start + 2] = min(values[start + 2], price)
+        values[start + 3] = price
+
+
+def rollup_messages(messages: Iterable[MarketMessage],
+                    resolutions: Tuple[int, ...] = ROLLUP_RESOLUTIONS) -> List[Tuple]:
+    """
+    Aggregate messages into per-symbol time bucket rollups
+    
+    RawMessage payloads are never decoded, so raw sessions only get counts
+    and timestamps.
+    
+    Returns:
+        Rows of (resolution, symbol, bucket start, *ROLLUP_COLUMNS); price
+        columns are None when no message in the bucket had a numeric bid/ask
+    """
+    rollups: Dict[Tuple, List] = {}
+    
+    for msg in messages:
+        data = None if isinstance(msg, RawMessage) else msg.data
+        bid = _price(data, 'bid')
+        ask = _price(data, 'ask')
+        spread = ask - bid if bid is not None and ask is not None else None
+        
+        for resolution in resolutions:
+            key = (resolution, msg.symbol, int(msg.timestamp // resolution) * resolution)
+            values = rollups.get(key)
+            
+            if values is None:
+                rollups[key] = [1, msg.timestamp, msg.timestamp,
+                                bid, bid, bid, bid, ask, ask, ask, ask, spread, spread]
+                continue
+            
+            values[0] += 1
+            values[1] = min(values[1], msg.timestamp)
+            values[2] = max(values[2], msg.timestamp)
+            _update_ohlc(values, 3, bid)
+            _update_ohlc(values, 7, ask)
+            if spread is not None:
+                values[11] = spread if values[11] is None else min(values[11], spread)
+                values[12] = spread if values[12] is None else max(values[12], spread)
+    
+    return [key + tuple(values) for key, values in rollups.items()]
+
+
+ROLLUP_UPSERT = """
+    INSERT INTO rollups (session_id, resolution, symbol, bucket, message_count,
+                         first_timestamp, last_timestamp,
+                         bid_open, bid_high, bid_low, bid_close,
+                         ask_open, ask_high, ask_low, ask_close,
+                         spread_min, spread_max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (session_id, resolution, symbol, bucket) DO UPDATE SET
+        message_count = message_count + excluded.message_count,
+        first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+        last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+        bid_open = COALESCE(bid_open, excluded.bid_open),
+        bid_high = MAX(COALESCE(bid_high, excluded.bid_high), COALESCE(excluded.bid_high, bid_high)),
+        bid_low = MIN(COALESCE(bid_low, excluded.bid_low), COALESCE(excluded.bid_low, bid_low)),
+        bid_close = COALESCE(excluded.bid_close, bid_close),
+        ask_open = COALESCE(ask_open, excluded.ask_open),
+        ask_high = MAX(COALESCE(ask_high, excluded.ask_high), COALESCE(excluded.ask_high, ask_high)),
+        ask_low = MIN(COALESCE(ask_low, excluded.ask_low), COALESCE(excluded.ask_low, ask_low)),
+        ask_close = COALESCE(excluded.ask_close, ask_close),
+        spread_min = MIN(COALESCE(spread_min, excluded.spread_min), COALESCE(excluded.spread_min, spread_min)),
+        spread_max = MAX(COALESCE(spread_max, excluded.spread_max), COALESCE(excluded.spread_max, spread_max))
+"""
+
+
+def store_rollups(cursor: sqlite3.Cursor, session_id: int, messages: List[MarketMessage]):
+    """Merge the rollups of messages into the stored buckets of a session"""
+    cursor.executemany(ROLLUP_UPSERT, [(session_id,) + row for row in rollup_messages(messages)])
+
+
+def decode_frame(timestamp: float, topic: bytes, payload: bytes,
+                 source: Optional[str] = None) -> MarketMessage:
+    """Build a MarketMessage from a received topic/payload frame pair"""
+    topic_str = topic.decode()
+    
+    return MarketMessage(
+        timestamp=timestamp,
+        topic=topic_str,
+        symbol=symbol_from_topic(topic_str),
+        data=json.loads(payload.decode()),
+        source=source
+    )
+
+
+# Received frame: (timestamp, topic, payload, source); source is None for single-feed recorders
+Frame = Tuple[float, bytes, bytes, Optional[str]]
+
+# Sent by a ShardedRecorder front to tell a shard that its feed has ended
+END_OF_FEED = b'END_OF_FEED'
+# Receive time the front adds to every frame it forwards to a shard
+FORWARD_TIMESTAMP = struct.Struct('<d')
+
+
+def feed_endpoints(zmq_address: Union[str, List[str], Dict[str, str]]) -> Dict[Optional[str], str]:
+    """Source name -> address of the feeds to record; a single feed is recorded untagged"""
+    if isinstance(zmq_address, str):
+        return {None: zmq_address}
+    if isinstance(zmq_address, dict):
+        return dict(zmq_address)
+    return {address: address for address in zmq_address}
+
+
+def symbol_shard(symbol: bytes, shard_count: int) -> int:
+    """Shard recording a symbol; stable across processes, unlike hash()"""
+    return zlib.crc32(symbol) % shard_count
+
+
+class RecordingWriter(threading.Thread):
+    """Writes buffered frames to block storage and the index on a dedicated thread"""
+    
+    def __init__(self, db_path: Path, session_id: int, file_path: Path,
+                 index_mode: IndexMode = IndexMode.FULL, raw: bool = False,
+                 block_size: int = 1024 * 1024, block_records: int = 1000,
+                 compression_level: int = 6, queue_size: int = 8,
+                 segment_size: Optional[int] = None, segment_duration: Optional[float] = None):
+        """
+        Initialize writer
+        
+        Args:
+            db_path: Path of the recordings database
+            session_id: Session the frames belong to
+            file_path: Recording file of the first segment
+            index_mode: FULL indexes every message, SPARSE only each block
+            raw: Store the original frames instead of decoded JSON messages
+            block_size: Maximum uncompressed bytes per block
+            block_records: Maximum messages per block
+            compression_level: zlib compression level
+            queue_size: Maximum number of buffers waiting to be written
+            segment_size: Start a new segment file once this many bytes are written
+            segment_duration: Start a new segment file after this many seconds
+        """
+        super().__init__(name=f"recording-writer-{session_id}", daemon=True)
+        self.db_path = db_path
+        self.session_id = session_id
+        self.file_path = Path(file_path)
+        self.index_mode = index_mode
+        self.raw = raw
+        self.block_size = block_size
+        self.block_records = block_records
+        self.compression_level = compression_level
+        self.segment_size = segment_size
+        self.segment_duration = segment_duration
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.logger = logging.getLogger(__name__)
+        
+        self.block_writer = self._create_block_writer(self.file_path)
+        self.db_conn = None
+        
+        # Current segment
+        self.segment_id: Optional[int] = None
+        self.segment_seq = 0
+        self.segment_started = time.time()
+        self.segment_messages = 0
+        self.segment_first_timestamp: Optional[float] = None
+        self.segment_last_timestamp: Optional[float] = None
+        
+        # Statistics
+        self.messages_written = 0
+        self.write_errors = 0
+        self.messages_failed = 0
+        self.messages_malformed = 0
+        self.last_write_error: Optional[str] = None
+        self.flush_count = 0
+        self.total_flush_latency = 0.0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+    
+    def submit(self, frames: List[Frame]) -> bool:
+        """Hand a full buffer to the writer without blocking, False if the queue is full"""
+        try:
+            self.queue.put_nowait(frames)
+            return True
+        except queue.Full:
+            return False
+    
+    def close(self):
+        """Write everything queued, then stop the thread"""
+        self.queue.put(None)
+        self.join()
+    
+    def _create_block_writer(self, path: Path) -> BlockWriter:
+        """Create the block file of a segment"""
+        return BlockWriter(
+            path,
+            compression_level=self.compression_level,
+            block_size=self.block_size,
+            block_records=self.block_records
+        )
+    
+    def segment_path(self, seq: int) -> Path:
+        """File of the segment with sequence number seq"""
+        if seq == 0:
+            return self.file_path
+        return self.file_path.with_name(f"{self.file_path.stem}.{seq:04d}{self.file_path.suffix}")
+    
+    def _open_segment(self):
+        """Register the current block file as the session's newest segment"""
+        cursor = self.db_conn.execute("""
+            INSERT INTO segments (session_id, seq, file_path, compression_level, status, created_at)
+            VALUES (?, ?, ?, ?, 'open', ?)
+        """, (self.session_id, self.segment_seq, str(self.block_writer.path),
+              self.compression_level, time.time()))
+        self.db_conn.commit()
+        
+        self.segment_id = cursor.lastrowid
+        self.segment_started = time.time()
+        self.segment_messages = 0
+        self.segment_first_timestamp = None
+        self.segment_last_timestamp = None
+    
+    def _close_segment(self):
+        """Finish the current block file and mark its segment closed"""
+        self.block_writer.close()
+        self.db_conn.execute("""
+            UPDATE segments SET status = 'closed', size_bytes = ? WHERE id = ?
+        """, (self.block_writer.path.stat().st_size, self.segment_id))
+        self.db_conn.commit()
+    
+    def _should_rotate(self) -> bool:
+        """Whether the current segment is full"""
+        if not self.segment_messages:
+            return False
+        if self.segment_size and self.block_writer.offset >= self.segment_size:
+            return True
+        return bool(self.segment_duration) and time.time() - self.segment_started >= self.segment_duration
+    
+    def _rotate(self):
+        """Close the current segment and continue in a new file"""
+        self._close_segment()
+        self.segment_seq += 1
+        self.block_writer = self._create_block_writer(self.segment_path(self.segment_seq))
+        self._open_segment()
+        self.logger.info(f"Rotated to segment {self.segment_seq}: {self.block_writer.path}")
+    
+    def run(self):
+        """Writer loop"""
+        self.db_conn = sqlite3.connect(str(self.db_path))
+        self._open_segment()
+        
+        try:
+            while True:
+                frames = self.queue.get()
+                if frames is None:
+                    break
+                
+                started = time.perf_counter()
+                try:
+                    self._write_frames(frames)
+                except Exception as e:
+                    # Discard the index rows of the failed buffer so the
+                    # next commit cannot serve messages the session does not count
+                    self.db_conn.rollback()
+                    self.write_errors += 1
+                    self.messages_failed += len(frames)
+                    self.last_write_error = str(e)
+                    self.logger.error(f"Failed to write {len(frames)} messages: {e}")
+                
+                latency = time.perf_counter() - started
+                self.flush_count += 1
+                self.total_flush_latency += latency
+                self.last_flush_latency = latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+        finally:
+            self._close_segment()
+            self.db_conn.close()
+    
+    def _write_frames(self, frames: List[Frame]):
+        """Compress a buffer of frames into blocks and index them"""
+        if self._should_rotate():
+            self._rotate()
+        
+        malformed = 0
+        if self.raw:
+            # Payloads are stored verbatim; only the topic is decoded
+            messages = [RawMessage.from_frame(*frame) for frame in frames]
+            if frames[0][3] is None:
+                records = [pack_raw_record(*frame[:3]) for frame in frames]
+                record_format = RECORD_RAW
+            else:
+                records = [pack_source_record(timestamp, source.encode(), topic, payload)
+                           for timestamp, topic, payload, source in frames]
+                record_format = RECORD_RAW_SOURCE
+        else:
+            # A frame that is not JSON is skipped without losing the rest of the buffer
+            messages = []
+            for frame in frames:
+                try:
+                    messages.append(decode_frame(*frame))
+                except ValueError as e:
+                    malformed += 1
+                    self.logger.debug(f"Skipping malformed frame on {frame[1]!r}: {e}")
+            records = [msg.to_json().encode() for msg in messages]
+            record_format = RECORD_JSONL
+        
+        if not messages:
+            self.messages_malformed += malformed
+            return
+        
+        # Compress messages into blocks
+        timestamps = [msg.timestamp for msg in messages]
+        blocks = self.block_writer.write_records(records, timestamps, record_format)
+        
+        # One summary row per block; FULL mode also indexes each message
+        # by block offset and position within the block
+        block_rows = []
+        message_rows = []
+        start = 0
+        for block in blocks:
+            block_messages = messages[start:start + block.message_count]
+            start += block.message_count
+            
+            block_rows.append((self.session_id, self.segment_id, block.offset, block.first_timestamp,
+                               block.last_timestamp, block.message_count,
+                               json.dumps(summarize_symbols(block_messages))))
+            
+            if self.index_mode == IndexMode.FULL:
+                for record_index, msg in enumerate(block_messages):
+                    message_rows.append((self.session_id, self.segment_id, msg.timestamp, msg.topic,
+                                         msg.symbol, block.offset, record_index))
+        
+        cursor = self.db_conn.cursor()
+        cursor.executemany("""
+            INSERT INTO block_index (session_id, segment_id, file_offset, first_timestamp,
+                                     last_timestamp, message_count, symbols)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, block_rows)
+        
+        if message_rows:
+            cursor.executemany("""
+                INSERT INTO message_index (session_id, segment_id, timestamp, topic, symbol,
+                                           file_offset, record_index)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, message_rows)
+        
+        # Merge into the rollups of buckets already started by earlier flushes
+        store_rollups(cursor, self.session_id, messages)
+        
+        # Counters only advance once the transaction is committed
+        messages_written = self.messages_written + len(messages)
+        segment_messages = self.segment_messages + len(messages)
+        first_timestamp = self.segment_first_timestamp
+        last_timestamp = self.segment_last_timestamp
+        if blocks:
+            if first_timestamp is None:
+                first_timestamp = blocks[0].first_timestamp
+            last_timestamp = blocks[-1].last_timestamp
+        
+        # Update segment record
+        cursor.execute("""
+            UPDATE segments
+            SET first_timestamp = ?, last_timestamp = ?, message_count = ?, size_bytes = ?
+            WHERE id = ?
+        """, (first_timestamp, last_timestamp, segment_messages,
+              self.block_writer.offset, self.segment_id))
+        
+        # Update session record
+        cursor.execute("""
+            UPDATE recording_sessions 
+            SET message_count = ? 
+            WHERE id = ?
+        """, (messages_written, self.session_id))
+        
+        self.db_conn.commit()
+        self.block_writer.flush()
+        
+        self.messages_written = messages_written
+        self.messages_malformed += malformed
+        self.segment_messages = segment_messages
+        self.segment_first_timestamp = first_timestamp
+        self.segment_last_timestamp = last_timestamp
+        
+        self.logger.debug(f"Flushed {len(messages)} messages in {len(blocks)} blocks")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get writer statistics"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'messages_written': self.messages_written,
+            'write_errors': self.write_errors,
+            'messages_failed': self.messages_failed,
+            'messages_malformed': self.messages_malformed,
+            'last_write_error': self.last_write_error,
+            'flush_count': self.flush_count,
+            'last_flush_latency_ms': self.last_flush_latency * 1000,
+            'avg_flush_latency_ms': self.total_flush_latency / self.flush_count * 1000 if self.flush_count else 0,
+            'max_flush_latency_ms': self.max_flush_latency * 1000,
+            'segments': self.segment_seq + 1
+        }
+
+
 class MessageRecorder:
     """Records market data messages to storage"""
     
-    def __init__(self, storage_path: str, zmq_address: str = "tcp://localhost:5556"):
+    def __init__(self, storage_path: str,
+                 zmq_address: Union[str, List[str], Dict[str, str]] = "tcp://localhost:5556",
+                 index_mode: IndexMode = IndexMode.FULL, raw: bool = False):
         """
         Initialize recorder
         
         Args:
             storage_path: Path to storage directory
-            zmq_address: ZeroMQ publisher address
+            zmq_address: ZeroMQ publisher address, a list of addresses, or a
+                dict of source name to address; messages from several feeds
+                are tagged with their source name (or address)
+            index_mode: FULL indexes every message, SPARSE only each block
+            raw: Store the original topic and payload bytes without JSON decoding
         """
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
         self.zmq_address = zmq_address
+        self.index_mode = index_mode
+        self.raw = raw
+        
+        self.endpoints = feed_endpoints(zmq_address)
         
         self.context = zmq.asyncio.Context()
-        self.socket = None
+        self.socket_type = zmq.SUB  # PULL when fed by a ShardedRecorder front
+        self.forwarded = False  # Set by _shard_worker; frames come from a ShardedRecorder front
+        self.sockets: Dict[Optional[str], zmq.asyncio.Socket] = {}
+        self.running = False
         self.db_conn = None
         self.current_file = None
-        self.file_handle = None
+        self.session_id = None
+        self.writer: Optional[RecordingWriter] = None
         self.message_count = 0
         self.start_time = None
         self.logger = logging.getLogger(__name__)
         
-        # Buffer for batch writing
-        self.buffer = []
+        # Buffer of raw (timestamp, topic, payload) frames for batch writing
+        self.buffer: List[Frame] = []
         self.buffer_size = 1000
         self.last_flush = time.time()
         self.flush_interval = 5  # seconds
+        
+        # Writer queue; frames beyond max_pending_messages are dropped
+        # while the writer thread is behind
+        self.queue_size = 8
+        self.max_pending_messages = self.buffer_size * 50
+        self.messages_received = 0
+        self.backpressure_events = 0
+        self.dropped_messages = 0
+        self.write_errors = 0
+        self.messages_failed = 0
+        self.messages_malformed = 0
+        
+        # Block storage settings
+        self.block_size = 1024 * 1024  # uncompressed bytes per block
+        self.compression_level = 6
+        self.segment_size: Optional[int] = 256 * 1024 * 1024  # bytes per segment file
+        self.segment_duration: Optional[float] = 3600  # seconds per segment file
     
     async def start(self):
         """Start recording"""
-        # Connect to ZeroMQ
-        self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect(self.zmq_address)
-        self.socket.subscribe(b"")  # Subscribe to all topics
+        # Connect to every ZeroMQ publisher
+        for source, address in self.endpoints.items():
+            socket = self.context.socket(self.socket_type)
+            socket.connect(address)
+            if self.socket_type == zmq.SUB:
+                socket.subscribe(b"")  # Subscribe to all topics
+            self.sockets[source] = socket
         
         # Initialize database
         self._init_database()
         
         # Create new recording session
-        self.start_time = time.time()
-        session_name = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create data file
-        self.current_file = self.storage_path / f"recording_{session_name}.jsonl.gz"
-        self.file_handle = gzip.open(self.current_file, 'wt')
-        
-        # Insert session record
-        cursor = self.db_conn.cursor()
-        cursor.execute("""
-            INSERT INTO recording_sessions (name, start_time, file_path, status)
-            VALUES (?, ?, ?, 'recording')
-        """, (session_name, self.start_time, str(self.current_file)))
-        self.db_conn.commit()
-        self.session_id = cursor.lastrowid
-        
-        self.logger.info(f"Started recording session: {session_name}")
+        self._open_session()
         
         # Start recording loop
         await self._recording_loop()
@@ -115,62 +1043,88 @@ class MessageRecorder:
         """Initialize SQLite database for indexing"""
         db_path = self.storage_path / "recordings.db"
         self.db_conn = sqlite3.connect(str(db_path))
+        init_database(self.db_conn)
+    
+    def _open_session(self):
+        """Create the session record and data file unless preassigned, and start the writer thread"""
+        if self.session_id is None:
+            self._create_session()
+        
+        self.writer = RecordingWriter(
+            self.storage_path / "recordings.db",
+            self.session_id,
+            self.current_file,
+            index_mode=self.index_mode,
+            raw=self.raw,
+            block_size=self.block_size,
+            block_records=self.buffer_size,
+            compression_level=self.compression_level,
+            queue_size=self.queue_size,
+            segment_size=self.segment_size,
+            segment_duration=self.segment_duration
+        )
+        self.writer.start()
+        
+        self.logger.info(f"Started recording session {self.session_id}: {self.current_file.name}")
+    
+    def _create_session(self):
+        """Insert the session record and choose its data file"""
+        self.start_time = time.time()
+        session_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.current_file = self.storage_path / f"recording_{session_name}.mtrb"
+        suffix = 1
+        while self.current_file.exists():
+            suffix += 1
+            self.current_file = self.storage_path / f"recording_{session_name}_{suffix}.mtrb"
         
-        # Create tables
-        self.db_conn.executescript("""
-            CREATE TABLE IF NOT EXISTS recording_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                start_time REAL NOT NULL,
-                end_time REAL,
-                file_path TEXT NOT NULL,
-                message_count INTEGER DEFAULT 0,
-                status TEXT DEFAULT 'recording',
-                metadata TEXT
-            );
-            
-            CREATE TABLE IF NOT EXISTS message_index (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL,
-                timestamp REAL NOT NULL,
-                topic TEXT NOT NULL,
-                symbol TEXT NOT NULL,
-                file_offset INTEGER NOT NULL,
-                FOREIGN KEY (session_id) REFERENCES recording_sessions(id)
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_timestamp ON message_index(timestamp);
-            CREATE INDEX IF NOT EXISTS idx_symbol ON message_index(symbol);
-            CREATE INDEX IF NOT EXISTS idx_session_symbol ON message_index(session_id, symbol);
-        """)
+        # Insert session record
+        cursor = self.db_conn.cursor()
+        metadata = {'index_mode': self.index_mode.value, 'raw': self.raw}
+        if None not in self.endpoints:
+            metadata['sources'] = self.endpoints
+        metadata = json.dumps(metadata)
+        cursor.execute("""
+            INSERT INTO recording_sessions (name, start_time, file_path, status, metadata)
+            VALUES (?, ?, ?, 'recording', ?)
+        """, (session_name, self.start_time, str(self.current_file), metadata))
         self.db_conn.commit()
+        self.session_id = cursor.lastrowid
     
     async def _recording_loop(self):
         """Main recording loop"""
+        poller = zmq.asyncio.Poller()
+        sources = {}
+        for source, socket in self.sockets.items():
+            poller.register(socket, zmq.POLLIN)
+            sources[socket] = source
+        
+        self.running = True
         try:
-            while True:
-                # Receive message
-                topic, message = await self.socket.recv_multipart()
-                
-                # Parse message
-                topic_str = topic.decode()
-                data = json.loads(message.decode())
-                
-                # Extract symbol from topic
-                symbol = ""
-                if topic_str.startswith("tick."):
-                    symbol = topic_str[5:]
-                
-                # Create message object
-                msg = MarketMessage(
-                    timestamp=time.time(),
-                    topic=topic_str,
-                    symbol=symbol,
-                    data=data
-                )
-                
-                # Add to buffer
-                self.buffer.append(msg)
+            while self.running:
+                # Drain every feed with messages waiting, at most a buffer
+                # per feed so a busy one cannot starve the others
+                for socket, _event in await poller.poll(self.flush_interval * 1000):
+                    source = sources[socket]
+                    for _ in range(self.buffer_size):
+                        try:
+                            parts = await socket.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        
+                        if not self.forwarded:
+                            if len(parts) == 2:
+                                self._append_frame(time.time(), parts[0], parts[1], source)
+                            else:
+                                self.messages_malformed += 1
+                        elif parts == [END_OF_FEED]:
+                            self.running = False
+                            break
+                        elif len(parts) in (3, 4) and len(parts[2]) == FORWARD_TIMESTAMP.size:
+                            # Forwarded by a ShardedRecorder front with its receive time and source
+                            self._append_frame(FORWARD_TIMESTAMP.unpack(parts[2])[0], parts[0], parts[1],
+                                               parts[3].decode() if len(parts) > 3 else None)
+                        else:
+                            self.messages_malformed += 1
                 
                 # Flush if needed
                 if len(self.buffer) >= self.buffer_size or \
@@ -182,48 +1136,65 @@ class MessageRecorder:
         finally:
             await self.stop()
     
+    def _append_frame(self, timestamp: float, topic: bytes, payload: bytes,
+                      source: Optional[str] = None):
+        """Buffer a received frame, dropping it if the writer is too far behind"""
+        self.messages_received += 1
+        
+        if len(self.buffer) >= self.max_pending_messages:
+            self.dropped_messages += 1
+            if self.dropped_messages % 1000 == 1:
+                self.logger.warning(f"Writer is behind, dropped {self.dropped_messages} messages")
+            return
+        
+        self.buffer.append((timestamp, topic, payload, source))
+    
     async def _flush_buffer(self):
-        """Flush buffer to disk"""
+        """Hand the buffer to the writer thread"""
         if not self.buffer:
             return
         
-        # Get file position before writing
-        file_pos = self.file_handle.tell()
-        
-        # Write messages
-        cursor = self.db_conn.cursor()
-        
-        for msg in self.buffer:
-            # Write to file
-            self.file_handle.write(msg.to_json() + '\n')
-            
-            # Index in database
-            cursor.execute("""
-                INSERT INTO message_index (session_id, timestamp, topic, symbol, file_offset)
-                VALUES (?, ?, ?, ?, ?)
-            """, (self.session_id, msg.timestamp, msg.topic, msg.symbol, file_pos))
-            
-            file_pos = self.file_handle.tell()
-            self.message_count += 1
-        
-        # Update session record
-        cursor.execute("""
-            UPDATE recording_sessions 
-            SET message_count = ? 
-            WHERE id = ?
-        """, (self.message_count, self.session_id))
+        if self.writer.submit(self.buffer):
+            self.buffer = []
+            self.last_flush = time.time()
+        else:
+            # Keep accumulating until the writer has room
+            self.backpressure_events += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get recorder statistics"""
+        stats = {
+            'messages_received': self.messages_received,
+            'buffered_messages': len(self.buffer),
+            'backpressure_events': self.backpressure_events,
+            'dropped_messages': self.dropped_messages,
+            'write_errors': self.write_errors,
+            'messages_failed': self.messages_failed,
+            'messages_malformed': self.messages_malformed,
+            'queue_size': self.queue_size
+        }
         
-        self.db_conn.commit()
-        self.file_handle.flush()
+        if self.writer:
+            stats.update(self.writer.get_stats())
+            # Frames skipped on receive add to those the writer could not decode
+            stats['messages_malformed'] += self.messages_malformed
         
-        self.logger.debug(f"Flushed {len(self.buffer)} messages to disk")
-        self.buffer.clear()
-        self.last_flush = time.time()
+        return stats
     
     async def stop(self):
         """Stop recording"""
-        # Flush remaining messages
-        await self._flush_buffer()
+        # Hand over remaining messages and wait for the writer to finish
+        if self.writer:
+            if self.buffer:
+                await asyncio.to_thread(self.writer.queue.put, self.buffer)
+                self.buffer = []
+            
+            await asyncio.to_thread(self.writer.close)
+            self.message_count = self.writer.messages_written
+            self.write_errors = self.writer.write_errors
+            self.messages_failed = self.writer.messages_failed
+            self.messages_malformed += self.writer.messages_malformed
+            self.writer = None
         
         # Update session record
         if self.db_conn and self.session_id:
@@ -233,21 +1204,1452 @@ class MessageRecorder:
                 SET end_time = ?, status = 'completed'
                 WHERE id = ?
             """, (time.time(), self.session_id))
+            if self.write_errors or self.messages_malformed:
+                # Buffers that failed to write and frames that could not be
+                # decoded are missing from the session
+                row = cursor.execute("SELECT metadata FROM recording_sessions WHERE id = ?",
+                                     (self.session_id,)).fetchone()
+                metadata = json.loads(row[0]) if row and row[0] else {}
+                if self.write_errors:
+                    metadata.update(write_errors=self.write_errors, messages_failed=self.messages_failed)
+                    self.logger.warning(f"Session {self.session_id} lost {self.messages_failed} messages "
+                                        f"in {self.write_errors} failed writes")
+                if self.messages_malformed:
+                    metadata.update(messages_malformed=self.messages_malformed)
+                    self.logger.warning(f"Session {self.session_id} skipped "
+                                        f"{self.messages_malformed} malformed messages")
+                cursor.execute("UPDATE recording_sessions SET metadata = ? WHERE id = ?",
+                               (json.dumps(metadata), self.session_id))
             self.db_conn.commit()
+            update_catalog(self.db_conn, self.session_id)
         
         # Close resources
-        if self.file_handle:
-            self.file_handle.close()
-        
-        if self.socket:
-            self.socket.close()
+        for socket in self.sockets.values():
+            socket.close()
+        self.sockets = {}
         
         if self.db_conn:
             self.db_conn.close()
         
         self.context.term()
         
-        self.logger.info(f"Recording stopped. Total messages: {self.message_count}")
+        self.logger.info(f"Recording stopped. Total messages: {self.message_count}")
+
+
+class ShardedRecorder:
+    """
+    Records high-rate feeds across processes, sharded by symbol
+    
+    A thin front receives the feeds and forwards every frame with its
+    receive time to the shard owning its symbol. Each shard is a
+    MessageRecorder in its own process that decodes, compresses and
+    indexes its own session and segment files. The session_shards table
+    maps the front's session to the shard sessions, which readers merge
+    back into a single feed.
+    """
+    
+    def __init__(self, storage_path: str,
+                 zmq_address: Union[str, List[str], Dict[str, str]] = "tcp://localhost:5556",
+                 shards: int = 4, index_mode: IndexMode = IndexMode.FULL, raw: bool = False):
+        """
+        Initialize recorder
+        
+        Args:
+            storage_path: Path to storage directory
+            zmq_address: Publisher address(es), as for MessageRecorder
+            shards: Number of shard processes
+            index_mode: FULL indexes every message, SPARSE only each block
+            raw: Store the original topic and payload bytes without JSON decoding
+        """
+        self.storage_path = Path(storage_path)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.endpoints = feed_endpoints(zmq_address)
+        self.shard_count = shards
+        self.index_mode = index_mode
+        self.raw = raw
+        
+        self.context = zmq.asyncio.Context()
+        self.sockets: Dict[Optional[str], zmq.asyncio.Socket] = {}
+        self.pushers: List[zmq.asyncio.Socket] = []
+        self.push_sockets: List[zmq.Socket] = []  # Synchronous shadows of pushers
+        self.processes: List[multiprocessing.Process] = []
+        self.db_conn = None
+        self.session_id = None
+        self.shard_sessions: List[int] = []
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+        
+        self.settings: Dict[str, Any] = {}  # MessageRecorder attributes set in every shard
+        self.send_hwm = 100000  # Frames queued per shard before the front waits
+        self.drain_size = 1000  # Frames read from one feed before polling the others
+        
+        # Statistics
+        self.messages_received = 0
+        self.messages_routed = [0] * shards
+        self.messages_malformed = 0
+        self.hwm_waits = 0
+    
+    async def start(self):
+        """Start the shard processes and route the feeds to them"""
+        for source, address in self.endpoints.items():
+            socket = self.context.socket(zmq.SUB)
+            socket.connect(address)
+            socket.subscribe(b"")
+            self.sockets[source] = socket
+        
+        self._open_session()
+        await self._routing_loop()
+    
+    def _open_session(self):
+        """Create the session and its shard sessions, then start a process per shard"""
+        self.db_conn = sqlite3.connect(str(self.storage_path / "recordings.db"))
+        init_database(self.db_conn)
+        
+        start_time = time.time()
+        session_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = f"recording_{session_name}"
+        suffix = 1
+        while list(self.storage_path.glob(f"{base}.*")):
+            suffix += 1
+            base = f"recording_{session_name}_{suffix}"
+        
+        metadata = {'index_mode': self.index_mode.value, 'raw': self.raw}
+        if None not in self.endpoints:
+            metadata['sources'] = self.endpoints
+        
+        # The front session holds no data itself; its file path is never created
+        cursor = self.db_conn.cursor()
+        cursor.execute("""
+            INSERT INTO recording_sessions (name, start_time, file_path, status, metadata)
+            VALUES (?, ?, ?, 'recording', ?)
+        """, (session_name, start_time, str(self.storage_path / f"{base}.mtrb"),
+              json.dumps(dict(metadata, shards=self.shard_count))))
+        self.session_id = cursor.lastrowid
+        
+        files = []
+        for shard in range(self.shard_count):
+            file_path = self.storage_path / f"{base}.shard{shard:02d}.mtrb"
+            cursor.execute("""
+                INSERT INTO recording_sessions (name, start_time, file_path, status, metadata)
+                VALUES (?, ?, ?, 'recording', ?)
+            """, (f"{session_name}.shard{shard:02d}", start_time, str(file_path),
+                  json.dumps(dict(metadata, shard=shard, parent=self.session_id))))
+            self.shard_sessions.append(cursor.lastrowid)
+            files.append(file_path)
+        
+        cursor.executemany("""
+            INSERT INTO session_shards (session_id, shard, shard_count, shard_session_id)
+            VALUES (?, ?, ?, ?)
+        """, [(self.session_id, shard, self.shard_count, shard_session)
+              for shard, shard_session in enumerate(self.shard_sessions)])
+        self.db_conn.commit()
+        
+        # Spawn rather than fork so shards do not inherit the front's ZeroMQ context and event loop
+        spawn = multiprocessing.get_context('spawn')
+        for shard, (shard_session, file_path) in enumerate(zip(self.shard_sessions, files)):
+            pusher = self.context.socket(zmq.PUSH)
+            pusher.setsockopt(zmq.SNDHWM, self.send_hwm)
+            port = pusher.bind_to_random_port('tcp://127.0.0.1')
+            self.pushers.append(pusher)
+            self.push_sockets.append(zmq.Socket.shadow(pusher.underlying))
+            
+            process = spawn.Process(
+                target=_shard_worker,
+                args=(str(self.storage_path), f"tcp://127.0.0.1:{port}", shard_session, str(file_path),
+                      self.index_mode.value, self.raw, self.settings),
+                name=f"recording-shard-{shard}",
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        
+        self.logger.info(f"Started sharded recording session {session_name} with {self.shard_count} shards")
+    
+    async def _routing_loop(self):
+        """Forward every received frame to the shard owning its symbol"""
+        poller = zmq.asyncio.Poller()
+        tags = {}
+        for source, socket in self.sockets.items():
+            poller.register(socket, zmq.POLLIN)
+            tags[socket] = [source.encode()] if source is not None else []
+        
+        self.running = True
+        try:
+            while self.running:
+                for socket, _event in await poller.poll(1000):
+                    tag = tags[socket]
+                    for _ in range(self.drain_size):
+                        try:
+                            parts = await socket.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        
+                        if len(parts) != 2:
+                            self.messages_malformed += 1
+                            continue
+                        
+                        topic, payload = parts
+                        self.messages_received += 1
+                        shard = symbol_shard(topic[5:] if topic.startswith(b'tick.') else b'',
+                                             self.shard_count)
+                        self.messages_routed[shard] += 1
+                        await self._forward(shard, [topic, payload, FORWARD_TIMESTAMP.pack(time.time())] + tag)
+        
+        except Exception as e:
+            self.logger.error(f"Routing error: {e}")
+        finally:
+            await self.stop()
+    
+    async def _forward(self, shard: int, frames: List[bytes]):
+        """Send frames to a shard, waiting while its queue is at the HWM"""
+        while True:
+            try:
+                self.push_sockets[shard].send_multipart(frames, zmq.NOBLOCK)
+                return
+            except zmq.Again:
+                self.hwm_waits += 1
+                await asyncio.sleep(0.001)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get recorder statistics"""
+        return {
+            'messages_received': self.messages_received,
+            'messages_routed': list(self.messages_routed),
+            'messages_malformed': self.messages_malformed,
+            'hwm_waits': self.hwm_waits,
+            'shards_alive': sum(1 for process in self.processes if process.is_alive())
+        }
+    
+    async def stop(self):
+        """Stop routing, wait for every shard to write its queue, then close the session"""
+        self.running = False
+        if not self.pushers:
+            return
+        
+        # Shards stop after the frames queued ahead of the marker
+        for shard in range(self.shard_count):
+            await self._forward(shard, [END_OF_FEED])
+        for process in self.processes:
+            await asyncio.to_thread(process.join)
+            if process.exitcode:
+                self.logger.error(f"{process.name} exited with code {process.exitcode}")
+        
+        for socket in list(self.sockets.values()) + self.pushers:
+            socket.close()
+        self.sockets = {}
+        self.pushers = []
+        self.push_sockets = []
+        
+        if self.db_conn and self.session_id:
+            placeholders = ','.join(['?' for _ in self.shard_sessions])
+            message_count = self.db_conn.execute(f"""
+                SELECT COALESCE(SUM(message_count), 0) FROM recording_sessions WHERE id IN ({placeholders})
+            """, self.shard_sessions).fetchone()[0]
+            self.db_conn.execute("""
+                UPDATE recording_sessions
+                SET end_time = ?, message_count = ?, status = 'completed'
+                WHERE id = ?
+            """, (time.time(), message_count, self.session_id))
+            if self.messages_malformed:
+                row = self.db_conn.execute("SELECT metadata FROM recording_sessions WHERE id = ?",
+                                           (self.session_id,)).fetchone()
+                metadata = dict(json.loads(row[0]), messages_malformed=self.messages_malformed)
+                self.db_conn.execute("UPDATE recording_sessions SET metadata = ? WHERE id = ?",
+                                     (json.dumps(metadata), self.session_id))
+                self.logger.warning(f"Session {self.session_id} skipped "
+                                    f"{self.messages_malformed} malformed messages")
+            self.db_conn.commit()
+            update_catalog(self.db_conn, self.session_id)
+            self.db_conn.close()
+            self.db_conn = None
+        
+        self.context.term()
+        self.logger.info(f"Sharded recording stopped. Total messages: {self.messages_received}")
+
+
+class SegmentCompactor:
+    """Merges, recompresses and downsamples the closed segments of recordings"""
+    
+    def __init__(self, storage_path: str):
+        """
+        Initialize compactor
+        
+        Args:
+            storage_path: Path to storage directory
+        """
+        self.storage_path = Path(storage_path)
+        self.db_conn = None
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+        
+        # Consecutive segments smaller than min_segment_size are merged
+        # into files of up to target_segment_size
+        self.min_segment_size = 16 * 1024 * 1024
+        self.target_segment_size = 256 * 1024 * 1024
+        
+        # Segments whose last message is older than cold_after seconds
+        # are recompressed at cold_compression_level
+        self.cold_after: Optional[float] = 24 * 3600
+        self.cold_compression_level = 9
+        
+        # Segments older than downsample_after seconds keep only their rollups
+        self.downsample_after: Optional[float] = None
+    
+    async def run(self, interval: float = 3600):
+        """Compact periodically without blocking the event loop"""
+        self.running = True
+        while self.running:
+            try:
+                stats = await asyncio.to_thread(self.compact)
+                if any(stats.values()):
+                    self.logger.info(f"Compaction finished: {stats}")
+            except Exception as e:
+                self.logger.error(f"Compaction error: {e}")
+            await asyncio.sleep(interval)
+    
+    def stop(self):
+        """Stop periodic compaction after the current pass"""
+        self.running = False
+    
+    def compact(self) -> Dict[str, int]:
+        """Run one compaction pass over every session"""
+        stats = {'merged': 0, 'recompressed': 0, 'downsampled': 0}
+        
+        self.db_conn = sqlite3.connect(str(self.storage_path / "recordings.db"))
+        self.db_conn.row_factory = sqlite3.Row
+        try:
+            init_database(self.db_conn)
+            sessions = [dict(row) for row in self.db_conn.execute("SELECT * FROM recording_sessions")]
+            for session in sessions:
+                changed = self._compact_session(session, stats)
+                if changed:
+                    update_catalog(self.db_conn, session['id'])
+        finally:
+            self.db_conn.close()
+            self.db_conn = None
+        
+        return stats
+    
+    def _compact_session(self, session: Dict[str, Any], stats: Dict[str, int]) -> bool:
+        """Compact the closed segments of a session, True if any changed"""
+        now = time.time()
+        changed = False
+        
+        def closed_segments() -> List[Dict[str, Any]]:
+            return [segment for segment in session_segments(self.db_conn, session)
+                    if segment['id'] is not None and segment['status'] == 'closed']
+        
+        if self.downsample_after is not None:
+            for segment in closed_segments():
+                if segment['last_timestamp'] is not None and \
+                   segment['last_timestamp'] < now - self.downsample_after:
+                    self._downsample(session, segment)
+                    stats['downsampled'] += 1
+                    changed = True
+        
+        for run in self._merge_runs(session_segments(self.db_conn, session)):
+            level = max(segment['compression_level'] or 0 for segment in run)
+            self._rewrite(session, run, level)
+            stats['merged'] += len(run)
+            changed = True
+        
+        if self.cold_after is not None:
+            for segment in closed_segments():
+                if segment['last_timestamp'] is not None and \
+                   segment['last_timestamp'] < now - self.cold_after and \
+                   (segment['compression_level'] or 0) < self.cold_compression_level:
+                    self._rewrite(session, [segment], self.cold_compression_level)
+                    stats['recompressed'] += 1
+                    changed = True
+        
+        return changed
+    
+    def _merge_runs(self, segments: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Groups of two or more consecutive small closed segments"""
+        runs = []
+        run: List[Dict[str, Any]] = []
+        size = 0
+        
+        for segment in segments:
+            small = segment['id'] is not None and segment['status'] == 'closed' and \
+                (segment['size_bytes'] or 0) < self.min_segment_size
+            if not small or size + (segment['size_bytes'] or 0) > self.target_segment_size:
+                if len(run) > 1:
+                    runs.append(run)
+                run, size = [], 0
+                if not small:
+                    continue
+            run.append(segment)
+            size += segment['size_bytes'] or 0
+        
+        if len(run) > 1:
+            runs.append(run)
+        return runs
+    
+    def _segment_blocks(self, segment: Dict[str, Any]) -> List[Tuple[int, float, float]]:
+        """(file_offset, first_timestamp, last_timestamp) of a segment's blocks in file order"""
+        return self.db_conn.execute("""
+            SELECT file_offset, first_timestamp, last_timestamp FROM block_index
+            WHERE session_id = ? AND segment_id = ?
+            ORDER BY file_offset
+        """, (segment['session_id'], segment['id'])).fetchall()
+    
+    def _rewrite(self, session: Dict[str, Any], segments: List[Dict[str, Any]], compression_level: int):
+        """
+        Copy the blocks of segments into one new file and swap it in
+        
+        Blocks keep their records and order, so index rows only need their
+        segment and file offset moved. The index switches to the new file in
+        a single transaction; the old files are deleted after it commits.
+        """
+        first = segments[0]
+        session_file = Path(session['file_path'])
+        path = session_file.with_name(
+            f"{session_file.stem}.{first['seq']:04d}.{int(time.time() * 1000)}{session_file.suffix}")
+        
+        writer = BlockWriter(path, compression_level=compression_level)
+        moves = []
+        try:
+            for segment in segments:
+                with RecordingFile(segment['file_path']) as f:
+                    for offset, first_timestamp, last_timestamp in self._segment_blocks(segment):
+                        record_format, records = f.block_reader.read_block_records(offset)
+                        info = writer.append_block(records, first_timestamp, last_timestamp, record_format)
+                        moves.append((segment['id'], offset, info.offset, first_timestamp, last_timestamp))
+        finally:
+            writer.close()
+        
+        try:
+            cursor = self.db_conn.execute("""
+                INSERT INTO segments (session_id, seq, file_path, first_timestamp, last_timestamp,
+                                      message_count, size_bytes, compression_level, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'closed', ?)
+            """, (session['id'], first['seq'], str(path),
+                  min((segment['first_timestamp'] for segment in segments
+                       if segment['first_timestamp'] is not None), default=None),
+                  max((segment['last_timestamp'] for segment in segments
+                       if segment['last_timestamp'] is not None), default=None),
+                  sum(segment['message_count'] or 0 for segment in segments),
+                  path.stat().st_size, compression_level, time.time()))
+            segment_id = cursor.lastrowid
+            
+            # The time bounds let both updates use the session/time indexes
+            self.db_conn.executemany("""
+                UPDATE block_index SET segment_id = ?, file_offset = ?
+                WHERE session_id = ? AND first_timestamp = ? AND segment_id = ? AND file_offset = ?
+            """, [(segment_id, new_offset, session['id'], first_timestamp, old_segment, old_offset)
+                  for old_segment, old_offset, new_offset, first_timestamp, _last in moves])
+            self.db_conn.executemany("""
+                UPDATE message_index SET segment_id = ?, file_offset = ?
+                WHERE session_id = ? AND timestamp BETWEEN ? AND ? AND segment_id = ? AND file_offset = ?
+            """, [(segment_id, new_offset, session['id'], first_timestamp, last_timestamp,
+                   old_segment, old_offset)
+                  for old_segment, old_offset, new_offset, first_timestamp, last_timestamp in moves])
+            
+            self.db_conn.executemany("DELETE FROM segments WHERE id = ?",
+                                     [(segment['id'],) for segment in segments])
+            self.db_conn.commit()
+        except Exception:
+            self.db_conn.rollback()
+            path.unlink(missing_ok=True)
+            raise
+        
+        for segment in segments:
+            Path(segment['file_path']).unlink(missing_ok=True)
+        
+        self.logger.info(f"Rewrote {len(segments)} segment(s) of session {session['id']} "
+                         f"into {path.name} at level {compression_level}")
+    
+    def _downsample(self, session: Dict[str, Any], segment: Dict[str, Any]):
+        """
+        Drop the messages of a segment and keep only its rollups
+        
+        Sessions recorded before rollups existed get them computed from the
+        segment before its file is deleted.
+        """
+        has_rollups = self.db_conn.execute("""
+            SELECT 1 FROM rollups
+            WHERE session_id = ? AND resolution = ? AND bucket BETWEEN ? AND ?
+            LIMIT 1
+        """, (session['id'], ROLLUP_RESOLUTIONS[0],
+              int(segment['first_timestamp'] // ROLLUP_RESOLUTIONS[0]),
+              int(segment['last_timestamp'] // ROLLUP_RESOLUTIONS[0]))).fetchone()
+        
+        cursor = self.db_conn.cursor()
+        if not has_rollups:
+            offsets = [row[0] for row in self._segment_blocks(segment)]
+            with RecordingFile(segment['file_path']) as f:
+                for messages in f.scan_blocks(offsets):
+                    store_rollups(cursor, session['id'], messages)
+        
+        cursor.execute("""
+            DELETE FROM message_index
+            WHERE session_id = ? AND timestamp BETWEEN ? AND ? AND segment_id = ?
+        """, (session['id'], segment['first_timestamp'], segment['last_timestamp'], segment['id']))
+        cursor.execute("DELETE FROM block_index WHERE session_id = ? AND segment_id = ?",
+                       (session['id'], segment['id']))
+        cursor.execute("UPDATE segments SET status = 'downsampled', size_bytes = 0 WHERE id = ?",
+                       (segment['id'],))
+        self.db_conn.commit()
+        
+        Path(segment['file_path']).unlink(missing_ok=True)
+        self.logger.info(f"Downsampled segment {segment['seq']} of session {session['id']}")
+
+
+class SessionRecovery:
+    """Rebuilds the index of recording sessions from their segment files"""
+    
+    def __init__(self, storage_path: str):
+        """
+        Initialize recovery
+        
+        Args:
+            storage_path: Path to storage directory
+        """
+        self.storage_path = Path(storage_path)
+        self.db_conn = None
+        self.workers = os.cpu_count() or 1  # Processes scanning segment files
+        self.task_messages = 100000  # Messages per scan task
+        self.logger = logging.getLogger(__name__)
+    
+    def connect(self):
+        """Connect to database"""
+        db_path = self.storage_path / "recordings.db"
+        self.db_conn = sqlite3.connect(str(db_path))
+        self.db_conn.row_factory = sqlite3.Row
+        init_database(self.db_conn)
+    
+    def recover_all(self) -> List[Dict[str, Any]]:
+        """
+        Rebuild every session left in the 'recording' state by a crashed recorder
+        
+        Only run this while no recorder is writing to the storage path.
+        """
+        results = []
+        for row in self.db_conn.execute("""
+            SELECT id FROM recording_sessions WHERE status = 'recording' ORDER BY id
+        """).fetchall():
+            # Shard sessions are rebuilt along with their sharded session
+            status = self.db_conn.execute("SELECT status FROM recording_sessions WHERE id = ?",
+                                          (row['id'],)).fetchone()['status']
+            if status != 'recording':
+                continue
+            try:
+                results.append(self.rebuild(row['id']))
+            except ValueError as e:
+                self.logger.error(f"Cannot recover session {row['id']}: {e}")
+        return results
+    
+    def rebuild(self, session_id: int) -> Dict[str, Any]:
+        """
+        Rebuild the index, rollups and catalog of a session from its files
+        
+        Segment files are scanned in parallel in runs of blocks and their rows
+        bulk inserted in one transaction. Files the writer never closed are
+        cut after their last intact block and sealed, and the session is
+        marked completed. A sharded session is rebuilt through its shard
+        sessions.
+        """
+        started = time.perf_counter()
+        row = self.db_conn.execute("SELECT * FROM recording_sessions WHERE id = ?",
+                                   (session_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Session {session_id} not found")
+        session = dict(row)
+        
+        shards = shard_session_ids(self.db_conn, session_id)
+        if shards:
+            return self._rebuild_sharded(session_id, shards, started)
+        
+        segments = session_segments(self.db_conn, session)
+        downsampled = [segment for segment in segments if segment['status'] == 'downsampled']
+        segments = [segment for segment in segments if segment['status'] != 'downsampled']
+        
+        for segment in segments:
+            path = Path(segment['file_path'])
+            if not path.exists() or path.stat().st_size < FILE_HEADER.size:
+                # The writer died before the file header reached disk; the
+                # segment holds no messages
+                BlockWriter(path).close()
+            elif segment['id'] is None and not is_block_file(path):
+                raise ValueError(f"{path} predates block storage")
+        
+        # Split every file into runs of blocks so large segments scan in parallel too
+        full_index = session_index_mode(session) == IndexMode.FULL
+        scanned = []
+        tasks = []
+        for segment in segments:
+            with BlockReader(segment['file_path']) as reader:
+                blocks = reader.blocks()
+                scanned.append((segment, reader.is_sealed(), []))
+            run: List[BlockInfo] = []
+            count = 0
+            for block in blocks:
+                run.append(block)
+                count += block.message_count
+                if count >= self.task_messages:
+                    tasks.append((len(scanned) - 1, run))
+                    run, count = [], 0
+            if run:
+                tasks.append((len(scanned) - 1, run))
+        
+        if self.workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+                results = list(executor.map(
+                    _recover_task,
+                    [scanned[i][0]['file_path'] for i, _run in tasks],
+                    [run for _i, run in tasks],
+                    itertools.repeat(full_index)
+                ))
+        else:
+            results = [_recover_task(scanned[i][0]['file_path'], run, full_index) for i, run in tasks]
+        
+        # Keep each file's blocks up to the first torn one
+        torn = set()
+        for (i, _run), result in zip(tasks, results):
+            segment, sealed, segment_results = scanned[i]
+            if i in torn:
+                continue
+            segment_results.append(result)
+            if result['torn']:
+                if sealed:
+                    raise ValueError(f"Corrupt block in {segment['file_path']}")
+                torn.add(i)
+        
+        cursor = self.db_conn.cursor()
+        cursor.execute("DELETE FROM message_index WHERE session_id = ?", (session_id,))
+        cursor.execute("DELETE FROM block_index WHERE session_id = ?", (session_id,))
+        
+        # Rollups are all that is left of downsampled segments
+        first_timestamp = min((result['blocks'][0].first_timestamp
+                               for _segment, _sealed, segment_results in scanned
+                               for result in segment_results if result['blocks']), default=None)
+        if not downsampled:
+            cursor.execute("DELETE FROM rollups WHERE session_id = ?", (session_id,))
+        elif first_timestamp is not None:
+            cursor.executemany("""
+                DELETE FROM rollups WHERE session_id = ? AND resolution = ? AND bucket >= ?
+            """, [(session_id, resolution, int(first_timestamp // resolution) * resolution)
+                  for resolution in ROLLUP_RESOLUTIONS])
+        
+        message_count = sum(segment['message_count'] or 0 for segment in downsampled)
+        end_time = None
+        truncated = 0
+        for segment, sealed, segment_results in scanned:
+            blocks = [block for result in segment_results for block in result['blocks']]
+            
+            # Results are applied in file order so rollup opens and closes merge correctly
+            for result in segment_results:
+                cursor.executemany("""
+                    INSERT INTO block_index (session_id, segment_id, file_offset, first_timestamp,
+                                             last_timestamp, message_count, symbols)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [(session_id, segment['id']) + row for row in result['block_rows']])
+                cursor.executemany("""
+                    INSERT INTO message_index (session_id, segment_id, timestamp, topic, symbol,
+                                               file_offset, record_index)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [(session_id, segment['id']) + row for row in result['messages']])
+                cursor.executemany(ROLLUP_UPSERT, [(session_id,) + row for row in result['rollups']])
+            
+            if not sealed:
+                truncated += seal_block_file(segment['file_path'], blocks)
+            
+            segment_count = sum(block.message_count for block in blocks)
+            message_count += segment_count
+            if blocks:
+                end_time = max(end_time or blocks[-1].last_timestamp, blocks[-1].last_timestamp)
+            
+            if segment['id'] is not None:
+                cursor.execute("""
+                    UPDATE segments
+                    SET first_timestamp = ?, last_timestamp = ?, message_count = ?, size_bytes = ?,
+                        status = 'closed'
+                    WHERE id = ?
+                """, (blocks[0].first_timestamp if blocks else None,
+                      blocks[-1].last_timestamp if blocks else None,
+                      segment_count, Path(segment['file_path']).stat().st_size, segment['id']))
+        
+        cursor.execute("""
+            UPDATE recording_sessions
+            SET message_count = ?, end_time = COALESCE(end_time, ?), status = 'completed'
+            WHERE id = ?
+        """, (message_count, end_time or session['start_time'], session_id))
+        self.db_conn.commit()
+        update_catalog(self.db_conn, session_id)
+        
+        # A sharded session that already finished has to take in the new count
+        parent = self.db_conn.execute("""
+            SELECT l.session_id FROM session_shards l
+            JOIN recording_sessions s ON s.id = l.session_id
+            WHERE l.shard_session_id = ? AND s.status != 'recording'
+        """, (session_id,)).fetchone()
+        if parent is not None:
+            self._finish_sharded(parent[0])
+        
+        stats = {
+            'session_id': session_id,
+            'segments': len(scanned),
+            'tasks': len(tasks),
+            'messages': message_count,
+            'truncated_bytes': truncated,
+            'elapsed': time.perf_counter() - started
+        }
+        self.logger.info(f"Rebuilt session {session_id}: {stats}")
+        return stats
+    
+    def _rebuild_sharded(self, session_id: int, shards: List[int], started: float) -> Dict[str, Any]:
+        """Rebuild the shard sessions still recording, then finish the sharded session"""
+        results = []
+        for shard in shards:
+            status = self.db_conn.execute("SELECT status FROM recording_sessions WHERE id = ?",
+                                          (shard,)).fetchone()['status']
+            if status == 'recording':
+                results.append(self.rebuild(shard))
+        
+        stats = {
+            'session_id': session_id,
+            'shards': len(shards),
+            'segments': sum(result['segments'] for result in results),
+            'tasks': sum(result['tasks'] for result in results),
+            'messages': self._finish_sharded(session_id),
+            'truncated_bytes': sum(result['truncated_bytes'] for result in results),
+            'elapsed': time.perf_counter() - started
+        }
+        self.logger.info(f"Rebuilt sharded session {session_id}: {stats}")
+        return stats
+    
+    def _finish_sharded(self, session_id: int) -> int:
+        """Total the shard sessions into their sharded session and mark it completed"""
+        shards = shard_session_ids(self.db_conn, session_id)
+        placeholders = ','.join(['?' for _ in shards])
+        message_count, end_time = self.db_conn.execute(f"""
+            SELECT COALESCE(SUM(message_count), 0), MAX(end_time)
+            FROM recording_sessions WHERE id IN ({placeholders})
+        """, shards).fetchone()
+        self.db_conn.execute("""
+            UPDATE recording_sessions
+            SET message_count = ?, end_time = COALESCE(end_time, ?, start_time), status = 'completed'
+            WHERE id = ?
+        """, (message_count, end_time, session_id))
+        self.db_conn.commit()
+        update_catalog(self.db_conn, session_id)
+        return message_count
+
+
+class ReplayScheduler:
+    """Paces a replay against absolute deadlines measured from its first message"""
+    
+    def __init__(self, speed_multiplier: float = 1.0, max_idle_gap: Optional[float] = None,
+                 coalesce_window: float = 0.0005, spin_threshold: float = 0.0,
+                 max_lag_samples: int = 100000):
+        """
+        Initialize scheduler
+        
+        Args:
+            speed_multiplier: Replay speed relative to the recording
+            max_idle_gap: Recorded gaps longer than this many seconds are shortened to it
+            coalesce_window: Messages due within this many seconds are sent without sleeping
+            spin_threshold: Poll the clock for the last this many seconds before a
+                deadline instead of sleeping. Each poll yields to the event loop, but
+                the loop stays busy for that time, so it defaults to 0 (sleep only)
+            max_lag_samples: Lag samples kept for percentiles (reservoir sampled)
+        """
+        self.speed_multiplier = speed_multiplier
+        self.max_idle_gap = max_idle_gap
+        self.coalesce_window = coalesce_window
+        self.spin_threshold = spin_threshold
+        self.max_lag_samples = max_lag_samples
+        
+        self.origin_clock: Optional[float] = None
+        self.origin_timestamp: Optional[float] = None
+        self.prev_timestamp: Optional[float] = None
+        self.skipped = 0.0  # Recorded seconds removed by gap compression
+        self.lag_samples: List[float] = []
+        self.lag_count = 0
+    
+    def deadline(self, timestamp: float) -> float:
+        """Monotonic clock time at which the message recorded at timestamp is due"""
+        if self.origin_clock is None:
+            self.origin_clock = time.perf_counter()
+            self.origin_timestamp = timestamp
+            self.prev_timestamp = timestamp
+        
+        gap = timestamp - self.prev_timestamp
+        if self.max_idle_gap is not None and gap > self.max_idle_gap:
+            self.skipped += gap - self.max_idle_gap
+        self.prev_timestamp = max(self.prev_timestamp, timestamp)
+        
+        elapsed = timestamp - self.origin_timestamp - self.skipped
+        return self.origin_clock + elapsed / self.speed_multiplier
+    
+    async def wait_until(self, deadline: float) -> bool:
+        """
+        Wait for a deadline
+        
+        Returns:
+            False if the deadline fell within the coalesce window and no wait happened
+        """
+        remaining = deadline - time.perf_counter()
+        if remaining <= self.coalesce_window:
+            return False
+        
+        if remaining > self.spin_threshold:
+            await asyncio.sleep(remaining - self.spin_threshold)
+        
+        # Spin for sub-millisecond accuracy, letting other tasks run meanwhile
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0)
+        
+        return True
+    
+    def record_lag(self, deadline: float):
+        """Record how late a message was sent relative to its deadline"""
+        lag = time.perf_counter() - deadline
+        self.lag_count += 1
+        
+        if len(self.lag_samples) < self.max_lag_samples:
+            self.lag_samples.append(lag)
+        else:
+            index = random.randrange(self.lag_count)
+            if index < self.max_lag_samples:
+                self.lag_samples[index] = lag
+    
+    def lag_percentiles(self) -> Dict[str, float]:
+        """Replay lag percentiles in milliseconds"""
+        if not self.lag_samples:
+            return {}
+        
+        samples = np.array(self.lag_samples) * 1000
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+        return {
+            'p50_ms': float(p50),
+            'p90_ms': float(p90),
+            'p99_ms': float(p99),
+            'max_ms': float(samples.max())
+        }
+
+
+def message_columns(messages: List[MarketMessage]) -> Dict[str, np.ndarray]:
+    """
+    Convert messages to NumPy columns
+    
+    timestamp, symbol and topic are always present. Every data field becomes
+    an int64 column if all messages carry an integer for it, a float64
+    column with NaN where a message lacks it if its values are numeric, or
+    an object column otherwise.
+    """
+    columns = {
+        'timestamp': np.fromiter((msg.timestamp for msg in messages), dtype=np.float64,
+                                 count=len(messages)),
+        'symbol': np.array([msg.symbol for msg in messages], dtype=object),
+        'topic': np.array([msg.topic for msg in messages], dtype=object)
+    }
+    
+    datas = [msg.data if isinstance(msg.data, dict) else {} for msg in messages]
+    
+    fields = {}
+    for data in datas:
+        for field in data:
+            fields.setdefault(field, None)
+    
+    for field in fields:
+        if field in columns:
+            continue
+        values = [data.get(field) for data in datas]
+        types = {type(v) for v in values}
+        
+        if types == {int} and all(-2**63 <= v < 2**63 for v in values):
+            columns[field] = np.array(values, dtype=np.int64)
+        elif types <= {int, float, type(None)}:
+            columns[field] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            columns[field] = np.array(values, dtype=object)
+    
+    return columns
+
+
+EXPORT_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'npz': '.npz'}
+
+
+def _column_type(values: np.ndarray) -> str:
+    """Export type name of a column"""
+    if values.dtype.kind == 'i':
+        return 'int64'
+    if values.dtype.kind == 'f':
+        return 'float64'
+    return 'string'
+
+
+def _export_array(values: np.ndarray) -> np.ndarray:
+    """Column as written to files; object columns become strings, nested values JSON"""
+    if values.dtype != object:
+        return values
+    return np.array(['' if v is None else v if isinstance(v, str) else json.dumps(v)
+                     for v in values], dtype=str)
+
+
+def concat_columns(chunks: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Concatenate column chunks that may not share the same fields
+    
+    Numeric columns missing from a chunk are filled with NaN, others with
+    empty strings.
+    """
+    fields: Dict[str, str] = {}
+    for chunk in chunks:
+        for name, values in chunk.items():
+            fields.setdefault(name, _column_type(values))
+    
+    columns = {}
+    for name, column_type in fields.items():
+        arrays = []
+        for chunk in chunks:
+            rows = len(next(iter(chunk.values()))) if chunk else 0
+            if name in chunk:
+                arrays.append(chunk[name])
+            elif column_type == 'string':
+                arrays.append(np.full(rows, '', dtype=str))
+            else:
+                arrays.append(np.full(rows, np.nan))
+        
+        try:
+            columns[name] = np.concatenate(arrays)
+        except (TypeError, ValueError):
+            # Numbers in some chunks and strings in others
+            columns[name] = np.concatenate([array.astype(object) for array in arrays])
+    
+    return columns
+
+
+def write_column_file(path: Path, columns: Dict[str, np.ndarray], export_format: str):
+    """Write columns to a Parquet, Arrow IPC or NPZ file"""
+    arrays = {name: _export_array(values) for name, values in columns.items()}
+    
+    if export_format == 'npz':
+        np.savez(path, **arrays)
+        return
+    
+    table = pa.table(arrays)
+    if export_format == 'parquet':
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_column_file(path: Path, export_format: str) -> Dict[str, np.ndarray]:
+    """Read a file written by write_column_file"""
+    if export_format == 'npz':
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    
+    if export_format == 'parquet':
+        table = pq.read_table(path)
+    else:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+def load_export(path: str, symbols: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Load a columnar export into NumPy arrays
+    
+    Args:
+        path: Directory written by ReplayAnalyzer.export_columnar
+        symbols: Only load these symbol partitions of a partitioned export
+    """
+    path = Path(path)
+    manifest = json.loads((path / 'manifest.json').read_text())
+    
+    chunks = [read_column_file(path / part['path'], manifest['format'])
+              for part in manifest['parts']
+              if not symbols or part['symbol'] is None or part['symbol'] in symbols]
+    
+    columns = concat_columns(chunks)
+    if symbols and not manifest['partition_by_symbol'] and columns:
+        mask = np.isin(columns['symbol'], symbols)
+        columns = {name: values[mask] for name, values in columns.items()}
+    
+    return columns
+
+
+class SessionReader:
+    """
+    Reads recorded sessions in-process
+    
+    Backtests and simulators iterate recordings straight from storage with
+    this instead of subscribing to a MessageReplayer, so no serialization
+    or socket hop is involved.
+    """
+    
+    def __init__(self, storage_path: str):
+        """
+        Initialize reader
+        
+        Args:
+            storage_path: Path to storage directory
+        """
+        self.storage_path = Path(storage_path)
+        self.db_conn = None
+        self.logger = logging.getLogger(__name__)
+        
+        self.page_size = 1000  # Index rows fetched per query
+        self.sequential_threshold = 0.05  # Minimum filter selectivity for sequential reads
+        self.column_batch = 10000  # Default batch size for column batches
+    
+    def connect(self):
+        """Connect to the recordings database"""
+        db_path = self.storage_path / "recordings.db"
+        self.db_conn = sqlite3.connect(str(db_path))
+        self.db_conn.row_factory = sqlite3.Row
+        init_database(self.db_conn)
+    
+    def close(self):
+        """Close the database connection"""
+        if self.db_conn:
+            self.db_conn.close()
+            self.db_conn = None
+    
+    def __enter__(self):
+        self.connect()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def get_session(self, session_id: int) -> Optional[Dict[str, Any]]:
+        """Get a recording session by ID"""
+        row = self.db_conn.execute("""
+            SELECT * FROM recording_sessions WHERE id = ?
+        """, (session_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def expand_shards(self, sessions: List[Dict[str, Any]],
+                      symbols: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Replace sharded sessions by their shard sessions (see expand_shards)"""
+        return expand_shards(self.db_conn, sessions, symbols)
+    
+    def find_sessions(self, start_time: Optional[float] = None, end_time: Optional[float] = None,
+                      symbols: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Sessions holding messages in the time range, oldest first
+        
+        Cataloged sessions are matched on the recorded coverage of the
+        requested symbols. Sessions not yet in the catalog, such as ones
+        still recording, are matched on their start and end times. Shard
+        sessions are reached through their sharded session only.
+        """
+        time_range = ""
+        params: List[Any] = []
+        if start_time:
+            time_range += " AND last_timestamp >= ?"
+            params.append(start_time)
+        if end_time:
+            time_range += " AND first_timestamp <= ?"
+            params.append(end_time)
+        
+        if symbols:
+            placeholders = ','.join(['?' for _ in symbols])
+            covered = f"""EXISTS (
+                SELECT 1 FROM symbol_catalog
+                WHERE session_id = s.id AND symbol IN ({placeholders}){time_range})"""
+            params = list(symbols) + params
+        else:
+            covered = f"""EXISTS (
+                SELECT 1 FROM session_catalog
+                WHERE session_id = s.id AND message_count > 0{time_range})"""
+        
+        # Sessions that never stopped have no end time and always qualify
+        uncataloged = "1=1"
+        if start_time:
+            uncataloged += " AND (s.end_time IS NULL OR s.end_time >= ?)"
+            params.append(start_time)
+        if end_time:
+            uncataloged += " AND s.start_time <= ?"
+            params.append(end_time)
+        
+        query = f"""
+            SELECT s.* FROM recording_sessions s
+            LEFT JOIN session_catalog c ON c.session_id = s.id
+            WHERE ((c.session_id IS NOT NULL AND {covered})
+                   OR (c.session_id IS NULL AND {uncataloged}))
+              AND s.id NOT IN (SELECT shard_session_id FROM session_shards)
+            ORDER BY s.start_time, s.id
+        """
+        return [dict(row) for row in self.db_conn.execute(query, params)]
+    
+    def coverage(self, symbols: Optional[List[str]] = None, start_time: Optional[float] = None,
+                 end_time: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Catalog entries of the sessions covering symbols in a time range
+        
+        Returns:
+            One row per session and symbol with its first/last timestamp,
+            message count and the session's name and file
+        """
+        query = """
+            SELECT c.session_id, c.symbol, c.first_timestamp, c.last_timestamp, c.message_count,
+                   s.name, s.file_path
+            FROM symbol_catalog c
+            JOIN recording_sessions s ON s.id = c.session_id
+            WHERE c.session_id NOT IN (SELECT shard_session_id FROM session_shards)
+        """
+        params: List[Any] = []
+        
+        if symbols:
+            placeholders = ','.join(['?' for _ in symbols])
+            query += f" AND c.symbol IN ({placeholders})"
+            params.extend(symbols)
+        
+        if start_time:
+            query += " AND c.last_timestamp >= ?"
+            params.append(start_time)
+        
+        if end_time:
+            query += " AND c.first_timestamp <= ?"
+            params.append(end_time)
+        
+        query += " ORDER BY c.first_timestamp, c.session_id, c.symbol"
+        return [dict(row) for row in self.db_conn.execute(query, params)]
+    
+    def iter_session(self, session_id: int, symbols: Optional[List[str]] = None,
+                     start_time: Optional[float] = None, end_time: Optional[float] = None,
+                     batch: Optional[int] = None, columns: bool = False) -> Iterator:
+        """
+        Iterate the messages of a session in timestamp order
+        
+        Args:
+            session_id: Recording session ID
+            symbols: Only yield these symbols
+            start_time: Only yield messages at or after this timestamp
+            end_time: Only yield messages at or before this timestamp
+            batch: Yield lists of up to this many messages instead of single messages
+            columns: Yield batches as dicts of NumPy arrays (see message_columns)
+        
+        Yields:
+            Messages, message lists, or column dicts
+        """
+        return self.iter_sessions([session_id], symbols, start_time, end_time, batch, columns)
+    
+    def iter_sessions(self, session_ids: Optional[List[int]] = None,
+                      symbols: Optional[List[str]] = None,
+                      start_time: Optional[float] = None, end_time: Optional[float] = None,
+                      batch: Optional[int] = None, columns: bool = False) -> Iterator:
+        """
+        Iterate several sessions as one feed in timestamp order
+        
+        Args:
+            session_ids: Recording session IDs, or None for every session
+                overlapping start_time to end_time
+            symbols, start_time, end_time, batch, columns: As for iter_session
+        
+        Yields:
+            Messages, message lists, or column dicts
+        """
+        if session_ids is None:
+            sessions = self.find_sessions(start_time, end_time, symbols)
+        else:
+            sessions = []
+            for session_id in session_ids:
+                session = self.get_session(session_id)
+                if not session:
+                    raise ValueError(f"Session {session_id} not found")
+                sessions.append(session)
+        
+        if columns and not batch:
+            batch = self.column_batch
+        
+        messages = self.merge_sessions(sessions, symbols, start_time, end_time)
+        if not batch:
+            return messages
+        return self._batches(messages, batch, columns)
+    
+    @staticmethod
+    def _batches(messages: Iterator[MarketMessage], batch: int, columns: bool) -> Iterator:
+        """Group a message stream into lists or column dicts"""
+        while True:
+            chunk = list(itertools.islice(messages, batch))
+            if not chunk:
+                return
+            yield message_columns(chunk) if columns else chunk
+    
+    def merge_sessions(self, sessions: List[Dict[str, Any]], symbols: Optional[List[str]],
+                       start_time: Optional[float],
+                       end_time: Optional[float]) -> Iterator[MarketMessage]:
+        """
+        Stream the messages of several sessions merged by timestamp
+        
+        Each session is read lazily from its own file, so memory is bounded
+        by one decoded block per session. Messages with equal timestamps
+        keep the order of sessions. Sharded sessions are read through their
+        shard sessions.
+        """
+        streams = [self._read_session(session, symbols, start_time, end_time)
+                   for session in self.expand_shards(sessions, symbols)]
+        try:
+            if len(streams) == 1:
+                yield from streams[0]
+            else:
+                yield from heapq.merge(*streams, key=attrgetter('timestamp'))
+        finally:
+            # Close the recording files when the consumer stops early
+            for stream in streams:
+                stream.close()
+    
+    def _read_session(self, session: Dict[str, Any], symbols: Optional[List[str]],
+                      start_time: Optional[float],
+                      end_time: Optional[float]) -> Iterator[MarketMessage]:
+        """Open a session's segment files and stream its messages"""
+        with SegmentFiles(self.db_conn, session) as files:
+            yield from self.select_messages(session, files, symbols, start_time, end_time)
+    
+    def select_messages(self, session: Dict[str, Any], files: SegmentFiles,
+                        symbols: Optional[List[str]], start_time: Optional[float],
+                        end_time: Optional[float]) -> Iterator[MarketMessage]:
+        """
+        Stream the messages of a session
+        
+        Block recordings are read sequentially from the blocks that overlap
+        the time range, filtering symbols in-stream. Indexed seeks are only
+        used for full-index sessions when the symbol filter matches less
+        than sequential_threshold of the messages in those blocks, and for
+        legacy gzip recordings.
+        """
+        blocks = query_blocks(self.db_conn, session['id'], start_time, end_time, symbols)
+        
+        if blocks and (session_index_mode(session) == IndexMode.SPARSE or not symbols or
+                       self._selectivity(blocks, symbols) >= self.sequential_threshold):
+            self.logger.info(f"Starting sequential read of {len(blocks)} blocks")
+            for segment_id, segment_blocks in itertools.groupby(blocks, key=itemgetter('segment_id')):
+                yield from self._scan_blocks(files.get(segment_id), list(segment_blocks),
+                                             symbols, start_time, end_time)
+            return
+        
+        self.logger.info(f"Starting indexed read of session {session['name']}")
+        for row in self._get_messages(session['id'], symbols, start_time, end_time):
+            yield files.get(row['segment_id']).read_message(row['file_offset'], row['record_index'])
+    
+    @staticmethod
+    def _selectivity(blocks: List[Dict], symbols: List[str]) -> float:
+        """Share of the messages in blocks that belong to symbols"""
+        total = sum(block['message_count'] for block in blocks)
+        matching = sum(block['symbols'][symbol][0]
+                       for block in blocks for symbol in symbols if symbol in block['symbols'])
+        return matching / total if total else 0.0
+    
+    def _get_messages(self, session_id: int, symbols: Optional[List[str]],
+                      start_time: Optional[float], end_time: Optional[float]) -> Iterator[Dict]:
+        """
+        Stream index rows
+        
+        Rows are fetched in pages of page_size using the last (timestamp, id)
+        seen as the key for the next page, so memory stays flat and no read
+        transaction is held open for the length of the read.
+        """
+        query = """
+            SELECT * FROM message_index 
+            WHERE session_id = ?
+        """
+        params = [session_id]
+        
+        if end_time is not None:
+            query += " AND timestamp <= ?"
+            params.append(end_time)
+        
+        if symbols:
+            placeholders = ','.join(['?' for _ in symbols])
+            query += f" AND symbol IN ({placeholders})"
+            params.extend(symbols)
+        
+        page_query = query + """
+            AND timestamp >= ? AND (timestamp > ? OR id > ?)
+            ORDER BY timestamp, id
+            LIMIT ?
+        """
+        last_timestamp = start_time if start_time is not None else float('-inf')
+        last_id = -1
+        cursor = self.db_conn.cursor()
+        
+        while True:
+            cursor.execute(page_query, params + [last_timestamp, last_timestamp, last_id, self.page_size])
+            rows = cursor.fetchall()
+            
+            for row in rows:
+                yield dict(row)
+            
+            if len(rows) < self.page_size:
+                return
+            
+            last_timestamp = rows[-1]['timestamp']
+            last_id = rows[-1]['id']
+    
+    def _scan_blocks(self, f: RecordingFile, blocks: List[Dict], symbols: Optional[List[str]],
+                     start_time: Optional[float], end_time: Optional[float]) -> Iterator[MarketMessage]:
+        """Read matching messages from the blocks selected by the block index"""
+        for block_messages in f.scan_blocks([block['file_offset'] for block in blocks]):
+            for msg in block_messages:
+                if start_time is not None and msg.timestamp < start_time:
+                    continue
+                if end_time is not None and msg.timestamp > end_time:
+                    continue
+                if symbols and msg.symbol not in symbols:
+                    continue
+                yield msg
+
+
+class FeedIndex:
+    """
+    Maps positions in a replay feed to timestamps
+    
+    A feed is the filtered messages of one or more sessions in timestamp
+    order. Positions are resolved by binary search over the cumulative
+    per-block message counts of the block index, decoding at most one
+    block per session, so a seek costs the same anywhere in a recording.
+    Sessions without matching blocks, such as legacy gzip recordings, are
+    counted through the message index, with a boundary every legacy_stride
+    messages. Counts are cached for the life of the index, which is built
+    once per load.
+    """
+    
+    legacy_stride = 1000  # Messages between the seek boundaries of a legacy session
+    
+    def __init__(self, reader: SessionReader, sessions: List[Dict[str, Any]],
+                 symbols: Optional[List[str]] = None):
+        """
+        Build the index
+        
+        Args:
+            reader: Connected session reader
+            sessions: Sessions making up the feed
+            symbols: Symbol filter of the feed
+        """
+        self.reader = reader
+        self.symbols = symbols
+        self.entries: List[Dict[str, Any]] = []
+        self.counts: Dict[float, int] = {}  # count_before results by timestamp
+        boundaries = set()
+        
+        for session in reader.expand_shards(sessions, symbols):
+            entry = {'session': session, 'files': SegmentFiles(reader.db_conn, session), 'blocks': None}
+            blocks = query_blocks(reader.db_conn, session['id'], symbols=symbols)
+            
+            if blocks:
+                entry['blocks'] = blocks
+                entry['last_timestamps'] = [block['last_timestamp'] for block in blocks]
+                entry['cumulative'] = list(itertools.accumulate(
+                    (self._matching(block) for block in blocks), initial=0))
+                entry['total'] = entry['cumulative'][-1]
+                boundaries.update(block['first_timestamp'] for block in blocks)
+            else:
+                entry['total'] = self._index_query(session['id'], "COUNT(*)", None)
+                boundaries.update(self._index_boundaries(session['id']))
+            
+            self.entries.append(entry)
+        
+        # Feed positions can only change at the first timestamp of a block
+        self.boundaries = sorted(boundaries)
+    
+    def _matching(self, block: Dict[str, Any]) -> int:
+        """Messages in a block that pass the symbol filter"""
+        if not self.symbols:
+            return block['message_count']
+        return sum(block['symbols'][symbol][0] for symbol in self.symbols if symbol in block['symbols'])
+    
+    def _index_filter(self, session_id: int, before: Optional[float]) -> Tuple[str, List[Any]]:
+        """WHERE clause selecting the feed's message index rows of a session"""
+        query = "session_id = ?"
+        params = [session_id]
+        
+        if before is not None:
+            query += " AND timestamp < ?"
+            params.append(before)
+        
+        if self.symbols:
+            placeholders = ','.join(['?' for _ in self.symbols])
+            query += f" AND symbol IN ({placeholders})"
+            params.extend(self.symbols)
+        
+        return query, params
+    
+    def _index_query(self, session_id: int, expression: str, before: Optional[float]):
+        """Aggregate the message index rows of a session"""
+        where, params = self._index_filter(session_id, before)
+        return self.reader.db_conn.execute(
+            f"SELECT {expression} FROM message_index WHERE {where}", params).fetchone()[0]
+    
+    def _index_boundaries(self, session_id: int) -> List[float]:
+        """Timestamps of every legacy_stride-th message index row of a session"""
+        where, params = self._index_filter(session_id, None)
+        rows = self.reader.db_conn.execute(f"""
+            SELECT timestamp FROM (
+                SELECT timestamp, ROW_NUMBER() OVER (ORDER BY timestamp, id) - 1 AS position
+                FROM message_index WHERE {where}
+            ) WHERE position % ? = 0
+        """, params + [self.legacy_stride])
+        return [row[0] for row in rows]
+    
+    def count_before(self, timestamp: float) -> int:
+        """Number of feed messages recorded before timestamp"""
+        if timestamp in self.counts:
+            return self.counts[timestamp]
+        
+        total = 0
+        
+        for entry in self.entries:
+            blocks = entry['blocks']
+            if blocks is None:
+                total += self._index_query(entry['session']['id'], "COUNT(*)", timestamp)
+                continue
+            
+            index = bisect.bisect_left(entry['last_timestamps'], timestamp)
+            total += entry['cumulative'][index]
+            
+            # Only the block straddling timestamp has to be decoded
+            if index < len(blocks) and blocks[index]['first_timestamp'] < timestamp:
+                block = blocks[index]
+                f = entry['files'].get(block['segment_id'])
+                total += sum(1 for msg in f.read_block(block['file_offset'])
+                             if msg.timestamp < timestamp and
+                             (not self.symbols or msg.symbol in self.symbols))
+        
+        self.counts[timestamp] = total
+        return total
+    
+    def locate(self, position: int) -> Tuple[Optional[float], int]:
+        """
+        Find where a feed position starts
+        
+        Returns:
+            Timestamp to start reading at and the number of messages to
+            skip from there to reach position
+        """
+        if position <= 0 or not self.boundaries:
+            return None, max(position, 0)
+        
+        # Last block boundary with at most position messages before it
+        low, high = 0, len(self.boundaries)
+        while low < high:
+            middle = (low + high) // 2
+            if self.count_before(self.boundaries[middle]) <= position:
+                low = middle + 1
+            else:
+                high = middle
+        
+        timestamp = self.boundaries[low - 1]
+        return timestamp, position - self.count_before(timestamp)
+    
+    @property
+    def total(self) -> int:
+        """Number of messages in the feed"""
+        return sum(entry['total'] for entry in self.entries)
+    
+    def close(self):
+        """Close the recording files"""
+        for entry in self.entries:
+            entry['files'].close()
 
 
 class MessageReplayer:
@@ -266,27 +2668,52 @@ class MessageReplayer:
         
         self.context = zmq.asyncio.Context()
         self.socket = None
+        self.send_socket = None  # Synchronous shadow of socket for batched sends
         self.db_conn = None
         self.logger = logging.getLogger(__name__)
         
+        # FAST mode settings
+        self.batch_size = 1000  # Messages sent between event loop yields
+        self.send_hwm = 100000  # Queued messages per subscriber before sends wait
+        self.target_rate: Optional[float] = None  # Messages per second, None for unthrottled
+        self.replay_stats: Dict[str, Any] = {}
+        self._reset_stats()
+        
+        # REALTIME/ACCELERATED scheduling
+        self.max_idle_gap: Optional[float] = None  # Seconds; longer silences are compressed
+        self.spin_threshold = 0.0  # Seconds of clock polling before each deadline; 0 only sleeps
+        self.coalesce_window = 0.0005  # Seconds; earlier deadlines are sent together
+        
         # Replay state
         self.mode = ReplayMode.REALTIME
         self.speed_multiplier = 1.0
         self.current_session = None
+        self.current_sessions: List[Dict[str, Any]] = []  # Sessions merged into one feed
         self.is_playing = False
         self.current_position = 0
         self.filters = {}  # Symbol filters
+        self.end_time: Optional[float] = None
+        self.reader = SessionReader(storage_path)
+        
+        # Feed read by play() and step(); reopened after seeks
+        self.feed_index: Optional[FeedIndex] = None
+        self._stream = None
+        self._messages: Optional[Iterator[MarketMessage]] = None
+        self._stream_start: Optional[Tuple[Optional[float], int]] = None
     
     async def start(self):
         """Start replay server"""
-        # Create publisher socket
+        # Create publisher socket; with XPUB_NODROP a full subscriber
+        # queue makes sends fail with EAGAIN instead of dropping messages
         self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, self.send_hwm)
+        self.socket.setsockopt(zmq.XPUB_NODROP, 1)
         self.socket.bind(self.zmq_address)
+        self.send_socket = zmq.Socket.shadow(self.socket.underlying)
         
         # Connect to database
-        db_path = self.storage_path / "recordings.db"
-        self.db_conn = sqlite3.connect(str(db_path))
-        self.db_conn.row_factory = sqlite3.Row
+        self.reader.connect()
+        self.db_conn = self.reader.db_conn
         
         self.logger.info(f"Replay server started on {self.zmq_address}")
     
@@ -320,10 +2747,42 @@ class MessageReplayer:
             return False
         
         self.current_session = dict(row)
-        self.current_position = 0
+        self.current_sessions = [self.current_session]
+        self._reset_feed()
         self.logger.info(f"Loaded session: {self.current_session['name']}")
         return True
     
+    def load_sessions(self, session_ids: Optional[List[int]] = None,
+                      start_time: Optional[float] = None, end_time: Optional[float] = None) -> bool:
+        """
+        Load several recording sessions to replay as one merged feed
+        
+        Args:
+            session_ids: Recording session IDs, or None for every session the
+                catalog shows covering the symbol filter from start_time to end_time
+            start_time: Start of the time range when session_ids is None
+            end_time: End of the time range when session_ids is None
+        """
+        if session_ids is None:
+            sessions = self.reader.find_sessions(start_time, end_time, self.filters.get('symbols'))
+        else:
+            sessions = [self.reader.get_session(session_id) for session_id in session_ids]
+            missing = [sid for sid, session in zip(session_ids, sessions) if not session]
+            if missing:
+                self.logger.error(f"Sessions not found: {missing}")
+                return False
+        
+        if not sessions:
+            self.logger.error("No sessions to load")
+            return False
+        
+        self.current_sessions = sessions
+        self.current_session = sessions[0]
+        self._reset_feed()
+        self.logger.info(f"Loaded {len(sessions)} sessions: "
+                         f"{', '.join(session['name'] for session in sessions)}")
+        return True
+    
     def set_mode(self, mode: ReplayMode, speed_multiplier: float = 1.0):
         """Set replay mode"""
         self.mode = mode
@@ -331,144 +2790,294 @@ class MessageReplayer:
         self.logger.info(f"Replay mode set to {mode.value} (speed: {speed_multiplier}x)")
     
     def set_filters(self, symbols: Optional[List[str]] = None):
-        """Set symbol filters"""
+        """Set symbol filters; positions count filtered messages, so this rewinds to the start"""
         self.filters['symbols'] = symbols
+        self._reset_feed()
         self.logger.info(f"Filters set: {self.filters}")
     
-    async def play(self, start_time: Optional[float] = None, end_time: Optional[float] = None):
-        """Start replay"""
-        if not self.current_session:
-            self.logger.error("No session loaded")
-            return
+    def _reset_feed(self):
+        """Forget the feed and its index and rewind to the first message"""
+        self._close_stream()
+        if self.feed_index:
+            self.feed_index.close()
+            self.feed_index = None
+        self.current_position = 0
+        self._stream_start = None
+    
+    def _close_stream(self):
+        """Close the open feed; the next read reopens it at current_position"""
+        if self._stream:
+            self._stream.close()
+        self._stream = None
+        self._messages = None
+    
+    def _get_feed_index(self) -> FeedIndex:
+        """Index of the loaded feed, built on first use"""
+        if not self.feed_index:
+            self.feed_index = FeedIndex(self.reader, self.current_sessions, self.filters.get('symbols'))
+        return self.feed_index
+    
+    def _feed(self) -> Iterator[MarketMessage]:
+        """The feed positioned at current_position, opening it if needed"""
+        if self._messages is None:
+            if self._stream_start is None:
+                if self.current_position:
+                    self._stream_start = self._get_feed_index().locate(self.current_position)
+                else:
+                    self._stream_start = (None, 0)
+            
+            start_time, skip = self._stream_start
+            self._stream = self.reader.merge_sessions(self.current_sessions, self.filters.get('symbols'),
+                                                      start_time, self.end_time)
+            self._messages = itertools.islice(self._stream, skip, None)
+            self._stream_start = None
         
-        self.is_playing = True
+        return self._messages
+    
+    def seek(self, timestamp: Optional[float] = None, position: Optional[int] = None) -> int:
+        """
+        Move the replay to a timestamp or a message position
         
-        # Open data file
-        file_path = Path(self.current_session['file_path'])
+        A running play() continues from the new position.
         
-        # Get messages to replay
-        messages = self._get_messages(start_time, end_time)
+        Args:
+            timestamp: Continue with the first message at or after this timestamp
+            position: Continue with the message at this position in the feed
         
-        if not messages:
-            self.logger.warning("No messages to replay")
-            return
+        Returns:
+            The new position
+        """
+        index = self._get_feed_index()
+        self._close_stream()
+        
+        if timestamp is not None:
+            self.current_position = index.count_before(timestamp)
+            self._stream_start = (timestamp, 0)
+        else:
+            self.current_position = max(0, min(position, index.total))
+            self._stream_start = index.locate(self.current_position)
+        
+        self.logger.info(f"Seeked to position {self.current_position}")
+        return self.current_position
+    
+    async def step(self, count: int = 1) -> List[MarketMessage]:
+        """
+        Publish the next messages
+        
+        Args:
+            count: Number of messages to publish
         
-        self.logger.info(f"Starting replay of {len(messages)} messages")
+        Returns:
+            The published messages; fewer than count at the end of the feed
+        """
+        if not self.current_sessions:
+            self.logger.error("No session loaded")
+            return []
         
-        # Replay based on mode
-        if self.mode == ReplayMode.REALTIME:
-            await self._replay_realtime(messages, file_path)
-        elif self.mode == ReplayMode.FAST:
-            await self._replay_fast(messages, file_path)
-        elif self.mode == ReplayMode.ACCELERATED:
-            await self._replay_accelerated(messages, file_path)
-        elif self.mode == ReplayMode.STEPPED:
-            await self._replay_stepped(messages, file_path)
+        batch = list(itertools.islice(self._feed(), count))
+        if batch:
+            await self._publish_batch(batch)
+            self.current_position += len(batch)
+        
+        return batch
     
-    def _get_messages(self, start_time: Optional[float], end_time: Optional[float]) -> List[Dict]:
-        """Get messages to replay"""
-        query = """
-            SELECT * FROM message_index 
-            WHERE session_id = ?
+    async def play(self, start_time: Optional[float] = None, end_time: Optional[float] = None):
         """
-        params = [self.current_session['id']]
+        Start replay
         
-        if start_time:
-            query += " AND timestamp >= ?"
-            params.append(start_time)
+        Replay continues from current_position, so playing again after
+        pause() or seek() resumes there. Messages of all loaded sessions
+        are merged by timestamp.
         
-        if end_time:
-            query += " AND timestamp <= ?"
-            params.append(end_time)
+        Args:
+            start_time: Seek to this timestamp first
+            end_time: Stop after this timestamp
+        """
+        if not self.current_session:
+            self.logger.error("No session loaded")
+            return
         
-        if self.filters.get('symbols'):
-            placeholders = ','.join(['?' for _ in self.filters['symbols']])
-            query += f" AND symbol IN ({placeholders})"
-            params.extend(self.filters['symbols'])
+        if end_time != self.end_time:
+            self.end_time = end_time
+            self._close_stream()
         
-        query += " ORDER BY timestamp"
+        if start_time is not None:
+            self.seek(timestamp=start_time)
         
-        cursor = self.db_conn.cursor()
-        cursor.execute(query, params)
+        self.is_playing = True
         
-        return [dict(row) for row in cursor]
+        while self.is_playing:
+            messages = self._feed()
+            
+            # Replay based on mode
+            if self.mode == ReplayMode.REALTIME:
+                await self._replay_realtime(messages)
+            elif self.mode == ReplayMode.FAST:
+                await self._replay_fast(messages)
+            elif self.mode == ReplayMode.ACCELERATED:
+                await self._replay_accelerated(messages)
+            elif self.mode == ReplayMode.STEPPED:
+                await self._replay_stepped(messages)
+            
+            # A seek during replay replaces the feed; carry on from there
+            if messages is self._messages:
+                break
+    
+    def _reset_stats(self):
+        """Start replay statistics over with every key present"""
+        self.replay_stats = {
+            'messages_sent': 0,
+            'elapsed': 0.0,
+            'messages_per_second': 0.0,
+            'hwm_waits': 0,
+            'compressed_idle_seconds': 0.0,
+            'lag': {}
+        }
     
-    async def _replay_realtime(self, messages: List[Dict], file_path: Path):
-        """Replay at original speed"""
-        with gzip.open(file_path, 'rt') as f:
-            prev_timestamp = None
+    async def _replay_realtime(self, messages: Iterator[MarketMessage]):
+        """
+        Replay at original speed
+        
+        Each message is due at an absolute deadline computed from the first
+        message, so sleep jitter and send time do not accumulate.
+        """
+        scheduler = ReplayScheduler(
+            speed_multiplier=self.speed_multiplier,
+            max_idle_gap=self.max_idle_gap,
+            coalesce_window=self.coalesce_window,
+            spin_threshold=self.spin_threshold
+        )
+        self._reset_stats()
+        coalesced = 0
+        
+        while self.is_playing:
+            # Check before taking a message so pausing does not lose one
+            msg = next(messages, None)
+            if msg is None:
+                break
             
-            for msg_index in messages:
-                if not self.is_playing:
-                    break
-                
-                # Read message from file
-                f.seek(msg_index['file_offset'])
-                line = f.readline()
-                msg = MarketMessage.from_json(line)
-                
-                # Calculate delay
-                if prev_timestamp:
-                    delay = (msg.timestamp - prev_timestamp) / self.speed_multiplier
-                    if delay > 0:
-                        await asyncio.sleep(delay)
-                
-                # Publish message
-                await self._publish_message(msg)
-                
-                prev_timestamp = msg.timestamp
-                self.current_position += 1
-    
-    async def _replay_fast(self, messages: List[Dict], file_path: Path):
-        """Replay as fast as possible"""
-        with gzip.open(file_path, 'rt') as f:
-            for msg_index in messages:
-                if not self.is_playing:
-                    break
-                
-                # Read and publish message
-                f.seek(msg_index['file_offset'])
-                line = f.readline()
-                msg = MarketMessage.from_json(line)
-                
-                await self._publish_message(msg)
-                self.current_position += 1
-                
-                # Small delay to prevent overwhelming
-                await asyncio.sleep(0.001)
+            deadline = scheduler.deadline(msg.timestamp)
+            if await scheduler.wait_until(deadline):
+                coalesced = 0
+            else:
+                # Still let other tasks run when far behind schedule
+                coalesced += 1
+                if coalesced >= self.batch_size:
+                    coalesced = 0
+                    await asyncio.sleep(0)
+            
+            # Publish message
+            await self._publish_message(msg)
+            scheduler.record_lag(deadline)
+            
+            self.current_position += 1
+        
+        self.replay_stats.update({
+            'messages_sent': scheduler.lag_count,
+            'compressed_idle_seconds': scheduler.skipped,
+            'lag': scheduler.lag_percentiles()
+        })
+        self.logger.info(f"Replay lag: {self.replay_stats['lag']}")
+    
+    async def _replay_fast(self, messages: Iterator[MarketMessage]):
+        """
+        Replay as fast as possible
+        
+        Messages are sent in batches of batch_size, yielding to the event
+        loop between batches. When target_rate is set, a token bucket
+        refilled at that rate paces the batches.
+        """
+        self._reset_stats()
+        started = time.perf_counter()
+        sent = 0
+        tokens = float(self.batch_size)
+        last_refill = started
+        
+        while self.is_playing:
+            batch = list(itertools.islice(messages, self.batch_size))
+            if not batch:
+                break
+            
+            if self.target_rate:
+                now = time.perf_counter()
+                tokens = min(float(self.batch_size), tokens + (now - last_refill) * self.target_rate)
+                last_refill = now
+                if tokens < len(batch):
+                    await asyncio.sleep((len(batch) - tokens) / self.target_rate)
+                    tokens = float(len(batch))
+                    last_refill = time.perf_counter()
+                tokens -= len(batch)
+            
+            await self._publish_batch(batch)
+            sent += len(batch)
+            self.current_position += len(batch)
+            
+            # Let other tasks run between batches
+            await asyncio.sleep(0)
+        
+        elapsed = time.perf_counter() - started
+        self.replay_stats.update({
+            'messages_sent': sent,
+            'elapsed': elapsed,
+            'messages_per_second': sent / elapsed if elapsed > 0 else 0
+        })
+        self.logger.info(f"Replayed {sent} messages in {elapsed:.2f}s "
+                         f"({self.replay_stats['messages_per_second']:.0f} msg/s, "
+                         f"{self.replay_stats['hwm_waits']} HWM waits)")
     
-    async def _replay_accelerated(self, messages: List[Dict], file_path: Path):
+    async def _replay_accelerated(self, messages: Iterator[MarketMessage]):
         """Replay at accelerated speed"""
         # Similar to realtime but with speed multiplier
-        await self._replay_realtime(messages, file_path)
+        await self._replay_realtime(messages)
     
-    async def _replay_stepped(self, messages: List[Dict], file_path: Path):
+    async def _replay_stepped(self, messages: Iterator[MarketMessage]):
         """Manual step through messages"""
-        self.logger.info("Stepped mode - use step() method to advance")
-        # Implementation would wait for manual step() calls
+        # The feed stays open at current_position for step() calls
+        self.is_playing = False
+        self.logger.info(f"Stepped mode at position {self.current_position} - use step() to advance")
+    
+    @staticmethod
+    def _encode_message(msg: MarketMessage) -> List[bytes]:
+        """Build the topic/payload frames for a message"""
+        if isinstance(msg, RawMessage):
+            # Raw recordings are replayed byte for byte
+            return [msg.raw_topic, msg.payload]
+        return [msg.topic.encode(), json.dumps(msg.data).encode()]
     
     async def _publish_message(self, msg: MarketMessage):
         """Publish a message"""
-        topic = msg.topic.encode()
-        data = json.dumps(msg.data).encode()
-        
-        await self.socket.send_multipart([topic, data])
+        await self.socket.send_multipart(self._encode_message(msg))
         
         self.logger.debug(f"Published: {msg.topic} - {msg.symbol}")
     
+    async def _publish_batch(self, batch: List[MarketMessage]):
+        """Publish a batch of messages, waiting whenever a subscriber queue hits the HWM"""
+        for msg in batch:
+            frames = self._encode_message(msg)
+            while True:
+                try:
+                    self.send_socket.send_multipart(frames, zmq.NOBLOCK)
+                    break
+                except zmq.Again:
+                    self.replay_stats['hwm_waits'] += 1
+                    await asyncio.sleep(0.001)
+    
     async def pause(self):
         """Pause replay"""
         self.is_playing = False
         self.logger.info("Replay paused")
     
     async def resume(self):
-        """Resume replay"""
-        self.is_playing = True
-        self.logger.info("Replay resumed")
+        """Resume replay from the current position"""
+        self.logger.info(f"Replay resumed at position {self.current_position}")
+        await self.play(end_time=self.end_time)
     
     async def stop(self):
         """Stop replay server"""
         self.is_playing = False
+        self._close_stream()
+        if self.feed_index:
+            self.feed_index.close()
         
         if self.socket:
             self.socket.close()
@@ -487,30 +3096,139 @@ class ReplayAnalyzer:
         self.storage_path = Path(storage_path)
         self.db_conn = None
         self.logger = logging.getLogger(__name__)
+        
+        self.chunk_size = 100000  # Messages decoded per chunk when loading columns
+        self.stats_cache: Dict[Tuple, Dict[str, Dict]] = {}
+        self.workers = os.cpu_count() or 1  # Processes used by the batch methods
     
     def connect(self):
         """Connect to database"""
         db_path = self.storage_path / "recordings.db"
         self.db_conn = sqlite3.connect(str(db_path))
         self.db_conn.row_factory = sqlite3.Row
+        init_database(self.db_conn)
     
     def analyze_session(self, session_id: int) -> Dict[str, Any]:
-        """Analyze a recording session"""
+        """Analyze a recording session; a sharded session is analyzed across its shards"""
         cursor = self.db_conn.cursor()
         
         # Get session info
         cursor.execute("SELECT * FROM recording_sessions WHERE id = ?", (session_id,))
         session = dict(cursor.fetchone())
         
+        sessions = expand_shards(self.db_conn, [session])
+        session_ids = [part['id'] for part in sessions]
+        if self._has_rollups(session_ids):
+            symbols, rates = self._analyze_rollups(session_ids)
+        elif session_index_mode(session) == IndexMode.SPARSE:
+            symbols, rates = self._analyze_blocks(sessions)
+        else:
+            symbols, rates = self._analyze_index(session_ids)
+        
+        analysis = {
+            'session': session,
+            'symbols': symbols,
+            'statistics': {
+                'total_messages': session['message_count'],
+                'duration': session['end_time'] - session['start_time'] if session['end_time'] else 0,
+                'avg_rate_per_second': np.mean(rates) if rates else 0,
+                'max_rate_per_second': np.max(rates) if rates else 0,
+                'min_rate_per_second': np.min(rates) if rates else 0
+            }
+        }
+        
+        return analysis
+    
+    def _has_rollups(self, session_ids: List[int]) -> bool:
+        """Whether the recorder wrote rollups for the sessions"""
+        placeholders = ','.join(['?' for _ in session_ids])
+        return self.db_conn.execute(
+            f"SELECT 1 FROM rollups WHERE session_id IN ({placeholders}) LIMIT 1", session_ids
+        ).fetchone() is not None
+    
+    def _analyze_rollups(self, session_ids: List[int]) -> Tuple[Dict[str, Dict], List[int]]:
+        """Symbol and rate statistics from the rollups written during recording"""
+        cursor = self.db_conn.cursor()
+        placeholders = ','.join(['?' for _ in session_ids])
+        
+        cursor.execute(f"""
+            SELECT symbol, SUM(message_count) as count,
+                   MIN(first_timestamp) as first_tick,
+                   MAX(last_timestamp) as last_tick,
+                   MIN(spread_min) as min_spread,
+                   MAX(spread_max) as max_spread
+            FROM rollups
+            WHERE session_id IN ({placeholders}) AND resolution = 60
+            GROUP BY symbol
+        """, session_ids)
+        
+        symbols = {}
+        for row in cursor:
+            symbols[row['symbol']] = {
+                'count': row['count'],
+                'first_tick': row['first_tick'],
+                'last_tick': row['last_tick'],
+                'duration': row['last_tick'] - row['first_tick'],
+                'min_spread': row['min_spread'],
+                'max_spread': row['max_spread']
+            }
+        
+        cursor.execute(f"""
+            SELECT SUM(message_count) as count
+            FROM rollups
+            WHERE session_id IN ({placeholders}) AND resolution = 1
+            GROUP BY bucket
+        """, session_ids)
+        
+        rates = [row['count'] for row in cursor]
+        
+        return symbols, rates
+    
+    def get_rollups(self, session_id: int, resolution: int = 60, symbol: Optional[str] = None,
+                    start_time: Optional[float] = None,
+                    end_time: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Get per-symbol bars of a session
+        
+        Args:
+            session_id: Recording session ID
+            resolution: Bucket length in seconds, one of ROLLUP_RESOLUTIONS
+            symbol: Only return this symbol
+            start_time: Only return buckets starting at or after this time
+            end_time: Only return buckets starting at or before this time
+        """
+        query = "SELECT * FROM rollups WHERE session_id = ? AND resolution = ?"
+        params = [session_id, resolution]
+        
+        if symbol:
+            query += " AND symbol = ?"
+            params.append(symbol)
+        
+        if start_time:
+            query += " AND bucket >= ?"
+            params.append(start_time)
+        
+        if end_time:
+            query += " AND bucket <= ?"
+            params.append(end_time)
+        
+        query += " ORDER BY bucket, symbol"
+        return [dict(row) for row in self.db_conn.execute(query, params)]
+    
+    def _analyze_index(self, session_ids: List[int]) -> Tuple[Dict[str, Dict], List[int]]:
+        """Symbol and rate statistics from the per-message index"""
+        cursor = self.db_conn.cursor()
+        placeholders = ','.join(['?' for _ in session_ids])
+        
         # Get symbol statistics
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT symbol, COUNT(*) as count,
                    MIN(timestamp) as first_tick,
                    MAX(timestamp) as last_tick
             FROM message_index
-            WHERE session_id = ?
+            WHERE session_id IN ({placeholders})
             GROUP BY symbol
-        """, (session_id,))
+        """, session_ids)
         
         symbols = {}
         for row in cursor:
@@ -522,87 +3240,534 @@ class ReplayAnalyzer:
             }
         
         # Get message rate statistics
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
                 CAST(timestamp AS INTEGER) as second,
                 COUNT(*) as count
             FROM message_index
-            WHERE session_id = ?
+            WHERE session_id IN ({placeholders})
             GROUP BY CAST(timestamp AS INTEGER)
-        """, (session_id,))
+        """, session_ids)
         
         rates = [row['count'] for row in cursor]
         
-        analysis = {
-            'session': session,
-            'symbols': symbols,
-            'statistics': {
-                'total_messages': session['message_count'],
-                'duration': session['end_time'] - session['start_time'] if session['end_time'] else 0,
-                'avg_rate_per_second': np.mean(rates) if rates else 0,
-                'max_rate_per_second': np.max(rates) if rates else 0,
-                'min_rate_per_second': np.min(rates) if rates else 0
-            }
+        return symbols, rates
+    
+    def _analyze_blocks(self, sessions: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict], List[int]]:
+        """Symbol and rate statistics from the block index of sparse sessions"""
+        blocks = {session['id']: query_blocks(self.db_conn, session['id']) for session in sessions}
+        
+        # Symbol statistics come straight from the block summaries
+        symbols = {}
+        for block in itertools.chain.from_iterable(blocks.values()):
+            for symbol, (count, first_tick, last_tick) in block['symbols'].items():
+                stats = symbols.setdefault(symbol, {
+                    'count': 0,
+                    'first_tick': first_tick,
+                    'last_tick': last_tick
+                })
+                stats['count'] += count
+                stats['first_tick'] = min(stats['first_tick'], first_tick)
+                stats['last_tick'] = max(stats['last_tick'], last_tick)
+        
+        for stats in symbols.values():
+            stats['duration'] = stats['last_tick'] - stats['first_tick']
+        
+        # Per-second rates need the message timestamps
+        per_second: Dict[int, int] = {}
+        for session in sessions:
+            with SegmentFiles(self.db_conn, session) as files:
+                for segment_id, segment_blocks in itertools.groupby(blocks[session['id']],
+                                                                    key=itemgetter('segment_id')):
+                    offsets = [block['file_offset'] for block in segment_blocks]
+                    for block_messages in files.get(segment_id).scan_blocks(offsets):
+                        for msg in block_messages:
+                            second = int(msg.timestamp)
+                            per_second[second] = per_second.get(second, 0) + 1
+        
+        return symbols, list(per_second.values())
+    
+    def rebuild_catalog(self) -> int:
+        """Refresh the catalog of every completed session, returning how many were updated"""
+        session_ids = [row['id'] for row in self.db_conn.execute(
+            "SELECT id FROM recording_sessions WHERE status = 'completed'")]
+        for session_id in session_ids:
+            update_catalog(self.db_conn, session_id)
+        return len(session_ids)
+    
+    def session_symbols(self, session_id: int) -> List[str]:
+        """Symbols recorded in a session, from the catalog or else the block or message index"""
+        cataloged = [row[0] for row in self.db_conn.execute(
+            "SELECT symbol FROM symbol_catalog WHERE session_id = ? ORDER BY symbol", (session_id,))]
+        if cataloged:
+            return cataloged
+        
+        blocks = query_blocks(self.db_conn, session_id)
+        if blocks:
+            return sorted({symbol for block in blocks for symbol in block['symbols']})
+        
+        return [row[0] for row in self.db_conn.execute(
+            "SELECT DISTINCT symbol FROM message_index WHERE session_id = ? ORDER BY symbol",
+            (session_id,))]
+    
+    def _batch_tasks(self, session_ids: List[int], split_symbols: bool,
+                     symbols: Optional[List[str]] = None) -> List[Tuple[int, Optional[str]]]:
+        """(session_id, symbol) work items; symbol is None for whole sessions"""
+        if not split_symbols:
+            return [(session_id, None) for session_id in session_ids]
+        return [(session_id, symbol) for session_id in session_ids
+                for symbol in self.session_symbols(session_id)
+                if not symbols or symbol in symbols]
+    
+    def _run_batch(self, function, tasks: List[Tuple]) -> Tuple[List[Dict], Dict[str, Any]]:
+        """
+        Run tasks across a process pool
+        
+        Returns:
+            Task results and throughput per worker process and overall
+        """
+        started = time.perf_counter()
+        results = []
+        
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)) or 1) as executor:
+            futures = [executor.submit(function, str(self.storage_path), *task) for task in tasks]
+            for future in as_completed(futures):
+                results.append(future.result())
+        
+        elapsed = time.perf_counter() - started
+        workers: Dict[int, Dict[str, Any]] = {}
+        for result in results:
+            worker = workers.setdefault(result['pid'], {'tasks': 0, 'messages': 0, 'busy_seconds': 0.0})
+            worker['tasks'] += 1
+            worker['messages'] += result['messages']
+            worker['busy_seconds'] += result['elapsed']
+        
+        for worker in workers.values():
+            worker['messages_per_second'] = \
+                worker['messages'] / worker['busy_seconds'] if worker['busy_seconds'] > 0 else 0
+        
+        total = sum(result['messages'] for result in results)
+        throughput = {
+            'workers': workers,
+            'tasks': len(results),
+            'messages': total,
+            'elapsed': elapsed,
+            'messages_per_second': total / elapsed if elapsed > 0 else 0
         }
+        self.logger.info(f"Processed {total} messages in {len(results)} tasks on "
+                         f"{len(workers)} workers in {elapsed:.2f}s "
+                         f"({throughput['messages_per_second']:.0f} msg/s)")
+        return results, throughput
+    
+    def export_sessions(self, session_ids: Optional[List[int]], output_path: str,
+                        export_format: Optional[str] = None, split_symbols: bool = False,
+                        symbols: Optional[List[str]] = None, start_time: Optional[float] = None,
+                        end_time: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Export several sessions in parallel with export_columnar
         
-        return analysis
+        Each session is written to output_path/session_<id>. With
+        split_symbols every symbol of a session is a separate task written
+        to a symbol=<SYMBOL> partition, and the parts are merged into one
+        manifest per session.
+        
+        Args:
+            session_ids: Sessions to export, or None for every session the
+                catalog shows covering symbols from start_time to end_time
+            symbols, start_time, end_time: Filters applied to every session
+        
+        Returns:
+            Manifests by session ID and worker throughput
+        """
+        if session_ids is None:
+            with SessionReader(self.storage_path) as reader:
+                session_ids = [session['id'] for session in
+                               reader.find_sessions(start_time, end_time, symbols)]
+        
+        output = Path(output_path)
+        results, throughput = self._run_batch(
+            _export_task, [(session_id, symbol, str(output / f"session_{session_id}"), export_format,
+                            symbols, start_time, end_time)
+                           for session_id, symbol in self._batch_tasks(session_ids, split_symbols, symbols)])
+        
+        manifests = {}
+        for result in sorted(results, key=lambda r: (r['session_id'], r['symbol'] or '')):
+            manifest = result['manifest']
+            if result['symbol'] is None:
+                manifests[result['session_id']] = manifest
+                continue
+            
+            merged = manifests.setdefault(result['session_id'], dict(
+                manifest, symbols=None, partition_by_symbol=True, rows=0, fields={}, parts=[]))
+            merged['rows'] += manifest['rows']
+            for name, column_type in manifest['fields'].items():
+                known = merged['fields'].setdefault(name, column_type)
+                if known != column_type:
+                    merged['fields'][name] = 'float64' if {known, column_type} == {'int64', 'float64'} \
+                        else 'string'
+            for part in manifest['parts']:
+                merged['parts'].append(dict(part, symbol=result['symbol'],
+                                            path=f"symbol={result['symbol']}/{part['path']}"))
+        
+        if split_symbols:
+            for session_id, manifest in manifests.items():
+                (output / f"session_{session_id}" / 'manifest.json').write_text(
+                    json.dumps(manifest, indent=2))
+        
+        return {'manifests': manifests, 'throughput': throughput}
     
-    def export_to_csv(self, session_id: int, output_path: str, symbol: Optional[str] = None):
-        """Export session data to CSV"""
-        import csv
+    def analyze_sessions(self, session_ids: List[int], gap_threshold: float = 5.0,
+                         split_symbols: bool = False) -> Dict[str, Any]:
+        """
+        Compute microstructure_stats for several sessions in parallel
         
-        # Get messages
-        query = """
-            SELECT m.*, s.file_path
-            FROM message_index m
-            JOIN recording_sessions s ON m.session_id = s.id
-            WHERE m.session_id = ?
+        Returns:
+            Per-symbol statistics by session ID and worker throughput
         """
-        params = [session_id]
+        results, throughput = self._run_batch(
+            _analyze_task, [(session_id, symbol, gap_threshold)
+                            for session_id, symbol in self._batch_tasks(session_ids, split_symbols)])
         
-        if symbol:
-            query += " AND m.symbol = ?"
-            params.append(symbol)
+        stats: Dict[int, Dict[str, Dict]] = {session_id: {} for session_id in session_ids}
+        for result in results:
+            stats[result['session_id']].update(result['stats'])
         
-        query += " ORDER BY m.timestamp"
+        return {'stats': stats, 'throughput': throughput}
+    
+    def load_columns(self, session_id: int, symbols: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Load the timestamp, symbol, bid and ask columns of a session
         
-        cursor = self.db_conn.cursor()
-        cursor.execute(query, params)
-        
-        # Open output file
-        with open(output_path, 'w', newline='') as csvfile:
-            writer = None
-            file_path = None
-            file_handle = None
-            
-            for row in cursor:
-                # Open data file if needed
-                if file_path != row['file_path']:
-                    if file_handle:
-                        file_handle.close()
-                    file_path = row['file_path']
-                    file_handle = gzip.open(file_path, 'rt')
-                
-                # Read message
-                file_handle.seek(row['file_offset'])
-                line = file_handle.readline()
-                msg = MarketMessage.from_json(line)
-                
-                # Create CSV writer with headers from first message
-                if writer is None:
-                    fieldnames = ['timestamp', 'symbol'] + list(msg.data.keys())
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                
-                # Write row
-                row_data = {'timestamp': msg.timestamp, 'symbol': msg.symbol}
-                row_data.update(msg.data)
-                writer.writerow(row_data)
+        Messages are streamed in chunks of chunk_size, so memory holds the
+        columns plus one chunk of decoded messages. The symbol column holds
+        codes into the returned 'symbols' array; missing prices are NaN.
+        """
+        codes: Dict[str, int] = {}
+        chunks = []
+        
+        with SessionReader(self.storage_path) as reader:
+            for batch in reader.iter_session(session_id, symbols, batch=self.chunk_size):
+                count = len(batch)
+                datas = [msg.data for msg in batch]
+                chunks.append((
+                    np.fromiter((msg.timestamp for msg in batch), dtype=np.float64, count=count),
+                    np.fromiter((codes.setdefault(msg.symbol, len(codes)) for msg in batch),
+                                dtype=np.int32, count=count),
+                    np.array([_price(data, 'bid') for data in datas], dtype=np.float64),
+                    np.array([_price(data, 'ask') for data in datas], dtype=np.float64)
+                ))
+        
+        columns = {
+            name: np.concatenate([chunk[i] for chunk in chunks]) if chunks else np.empty(0, dtype)
+            for i, (name, dtype) in enumerate([('timestamp', np.float64), ('symbol', np.int32),
+                                               ('bid', np.float64), ('ask', np.float64)])
+        }
+        columns['symbols'] = np.array(list(codes), dtype=object)
+        return columns
+    
+    def microstructure_stats(self, session_id: int, gap_threshold: float = 5.0,
+                             symbols: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Per-symbol inter-arrival, spread, volatility and gap statistics
+        
+        Results for completed sessions are cached, so repeat calls are free.
+        
+        Args:
+            session_id: Recording session ID
+            gap_threshold: Silences longer than this many seconds count as gaps
+            symbols: Only analyze these symbols
+        """
+        key = (session_id, gap_threshold, tuple(symbols) if symbols else None)
+        if key in self.stats_cache:
+            return self.stats_cache[key]
+        
+        columns = self.load_columns(session_id, symbols)
+        
+        # Group rows by symbol; a stable sort keeps each group in time order
+        order = np.argsort(columns['symbol'], kind='stable')
+        codes = columns['symbol'][order]
+        bounds = np.searchsorted(codes, np.arange(len(columns['symbols']) + 1))
+        
+        stats = {}
+        for code, symbol in enumerate(columns['symbols']):
+            rows = order[bounds[code]:bounds[code + 1]]
+            stats[symbol] = self._symbol_stats(columns['timestamp'][rows], columns['bid'][rows],
+                                               columns['ask'][rows], gap_threshold)
+        
+        row = self.db_conn.execute("SELECT status FROM recording_sessions WHERE id = ?",
+                                   (session_id,)).fetchone()
+        if row and row['status'] == 'completed':
+            self.stats_cache[key] = stats
+        
+        return stats
+    
+    @staticmethod
+    def _symbol_stats(timestamps: np.ndarray, bid: np.ndarray, ask: np.ndarray,
+                      gap_threshold: float) -> Dict[str, Any]:
+        """Statistics of one symbol's time-ordered columns"""
+        def summary(values: np.ndarray) -> Dict[str, float]:
+            if not values.size:
+                return {}
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            return {'mean': float(values.mean()), 'p50': float(p50), 'p90': float(p90),
+                    'p99': float(p99), 'max': float(values.max())}
+        
+        intervals = np.diff(timestamps)
+        
+        spread = ask - bid
+        spread = spread[~np.isnan(spread)]
+        
+        # Tick-to-tick log returns of the mid price
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.diff(np.log((bid + ask) / 2))
+        returns = returns[np.isfinite(returns)]
+        
+        gaps = intervals > gap_threshold
+        
+        return {
+            'count': int(timestamps.size),
+            'inter_arrival': summary(intervals),
+            'spread': summary(spread),
+            'volatility': float(returns.std()) if returns.size else 0.0,
+            'gaps': {
+                'count': int(gaps.sum()),
+                'total': float(intervals[gaps].sum()),
+                'max': float(intervals[gaps].max()) if gaps.any() else 0.0,
+                'starts': timestamps[:-1][gaps].tolist()
+            }
+        }
+    
+    def export_to_csv(self, session_id: int, output_path: str, symbol: Optional[str] = None):
+        """
+        Export session data to CSV
+        
+        Rows are streamed to a temporary file while the set of fields grows,
+        then written after a header that covers every field.
+        """
+        import csv
+        import shutil
+        import tempfile
+        
+        fieldnames = ['timestamp', 'symbol']
+        known = set(fieldnames)
+        
+        with tempfile.TemporaryFile('w+', newline='') as body:
+            writer = csv.writer(body)
+            
+            with SessionReader(self.storage_path) as reader:
+                for msg in reader.iter_session(session_id, [symbol] if symbol else None):
+                    data = msg.data
+                    for field in data:
+                        if field not in known:
+                            known.add(field)
+                            fieldnames.append(field)
+                    
+                    # Write row
+                    row_data = {'timestamp': msg.timestamp, 'symbol': msg.symbol}
+                    row_data.update(data)
+                    writer.writerow([row_data.get(name, '') for name in fieldnames])
             
-            if file_handle:
-                file_handle.close()
+            body.seek(0)
+            with open(output_path, 'w', newline='') as csvfile:
+                csv.writer(csvfile).writerow(fieldnames)
+                shutil.copyfileobj(body, csvfile)
         
         self.logger.info(f"Exported to {output_path}")
+    
+    def export_columnar(self, session_id: int, output_path: str, symbols: Optional[List[str]] = None,
+                        start_time: Optional[float] = None, end_time: Optional[float] = None,
+                        export_format: Optional[str] = None,
+                        partition_by_symbol: bool = False) -> Dict[str, Any]:
+        """
+        Export a session to typed columnar files
+        
+        Messages are streamed in chunks of chunk_size and written as part
+        files, so memory stays bounded by the chunk size (per symbol when
+        partitioning). A manifest.json lists the parts and column types;
+        load_export() reads an export back into NumPy arrays.
+        
+        Args:
+            session_id: Recording session ID
+            output_path: Directory to write; parts go to symbol=<SYMBOL>/
+                subdirectories with partition_by_symbol
+            symbols: Only export these symbols
+            start_time: Only export messages at or after this timestamp
+            end_time: Only export messages at or before this timestamp
+            export_format: 'parquet' or 'arrow' (require pyarrow) or 'npz';
+                defaults to parquet when pyarrow is installed, else npz
+            partition_by_symbol: Write each symbol's rows to its own directory
+        
+        Returns:
+            The export manifest
+        """
+        export_format = export_format or ('parquet' if USE_PYARROW else 'npz')
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        if export_format != 'npz' and not USE_PYARROW:
+            raise ImportError(f"pyarrow is required for {export_format} export")
+        
+        output = Path(output_path)
+        output.mkdir(parents=True, exist_ok=True)
+        
+        manifest = {
+            'session_id': session_id,
+            'format': export_format,
+            'symbols': symbols,
+            'start_time': start_time,
+            'end_time': end_time,
+            'partition_by_symbol': partition_by_symbol,
+            'rows': 0,
+            'fields': {},
+            'parts': []
+        }
+        pending: Dict[Optional[str], List[Dict[str, np.ndarray]]] = {}
+        pending_rows: Dict[Optional[str], int] = {}
+        
+        def write_part(partition: Optional[str]):
+            columns = concat_columns(pending.pop(partition))
+            rows = pending_rows.pop(partition)
+            directory = output / f"symbol={partition}" if partition is not None else output
+            directory.mkdir(exist_ok=True)
+            
+            index = sum(1 for part in manifest['parts'] if part['symbol'] == partition)
+            part_path = directory / f"part-{index:05d}{EXPORT_FORMATS[export_format]}"
+            write_column_file(part_path, columns, export_format)
+            
+            for name, values in columns.items():
+                column_type = _column_type(values)
+                known = manifest['fields'].setdefault(name, column_type)
+                if known != column_type:
+                    both = {known, column_type}
+                    manifest['fields'][name] = 'float64' if both == {'int64', 'float64'} else 'string'
+            
+            manifest['parts'].append({'path': str(part_path.relative_to(output)),
+                                      'symbol': partition, 'rows': rows})
+            manifest['rows'] += rows
+        
+        def add(partition: Optional[str], columns: Dict[str, np.ndarray]):
+            pending.setdefault(partition, []).append(columns)
+            pending_rows[partition] = pending_rows.get(partition, 0) + len(columns['timestamp'])
+            if pending_rows[partition] >= self.chunk_size:
+                write_part(partition)
+        
+        with SessionReader(self.storage_path) as reader:
+            for columns in reader.iter_session(session_id, symbols, start_time, end_time,
+                                               batch=self.chunk_size, columns=True):
+                if not partition_by_symbol:
+                    add(None, columns)
+                    continue
+                
+                for symbol in np.unique(columns['symbol']):
+                    mask = columns['symbol'] == symbol
+                    add(symbol, {name: values[mask] for name, values in columns.items()})
+        
+        for partition in list(pending):
+            write_part(partition)
+        
+        (output / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+        self.logger.info(f"Exported {manifest['rows']} messages in {len(manifest['parts'])} "
+                         f"{export_format} parts to {output_path}")
+        return manifest
+
+
+def _export_task(storage_path: str, session_id: int, symbol: Optional[str],
+                 output_path: str, export_format: Optional[str], symbols: Optional[List[str]],
+                 start_time: Optional[float], end_time: Optional[float]) -> Dict[str, Any]:
+    """Process pool worker for ReplayAnalyzer.export_sessions"""
+    started = time.perf_counter()
+    analyzer = ReplayAnalyzer(storage_path)
+    analyzer.connect()
+    
+    try:
+        if symbol is None:
+            manifest = analyzer.export_columnar(session_id, output_path, symbols, start_time, end_time,
+                                                export_format=export_format)
+        else:
+            manifest = analyzer.export_columnar(session_id, str(Path(output_path) / f"symbol={symbol}"),
+                                                [symbol], start_time, end_time,
+                                                export_format=export_format)
+    finally:
+        analyzer.db_conn.close()
+    
+    return {
+        'pid': os.getpid(),
+        'session_id': session_id,
+        'symbol': symbol,
+        'manifest': manifest,
+        'messages': manifest['rows'],
+        'elapsed': time.perf_counter() - started
+    }
+
+
+def _analyze_task(storage_path: str, session_id: int, symbol: Optional[str],
+                  gap_threshold: float) -> Dict[str, Any]:
+    """Process pool worker for ReplayAnalyzer.analyze_sessions"""
+    started = time.perf_counter()
+    analyzer = ReplayAnalyzer(storage_path)
+    analyzer.connect()
+    
+    try:
+        stats = analyzer.microstructure_stats(session_id, gap_threshold,
+                                              [symbol] if symbol else None)
+    finally:
+        analyzer.db_conn.close()
+    
+    return {
+        'pid': os.getpid(),
+        'session_id': session_id,
+        'symbol': symbol,
+        'stats': stats,
+        'messages': sum(symbol_stats['count'] for symbol_stats in stats.values()),
+        'elapsed': time.perf_counter() - started
+    }
+
+
+def _recover_task(file_path: str, blocks: List[BlockInfo], full_index: bool) -> Dict[str, Any]:
+    """Process pool worker for SessionRecovery.rebuild: index a run of blocks of one file"""
+    intact: List[BlockInfo] = []
+    block_rows = []
+    message_rows = []
+    torn = False
+    
+    with RecordingFile(file_path) as f:
+        def messages() -> Iterator[MarketMessage]:
+            nonlocal torn
+            try:
+                for block, block_messages in zip(blocks, f.scan_blocks([block.offset for block in blocks])):
+                    intact.append(block)
+                    block_rows.append((block.offset, block.first_timestamp, block.last_timestamp,
+                                       block.message_count, json.dumps(summarize_symbols(block_messages))))
+                    if full_index:
+                        message_rows.extend((msg.timestamp, msg.topic, msg.symbol, block.offset, i)
+                                            for i, msg in enumerate(block_messages))
+                    yield from block_messages
+            except BlockFormatError:
+                torn = True
+        
+        rollups = rollup_messages(messages())
+    
+    return {
+        'blocks': intact,
+        'block_rows': block_rows,
+        'messages': message_rows,
+        'rollups': rollups,
+        'torn': torn
+    }
+
+
+def _shard_worker(storage_path: str, address: str, session_id: int, file_path: str,
+                  index_mode: str, raw: bool, settings: Dict[str, Any]):
+    """Process entry point of a ShardedRecorder shard"""
+    recorder = MessageRecorder(storage_path, address, IndexMode(index_mode), raw)
+    recorder.socket_type = zmq.PULL
+    recorder.forwarded = True
+    recorder.session_id = session_id
+    recorder.current_file = Path(file_path)
+    recorder.start_time = time.time()
+    for name, value in settings.items():
+        setattr(recorder, name, value)
+    
+    asyncio.run(recorder.start())
 
 
 # Example usage
@@ -652,6 +3817,15 @@ def analyze_example():
     analyzer.export_to_csv(1, "/tmp/mt4_data.csv", symbol="EURUSD")
 
 
+def recover_example():
+    """Example recovery after a recorder crash"""
+    recovery = SessionRecovery("/tmp/mt4_recordings")
+    recovery.connect()
+    
+    for stats in recovery.recover_all():
+        print(f"Recovered session {stats['session_id']}: {stats['messages']} messages")
+
+
 if __name__ == "__main__":
     import sys
     
@@ -662,5 +3836,7 @@ if __name__ == "__main__":
             asyncio.run(replay_example())
         elif sys.argv[1] == "analyze":
             analyze_example()
+        elif sys.argv[1] == "recover":
+            recover_example()
     else:
-        print("Usage: python message_replay.py [record|replay|analyze]")
\ No newline at end of file
+        print("Usage: python message_replay.py [record|replay|analyze|recover]")
\ No newline at end of file
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Packed binary tick protocol
+Frame layout shared by the WebSocket server and client
+"""
+
+import struct
+
+# Frame header: batch seq (0 for a single tick), tick count
+PACKED_HEADER = struct.Struct('<IH')
+
+# Fixed-size tick: symbol ID followed by PACKED_FIELDS
+PACKED_TICK = struct.Struct('<Hdddqd')
+PACKED_FIELDS = ('bid', 'ask', 'spread', 'volume', 'timestamp')
+
+# Symbol IDs are unsigned 16-bit and start at 1
+MAX_SYMBOL_ID = 0xFFFF
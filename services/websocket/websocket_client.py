@@ -10,9 +10,21 @@ import json
 import time
 import jwt
 import logging
-from typing import Optional, List, Dict, Callable, Set
+from typing import Optional, List, Dict, Callable, Set, Any
 from datetime import datetime
 import aiohttp
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from services.websocket.tick_protocol import PACKED_HEADER, PACKED_TICK, PACKED_FIELDS
+
+try:
+    import msgpack
+    USE_MSGPACK = True
+except ImportError:
+    USE_MSGPACK = False
 
 
 class MT4WebSocketClient:
@@ -21,7 +33,8 @@ class MT4WebSocketClient:
     def __init__(self, 
                  url: str = "ws://localhost:8765",
                  token: Optional[str] = None,
-                 debug: bool = False):
+                 debug: bool = False,
+                 protocol: str = 'json'):
         """
         Initialize WebSocket client
         
@@ -29,16 +42,23 @@ class MT4WebSocketClient:
             url: WebSocket server URL
             token: JWT authentication token
             debug: Enable debug logging
+            protocol: Tick encoding ('json', 'packed' or 'msgpack')
         """
+        if protocol == 'msgpack' and not USE_MSGPACK:
+            raise ValueError("msgpack protocol requires the msgpack package")
+        
         self.url = url
         self.token = token
         self.debug = debug
+        self.protocol = protocol
+        self.symbol_names: Dict[int, str] = {}
         
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self.client_id: Optional[str] = None
         self.authenticated = False
         self.tier = 'free'
         self.subscriptions: Set[str] = set()
+        self.batch_seq = 0
         
         # Event handlers
         self.handlers: Dict[str, List[Callable]] = {}
@@ -85,7 +105,10 @@ class MT4WebSocketClient:
         for attempt in range(self.max_reconnect_attempts):
             try:
                 self.logger.info(f"Connecting to {self.url}...")
-                self.ws = await websockets.connect(self.url)
+                url = self.url
+                if self.protocol != 'json':
+                    url += ('&' if '?' in url else '?') + f'protocol={self.protocol}'
+                self.ws = await websockets.connect(url)
                 
                 # Start receive loop
                 self.receive_task = asyncio.create_task(self._receive_loop())
@@ -170,6 +193,14 @@ class MT4WebSocketClient:
             'symbols': symbols
         })
     
+    async def set_batching(self, window_ms: int = 10, max_ticks: int = 64):
+        """Receive ticks in micro-batched frames (window_ms=0 disables)"""
+        await self.send({
+            'type': 'set_batching',
+            'window_ms': window_ms,
+            'max_ticks': max_ticks
+        })
+    
     async def get_stats(self):
         """Request server statistics (premium feature)"""
         await self.send({
@@ -191,7 +222,10 @@ class MT4WebSocketClient:
         try:
             async for message in self.ws:
                 try:
-                    data = json.loads(message)
+                    if isinstance(message, bytes):
+                        data = self._decode_binary(message)
+                    else:
+                        data = json.loads(message)
                     await self._handle_message(data)
                 except json.JSONDecodeError as e:
                     self.logger.error(f"Failed to parse message: {e}")
@@ -204,6 +238,23 @@ class MT4WebSocketClient:
             # Attempt reconnection
             asyncio.create_task(self.connect())
     
+    def _decode_binary(self, message: bytes) -> Dict:
+        """Decode a binary tick frame into its JSON equivalent"""
+        if self.protocol == 'msgpack':
+            return msgpack.unpackb(message)
+        
+        seq, count = PACKED_HEADER.unpack_from(message)
+        body = message[PACKED_HEADER.size:PACKED_HEADER.size + count * PACKED_TICK.size]
+        ticks = []
+        for symbol_id, *values in PACKED_TICK.iter_unpack(body):
+            tick = dict(zip(PACKED_FIELDS, values))
+            tick['symbol'] = self.symbol_names.get(symbol_id, str(symbol_id))
+            ticks.append(tick)
+        
+        if seq:
+            return {'type': 'ticks', 'seq': seq, 'data': ticks}
+        return {'type': 'tick', 'data': ticks[0]}
+    
     async def _handle_message(self, data: Dict):
         """Handle incoming message"""
         if self.debug:
@@ -214,6 +265,8 @@ class MT4WebSocketClient:
         # Handle specific message types
         if msg_type == 'welcome':
             self.client_id = data.get('client_id')
+            self.batch_seq = 0
+            self.symbol_names = {}
             self.heartbeat_interval = data.get('heartbeat_interval', 30)
             # Start heartbeat
             if self.heartbeat_task:
@@ -233,9 +286,27 @@ class MT4WebSocketClient:
             # Emit market data event
             await self.emit('market_data', data.get('data'))
         
+        elif msg_type == 'ticks':
+            # Micro-batched ticks carry a sequence number per frame
+            seq = data.get('seq', 0)
+            if seq != self.batch_seq + 1:
+                self.logger.warning(f"Batch sequence gap: expected {self.batch_seq + 1}, got {seq}")
+            self.batch_seq = seq
+            
+            for tick in data.get('data', []):
+                await self.emit('market_data', tick)
+        
         elif msg_type == 'subscribed':
+            self.symbol_names.update({v: k for k, v in data.get('symbol_ids', {}).items()})
             self.logger.info(f"Subscribed to: {data.get('symbols')}")
         
+        elif msg_type == 'protocol':
+            self.symbol_names.update({v: k for k, v in data.get('symbol_ids', {}).items()})
+            self.logger.info(f"Using protocol: {data.get('protocol')}")
+        
+        elif msg_type == 'symbol_ids':
+            self.symbol_names.update({v: k for k, v in data.get('symbol_ids', {}).items()})
+        
         elif msg_type == 'error':
             self.logger.error(f"Server error: {data.get('error')}")
         
@@ -13,16 +13,25 @@ import logging
 import time
 import jwt
 import hashlib
-from typing import Set, Dict, Optional, List
+import math
+from typing import Set, Dict, Optional, List, Tuple, Deque, Hashable, Union
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, asdict
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from services.rate_limiter.rate_limiter import RateLimiter, TokenBucket
+from services.websocket.tick_protocol import PACKED_HEADER, PACKED_TICK, MAX_SYMBOL_ID
 
+try:
+    import msgpack
+    USE_MSGPACK = True
+except ImportError:
+    USE_MSGPACK = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,6 +43,27 @@ WS_PORT = int(os.environ.get('WS_PORT', 8765))
 ZMQ_PUBLISHER = os.environ.get('ZMQ_PUBLISHER', 'tcp://localhost:5556')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
 HEARTBEAT_INTERVAL = 30  # seconds
+SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', 256))  # control frames per client
+TIMER_WHEEL_RESOLUTION = 0.01  # seconds per wheel slot
+TIMER_WHEEL_SLOTS = 512
+BATCH_WINDOW_MS = 10  # default micro-batch window
+MAX_BATCH_WINDOW_MS = 100
+BATCH_MAX_TICKS = 64
+
+# Tick frames are assembled around an already encoded MarketTick
+TICK_FRAME = '{"type": "tick", "data": %s}'
+TICKS_FRAME = '{"type": "ticks", "seq": %d, "data": [%s]}'
+
+Frame = Union[str, bytes]
+
+# Message rate of each tier (msg/sec). Tick updates per symbol are spaced
+# so that all of a client's subscriptions together stay within it.
+TIER_MESSAGE_RATES = {
+    'free': 10,
+    'basic': 50,
+    'premium': 100,
+    'unlimited': 1000
+}
 
 
 @dataclass
@@ -51,6 +81,189 @@ class MarketTick:
         return json.dumps(asdict(self))
 
 
+class SendQueue:
+    """Outbound frame queue for one client
+    
+    Control frames are kept in order and never dropped. Ticks are held in
+    a latest-value map keyed by symbol: a new tick replaces the pending
+    one of its symbol in place, so the queue never holds more ticks than
+    the client has subscriptions and a slow client always gets current
+    prices. Control frames are sent before pending ticks.
+    
+    At most maxsize control frames can wait. A client that falls further
+    behind is not reading its socket; the queue then closes and reports
+    the overflow so the client can be disconnected.
+    """
+    
+    def __init__(self, maxsize: int = SEND_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.control: Deque[Frame] = deque()
+        self.ticks: 'OrderedDict[str, Frame]' = OrderedDict()
+        self.conflated = 0
+        self.overflowed = False
+        self.closed = False
+        self._ready = asyncio.Event()
+    
+    def __len__(self) -> int:
+        return len(self.control) + len(self.ticks)
+    
+    def put(self, frame: Frame, symbol: Optional[str] = None) -> bool:
+        """Queue a control frame, or an encoded tick with its symbol
+        
+        Returns False when the queue is closed, or when the control frame
+        overflows it.
+        """
+        if self.closed:
+            return False
+        
+        if symbol is None:
+            if len(self.control) >= self.maxsize:
+                self.overflowed = True
+                self.close()
+                return False
+            self.control.append(frame)
+        else:
+            if symbol in self.ticks:
+                self.conflated += 1
+            self.ticks[symbol] = frame
+        
+        self._ready.set()
+        return True
+    
+    async def get(self) -> Optional[Tuple[Optional[str], Frame]]:
+        """Wait for the next (symbol, frame) entry, None once closed"""
+        while not self.control and not self.ticks:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        
+        if self.control:
+            return None, self.control.popleft()
+        return self.ticks.popitem(last=False)
+    
+    def pop_tick(self) -> Optional[Frame]:
+        """Take the next pending tick unless a control frame is waiting"""
+        if self.ticks and not self.control:
+            return self.ticks.popitem(last=False)[1]
+        return None
+    
+    async def wait(self, timeout: float):
+        """Wait up to timeout seconds for a new entry"""
+        if self.control or self.ticks or self.closed:
+            return
+        
+        self._ready.clear()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    def discard(self, symbol: str):
+        """Drop the pending tick of a symbol"""
+        self.ticks.pop(symbol, None)
+    
+    def discard_ticks(self):
+        """Drop every pending tick, keeping control frames"""
+        self.ticks.clear()
+    
+    def close(self):
+        """Stop accepting frames and wake the writer"""
+        self.closed = True
+        self.control.clear()
+        self.ticks.clear()
+        self._ready.set()
+
+
+class JsonTickCodec:
+    """Text tick frames (the default protocol)"""
+    
+    def encode(self, tick: MarketTick, symbol_id: int) -> str:
+        return tick.to_json()
+    
+    def frame(self, payload: str) -> str:
+        return TICK_FRAME % payload
+    
+    def batch(self, seq: int, payloads: List[str]) -> str:
+        return TICKS_FRAME % (seq, ','.join(payloads))
+
+
+class MsgpackTickCodec:
+    """MessagePack tick frames, same structure as the JSON ones"""
+    
+    def encode(self, tick: MarketTick, symbol_id: int) -> bytes:
+        return msgpack.packb(asdict(tick))
+    
+    def frame(self, payload: bytes) -> bytes:
+        packer = msgpack.Packer()
+        return (packer.pack_map_header(2) + packer.pack('type') + packer.pack('tick') +
+                packer.pack('data') + payload)
+    
+    def batch(self, seq: int, payloads: List[bytes]) -> bytes:
+        packer = msgpack.Packer()
+        return (packer.pack_map_header(3) + packer.pack('type') + packer.pack('ticks') +
+                packer.pack('seq') + packer.pack(seq) +
+                packer.pack('data') + packer.pack_array_header(len(payloads)) +
+                b''.join(payloads))
+
+
+class PackedTickCodec:
+    """Fixed-layout binary tick frames (see PACKED_HEADER / PACKED_TICK)"""
+    
+    def encode(self, tick: MarketTick, symbol_id: int) -> bytes:
+        return PACKED_TICK.pack(symbol_id, tick.bid, tick.ask, tick.spread,
+                                int(tick.volume), tick.timestamp)
+    
+    def frame(self, payload: bytes) -> bytes:
+        return PACKED_HEADER.pack(0, 1) + payload
+    
+    def batch(self, seq: int, payloads: List[bytes]) -> bytes:
+        return PACKED_HEADER.pack(seq, len(payloads)) + b''.join(payloads)
+
+
+# Wire protocols a client can negotiate
+TICK_CODECS = {
+    'json': JsonTickCodec(),
+    'packed': PackedTickCodec()
+}
+if USE_MSGPACK:
+    TICK_CODECS['msgpack'] = MsgpackTickCodec()
+
+
+class TimerWheel:
+    """Hashed timer wheel for throttled symbol deadlines
+    
+    Scheduling and expiry are O(1) per key regardless of how many
+    subscriptions are pending, at the cost of RESOLUTION-sized precision.
+    """
+    
+    def __init__(self, resolution: float = TIMER_WHEEL_RESOLUTION, slots: int = TIMER_WHEEL_SLOTS):
+        self.resolution = resolution
+        self.slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self.cursor = 0
+    
+    def schedule(self, key: Hashable, delay: float):
+        """Fire key once after delay seconds"""
+        ticks = max(1, math.ceil(delay / self.resolution))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot][key] = (ticks - 1) // len(self.slots)
+    
+    def advance(self) -> List[Hashable]:
+        """Move one slot forward and return the keys that expired"""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        slot = self.slots[self.cursor]
+        expired = []
+        
+        for key, rounds in list(slot.items()):
+            if rounds:
+                slot[key] = rounds - 1
+            else:
+                del slot[key]
+                expired.append(key)
+        
+        return expired
+
+
 @dataclass
 class ClientInfo:
     """WebSocket client information"""
@@ -62,6 +275,17 @@ class ClientInfo:
     last_heartbeat: float
     message_count: int
     connected_at: float
+    queue: SendQueue = field(default_factory=SendQueue)
+    writer: Optional[asyncio.Task] = None
+    throttle_ms: Dict[str, int] = field(default_factory=dict)
+    throttle_floor: float = 0.0
+    throttled: Dict[str, str] = field(default_factory=dict)
+    last_update: Dict[str, float] = field(default_factory=dict)
+    batch_window: float = 0.0
+    batch_size: int = 0
+    batch_seq: int = 0
+    protocol: str = 'json'
+    symbol_ids_sent: Set[str] = field(default_factory=set)
 
 
 class WebSocketManager:
@@ -71,13 +295,14 @@ class WebSocketManager:
         self.clients: Dict[str, ClientInfo] = {}
         self.symbol_subscribers: Dict[str, Set[str]] = {}
         self.rate_limiters = {
-            'free': RateLimiter(TokenBucket(10, 10, 1)),      # 10 msg/sec
-            'basic': RateLimiter(TokenBucket(50, 50, 1)),     # 50 msg/sec
-            'premium': RateLimiter(TokenBucket(100, 100, 1)), # 100 msg/sec
-            'unlimited': RateLimiter(TokenBucket(1000, 1000, 1))
+            tier: RateLimiter(TokenBucket(rate, rate, 1))
+            for tier, rate in TIER_MESSAGE_RATES.items()
         }
         self.zmq_context = zmq.asyncio.Context()
         self.market_data_cache: Dict[str, MarketTick] = {}
+        self.timer_wheel = TimerWheel()
+        self.symbol_ids: Dict[str, int] = {}
+        self.encode_failures: Set[Tuple[str, str]] = set()
     
     async def register_client(self, websocket: websockets.WebSocketServerProtocol, path: str) -> ClientInfo:
         """Register new WebSocket client"""
@@ -97,6 +322,7 @@ class WebSocketManager:
         )
         
         self.clients[client_id] = client
+        client.writer = asyncio.create_task(self._write_loop(client))
         logger.info(f"Client {client_id} connected from {websocket.remote_address}")
         
         # Send welcome message
@@ -104,9 +330,15 @@ class WebSocketManager:
             'type': 'welcome',
             'client_id': client_id,
             'server_time': time.time(),
-            'heartbeat_interval': HEARTBEAT_INTERVAL
+            'heartbeat_interval': HEARTBEAT_INTERVAL,
+            'protocols': list(TICK_CODECS)
         })
         
+        # Protocol requested at connect time, e.g. ws://host:port/?protocol=packed
+        protocol = parse_qs(urlparse(path or '').query).get('protocol', ['json'])[0]
+        if protocol != 'json':
+            await self.set_protocol(client_id, protocol)
+        
         return client
     
     async def unregister_client(self, client_id: str):
@@ -116,6 +348,11 @@ class WebSocketManager:
         
         client = self.clients[client_id]
         
+        # Stop the writer task
+        client.queue.close()
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        
         # Remove from all subscriptions
         for symbol in client.subscriptions:
             if symbol in self.symbol_subscribers:
@@ -134,6 +371,7 @@ class WebSocketManager:
             if client_id in self.clients:
                 self.clients[client_id].authenticated = True
                 self.clients[client_id].tier = payload.get('tier', 'basic')
+                self.update_throttle_floor(self.clients[client_id])
                 
                 await self.send_to_client(self.clients[client_id], {
                     'type': 'auth_success',
@@ -154,8 +392,16 @@ class WebSocketManager:
         
         return False
     
-    async def subscribe_client(self, client_id: str, symbols: List[str]) -> bool:
-        """Subscribe client to symbols"""
+    async def subscribe_client(self, client_id: str, symbols: List[str],
+                               throttle_ms: Optional[int] = None) -> bool:
+        """Subscribe client to symbols
+        
+        throttle_ms caps updates of these symbols to one conflated tick per
+        interval. Without it, and never faster than this, updates are spaced
+        so the client's subscriptions share the tier message rate. As that
+        floor depends on the subscription count, the reply maps every
+        subscribed symbol to its effective interval.
+        """
         if client_id not in self.clients:
             return False
         
@@ -181,8 +427,12 @@ class WebSocketManager:
         
         # Add subscriptions
         added = []
+        cached = []
         for symbol in symbols:
             symbol = symbol.upper()
+            if throttle_ms is not None:
+                client.throttle_ms[symbol] = max(int(throttle_ms), 0)
+            
             if symbol not in client.subscriptions:
                 client.subscriptions.add(symbol)
                 
@@ -192,17 +442,32 @@ class WebSocketManager:
                 
                 added.append(symbol)
                 
-                # Send cached data if available
                 if symbol in self.market_data_cache:
-                    await self.send_market_data(client, self.market_data_cache[symbol])
+                    cached.append(self.market_data_cache[symbol])
         
         if added:
-            await self.send_to_client(client, {
+            self.update_throttle_floor(client)
+            reply = {
                 'type': 'subscribed',
-                'symbols': added
-            })
+                'symbols': added,
+                'throttle_ms': {
+                    symbol: round(self.throttle_interval(client, symbol) * 1000)
+                    for symbol in sorted(client.subscriptions)
+                }
+            }
+            if client.protocol == 'packed':
+                reply['symbol_ids'] = self.known_symbol_ids(added)
+            
+            # IDs only count as sent once the reply is queued; otherwise
+            # they are announced again before the symbol's next tick
+            if await self.send_to_client(client, reply):
+                client.symbol_ids_sent.update(reply.get('symbol_ids', {}))
             logger.info(f"Client {client_id} subscribed to: {added}")
         
+        # Send cached data after the reply that carries the symbol IDs
+        for tick in cached:
+            await self.send_market_data(client, tick)
+        
         return True
     
     async def unsubscribe_client(self, client_id: str, symbols: List[str]) -> bool:
@@ -217,6 +482,10 @@ class WebSocketManager:
             symbol = symbol.upper()
             if symbol in client.subscriptions:
                 client.subscriptions.remove(symbol)
+                client.throttle_ms.pop(symbol, None)
+                client.throttled.pop(symbol, None)
+                client.last_update.pop(symbol, None)
+                client.queue.discard(symbol)
                 
                 if symbol in self.symbol_subscribers:
                     self.symbol_subscribers[symbol].discard(client_id)
@@ -226,6 +495,7 @@ class WebSocketManager:
                 removed.append(symbol)
         
         if removed:
+            self.update_throttle_floor(client)
             await self.send_to_client(client, {
                 'type': 'unsubscribed',
                 'symbols': removed
@@ -236,55 +506,286 @@ class WebSocketManager:
     
     async def send_to_client(self, client: ClientInfo, data: Dict) -> bool:
         """Send data to specific client"""
-        try:
-            # Check rate limit
-            allowed, metadata = self.rate_limiters[client.tier].check_rate_limit(client.id)
-            
-            if not allowed:
-                # Send rate limit warning
-                await client.websocket.send(json.dumps({
-                    'type': 'rate_limit',
-                    'retry_after': metadata.get('retry_after', 1)
-                }))
-                return False
-            
-            await client.websocket.send(json.dumps(data))
-            client.message_count += 1
+        return await self.send_frame(client, json.dumps(data))
+    
+    async def send_frame(self, client: ClientInfo, frame: Frame, symbol: Optional[str] = None) -> bool:
+        """Queue an already encoded frame for specific client
+        
+        With a symbol, frame is an encoded MarketTick that the writer wraps
+        into a tick frame (or a batch). Returns False when the frame was
+        refused by the tier rate limit or could not be queued.
+        """
+        # Check rate limit
+        allowed, metadata = self.rate_limiters[client.tier].check_rate_limit(client.id)
+        
+        if not allowed:
+            # Send rate limit warning
+            await self.queue_frame(client, json.dumps({
+                'type': 'rate_limit',
+                'retry_after': metadata.get('retry_after', 1)
+            }))
+            return False
+        
+        return await self.queue_frame(client, frame, symbol)
+    
+    async def queue_frame(self, client: ClientInfo, frame: Frame, symbol: Optional[str] = None) -> bool:
+        """Put a frame on a client's send queue, disconnecting the client on overflow"""
+        if client.queue.put(frame, symbol):
             return True
-            
+        
+        if client.queue.overflowed and client.id in self.clients:
+            logger.warning(f"Client {client.id} is not reading its frames, disconnecting")
+            await self.unregister_client(client.id)
+            asyncio.create_task(client.websocket.close(code=1008, reason='Send queue overflow'))
+        
+        return False
+    
+    async def _write_loop(self, client: ClientInfo):
+        """Drain a client's send queue onto its socket"""
+        try:
+            while True:
+                entry = await client.queue.get()
+                if entry is None:
+                    break
+                
+                symbol, frame = entry
+                if symbol is not None:
+                    codec = TICK_CODECS[client.protocol]
+                    if client.batch_window:
+                        frame = await self._collect_batch(client, codec, frame)
+                    else:
+                        frame = codec.frame(frame)
+                
+                await client.websocket.send(frame)
+                client.message_count += 1
+                
         except websockets.exceptions.ConnectionClosed:
-            return False
+            pass
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error sending to client {client.id}: {e}")
+        
+        await self.unregister_client(client.id)
+    
+    async def _collect_batch(self, client: ClientInfo, codec, first: Frame) -> Frame:
+        """Gather queued ticks for up to one batch window into a frame
+        
+        Collection stops at batch_size ticks, when the window closes, or
+        when a control frame is waiting so it is not held back.
+        """
+        ticks = [first]
+        deadline = time.monotonic() + client.batch_window
+        
+        while len(ticks) < client.batch_size:
+            data = client.queue.pop_tick()
+            if data is not None:
+                ticks.append(data)
+                continue
+            
+            remaining = deadline - time.monotonic()
+            if client.queue.control or client.queue.closed or remaining <= 0:
+                break
+            await client.queue.wait(remaining)
+        
+        client.batch_seq += 1
+        return codec.batch(client.batch_seq, ticks)
+    
+    async def set_batching(self, client_id: str, window_ms: int = BATCH_WINDOW_MS,
+                           max_ticks: int = BATCH_MAX_TICKS) -> bool:
+        """Enable micro-batched tick frames for a client, 0 disables"""
+        if client_id not in self.clients:
+            return False
+        
+        client = self.clients[client_id]
+        window_ms = min(max(int(window_ms), 0), MAX_BATCH_WINDOW_MS)
+        max_ticks = max(int(max_ticks), 1)
+        
+        client.batch_window = window_ms / 1000
+        client.batch_size = max_ticks if window_ms else 0
+        
+        await self.send_to_client(client, {
+            'type': 'batching',
+            'window_ms': window_ms,
+            'max_ticks': client.batch_size
+        })
+        logger.info(f"Client {client_id} batching: {window_ms}ms / {client.batch_size} ticks")
+        
+        return True
+    
+    async def set_protocol(self, client_id: str, protocol: str) -> bool:
+        """Switch the wire protocol used for a client's ticks
+        
+        Control frames stay JSON text. Ticks still queued in the previous
+        encoding are discarded; the reply carries the symbol ID table for
+        the client's subscriptions.
+        """
+        if client_id not in self.clients:
+            return False
+        
+        client = self.clients[client_id]
+        
+        if protocol not in TICK_CODECS:
+            await self.send_to_client(client, {
+                'type': 'error',
+                'error': f'Unsupported protocol: {protocol}'
+            })
             return False
+        
+        if protocol != client.protocol:
+            client.protocol = protocol
+            client.queue.discard_ticks()
+            client.throttled.clear()
+        
+        symbol_ids = self.known_symbol_ids(client.subscriptions)
+        client.symbol_ids_sent = set()
+        
+        if await self.send_to_client(client, {
+            'type': 'protocol',
+            'protocol': protocol,
+            'symbol_ids': symbol_ids
+        }):
+            client.symbol_ids_sent.update(symbol_ids)
+        logger.info(f"Client {client_id} using protocol: {protocol}")
+        
+        return True
+    
+    def symbol_id(self, symbol: str) -> Optional[int]:
+        """Get the packed protocol ID of a feed symbol, assigning one if needed
+        
+        IDs are only assigned to symbols seen on the market data feed, and
+        None is returned once every 16-bit ID is taken.
+        """
+        if symbol not in self.symbol_ids:
+            if len(self.symbol_ids) >= MAX_SYMBOL_ID:
+                return None
+            self.symbol_ids[symbol] = len(self.symbol_ids) + 1
+        return self.symbol_ids[symbol]
+    
+    def known_symbol_ids(self, symbols) -> Dict[str, int]:
+        """IDs of the symbols that already have one"""
+        return {symbol: self.symbol_ids[symbol] for symbol in symbols if symbol in self.symbol_ids}
+    
+    def encode_tick(self, tick: MarketTick, protocol: str = 'json') -> Optional[Frame]:
+        """Encode a tick in a client protocol, None if the protocol cannot carry it
+        
+        Failures are logged once per protocol and symbol, e.g. for packed
+        ticks of symbols left without an ID once every ID is taken.
+        """
+        try:
+            return TICK_CODECS[protocol].encode(tick, self.symbol_ids.get(tick.symbol))
+        except Exception as e:
+            if (protocol, tick.symbol) not in self.encode_failures:
+                self.encode_failures.add((protocol, tick.symbol))
+                logger.error(f"Cannot encode {tick.symbol} ticks as {protocol}: {e}")
+            return None
     
     async def send_market_data(self, client: ClientInfo, tick: MarketTick) -> bool:
         """Send market data to client"""
-        return await self.send_to_client(client, {
-            'type': 'tick',
-            'data': asdict(tick)
-        })
+        frame = self.encode_tick(tick, client.protocol)
+        if frame is None:
+            return False
+        
+        return await self.queue_tick(client, tick.symbol, frame)
+    
+    async def queue_tick(self, client: ClientInfo, symbol: str, frame: Frame) -> bool:
+        """Queue an encoded tick, at most one per throttle interval and symbol
+        
+        The tick is sent at once when the symbol's interval has passed;
+        otherwise it replaces any held one and the timer wheel sends it when
+        the interval expires.
+        """
+        if client.protocol == 'packed' and symbol not in client.symbol_ids_sent:
+            # Symbol first seen on the feed after the client subscribed, or
+            # an earlier announcement was refused; the client cannot decode
+            # the tick without its ID
+            if not await self.send_to_client(client, {
+                'type': 'symbol_ids',
+                'symbol_ids': self.known_symbol_ids([symbol])
+            }):
+                return False
+            client.symbol_ids_sent.add(symbol)
+        
+        interval = self.throttle_interval(client, symbol)
+        
+        if symbol in client.throttled:
+            client.throttled[symbol] = frame
+            return True
+        
+        now = time.monotonic()
+        due = client.last_update.get(symbol, 0) + interval
+        
+        if now >= due:
+            client.last_update[symbol] = now
+            client.queue.put(frame, symbol)
+        else:
+            client.throttled[symbol] = frame
+            self.timer_wheel.schedule((client.id, symbol), due - now)
+        
+        return True
+    
+    def update_throttle_floor(self, client: ClientInfo):
+        """Recompute the interval that keeps a client's subscriptions within its tier rate"""
+        rate = TIER_MESSAGE_RATES.get(client.tier, TIER_MESSAGE_RATES['free'])
+        client.throttle_floor = len(client.subscriptions) / rate
+    
+    def throttle_interval(self, client: ClientInfo, symbol: str) -> float:
+        """Minimum seconds between two updates of a symbol for a client"""
+        return max(client.throttle_ms.get(symbol, 0) / 1000, client.throttle_floor)
+    
+    def release_throttled(self, client_id: str, symbol: str):
+        """Send the tick held back for a throttled symbol"""
+        client = self.clients.get(client_id)
+        if client is None:
+            return
+        
+        frame = client.throttled.pop(symbol, None)
+        if frame is not None:
+            client.last_update[symbol] = time.monotonic()
+            client.queue.put(frame, symbol)
+    
+    async def run_timer_wheel(self):
+        """Advance the throttle timer wheel in real time"""
+        resolution = self.timer_wheel.resolution
+        next_tick = time.monotonic() + resolution
+        
+        while True:
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+            
+            # Catch up on slots missed while the loop was busy
+            while next_tick <= time.monotonic():
+                for client_id, symbol in self.timer_wheel.advance():
+                    self.release_throttled(client_id, symbol)
+                next_tick += resolution
     
     async def broadcast_market_data(self, tick: MarketTick):
-        """Broadcast market data to subscribed clients"""
+        """Broadcast market data to subscribed clients
+        
+        The tick is encoded once per protocol and queued for every subscriber.
+        Each client's writer task drains its own queue, so a slow socket
+        only falls behind (and gets conflated ticks) on its own.
+        """
         # Update cache
         self.market_data_cache[tick.symbol] = tick
+        self.symbol_id(tick.symbol)
         
         # Get subscribers for this symbol
         if tick.symbol not in self.symbol_subscribers:
             return
         
         # Send to all subscribers
-        disconnected = []
-        for client_id in self.symbol_subscribers[tick.symbol]:
-            if client_id in self.clients:
-                success = await self.send_market_data(self.clients[client_id], tick)
-                if not success:
-                    disconnected.append(client_id)
-        
-        # Clean up disconnected clients
-        for client_id in disconnected:
-            await self.unregister_client(client_id)
+        frames: Dict[str, Optional[Frame]] = {}
+        for client_id in list(self.symbol_subscribers[tick.symbol]):
+            if client_id not in self.clients:
+                continue
+            
+            client = self.clients[client_id]
+            if client.protocol not in frames:
+                # A tick that cannot be encoded only skips that protocol's clients
+                frames[client.protocol] = self.encode_tick(tick, client.protocol)
+            
+            if frames[client.protocol] is not None:
+                await self.queue_tick(client, tick.symbol, frames[client.protocol])
     
     async def handle_heartbeat(self, client_id: str):
         """Handle client heartbeat"""
@@ -312,6 +813,24 @@ class WebSocketManager:
             for client_id in disconnected:
                 await self.unregister_client(client_id)
     
+    def get_client_stats(self, client_id: str) -> Optional[Dict]:
+        """Get delivery statistics for one client"""
+        if client_id not in self.clients:
+            return None
+        
+        client = self.clients[client_id]
+        return {
+            'client_id': client.id,
+            'tier': client.tier,
+            'protocol': client.protocol,
+            'subscriptions': len(client.subscriptions),
+            'messages_sent': client.message_count,
+            'queued': len(client.queue),
+            'conflated': client.queue.conflated,
+            'batch_window_ms': int(client.batch_window * 1000),
+            'batches_sent': client.batch_seq
+        }
+    
     def get_stats(self) -> Dict:
         """Get server statistics"""
         return {
@@ -322,7 +841,9 @@ class WebSocketManager:
                 tier: sum(1 for c in self.clients.values() if c.tier == tier)
                 for tier in ['free', 'basic', 'premium', 'unlimited']
             },
-            'cache_size': len(self.market_data_cache)
+            'cache_size': len(self.market_data_cache),
+            'frames_queued': sum(len(c.queue) for c in self.clients.values()),
+            'frames_conflated': sum(c.queue.conflated for c in self.clients.values())
         }
 
 
@@ -365,17 +886,28 @@ class WebSocketServer:
             token = data.get('token')
             if token:
                 await self.manager.authenticate_client(client_id, token)
+            
+            protocol = data.get('protocol')
+            if protocol:
+                await self.manager.set_protocol(client_id, protocol)
         
         elif msg_type == 'subscribe':
             symbols = data.get('symbols', [])
             if symbols:
-                await self.manager.subscribe_client(client_id, symbols)
+                await self.manager.subscribe_client(client_id, symbols, data.get('throttle_ms'))
         
         elif msg_type == 'unsubscribe':
             symbols = data.get('symbols', [])
             if symbols:
                 await self.manager.unsubscribe_client(client_id, symbols)
         
+        elif msg_type == 'set_batching':
+            await self.manager.set_batching(
+                client_id,
+                data.get('window_ms', BATCH_WINDOW_MS),
+                data.get('max_ticks', BATCH_MAX_TICKS)
+            )
+        
         elif msg_type == 'ping':
             await self.manager.handle_heartbeat(client_id)
         
@@ -385,7 +917,8 @@ class WebSocketServer:
                 if client.tier in ['premium', 'unlimited']:
                     await self.manager.send_to_client(client, {
                         'type': 'stats',
-                        'data': self.manager.get_stats()
+                        'data': self.manager.get_stats(),
+                        'client': self.manager.get_client_stats(client_id)
                     })
                 else:
                     await self.manager.send_to_client(client, {
@@ -445,6 +978,9 @@ class WebSocketServer:
         # Start health check task
         health_task = asyncio.create_task(self.manager.check_client_health())
         
+        # Start throttle timer wheel
+        throttle_task = asyncio.create_task(self.manager.run_timer_wheel())
+        
         # Start ZMQ subscriber
         zmq_task = asyncio.create_task(self.zmq_subscriber())
         
@@ -485,6 +1021,10 @@ class AdminAPI:
         stats['uptime'] = time.time() - self.server.start_time if hasattr(self.server, 'start_time') else 0
         return stats
     
+    async def get_client_stats(self, client_id: str) -> Optional[Dict]:
+        """Get delivery statistics for one client"""
+        return self.server.manager.get_client_stats(client_id)
+    
     async def kick_client(self, client_id: str) -> bool:
         """Kick a client"""
         if client_id in self.server.manager.clients:
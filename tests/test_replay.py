@@ -0,0 +1,969 @@
+#!/usr/bin/env python3
+"""
+Tests for the market data recording and replay storage
+"""
+
+import unittest
+import sys
+import os
+import json
+import time
+import asyncio
+import tempfile
+import shutil
+import sqlite3
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.replay.block_storage import (
+    BlockWriter, BlockReader, BlockFormatError, is_block_file, FILE_HEADER
+)
+
+
+def make_records(count: int, start: float = 1000.0):
+    """Build JSON records with increasing timestamps"""
+    records = []
+    timestamps = []
+    for i in range(count):
+        timestamp = start + i * 0.5
+        symbol = 'EURUSD' if i % 2 == 0 else 'GBPUSD'
+        records.append(json.dumps({
+            'timestamp': timestamp,
+            'topic': f'tick.{symbol}',
+            'symbol': symbol,
+            'data': {'bid': 1.1 + i / 10000, 'ask': 1.1002 + i / 10000}
+        }).encode())
+        timestamps.append(timestamp)
+    return records, timestamps
+
+
+class TestBlockStorage(unittest.TestCase):
+    """Test the block-compressed recording format"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = Path(self.temp_dir) / "recording.mtrb"
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_blocks_split_by_record_count(self):
+        """Test that records are split into blocks of bounded size"""
+        records, timestamps = make_records(25)
+        writer = BlockWriter(self.path, block_records=10)
+        blocks = writer.write_records(records, timestamps)
+        writer.close()
+
+        self.assertEqual([b.message_count for b in blocks], [10, 10, 5])
+        self.assertEqual(blocks[1].first_timestamp, timestamps[10])
+        self.assertEqual(blocks[1].offset, blocks[0].end_offset)
+
+    def test_random_access(self):
+        """Test reading single records through the block directory"""
+        records, timestamps = make_records(25)
+        writer = BlockWriter(self.path, block_records=10)
+        blocks = writer.write_records(records, timestamps)
+        writer.close()
+
+        self.assertTrue(is_block_file(self.path))
+        with BlockReader(self.path) as reader:
+            self.assertEqual(len(reader.blocks()), 3)
+            self.assertEqual(reader.read_record(blocks[2].offset, 3), records[23])
+            self.assertEqual(reader.read_record(blocks[0].offset, 0), records[0])
+
+    def test_find_block_by_timestamp(self):
+        """Test locating the block for a time point"""
+        records, timestamps = make_records(25)
+        writer = BlockWriter(self.path, block_records=10)
+        writer.write_records(records, timestamps)
+        writer.close()
+
+        with BlockReader(self.path) as reader:
+            self.assertEqual(reader.find_block(timestamps[0]), 0)
+            self.assertEqual(reader.find_block(timestamps[15]), 1)
+            self.assertEqual(reader.find_block(timestamps[-1] + 1), 3)
+
+    def test_sequential_read(self):
+        """Test sequential reads across runs of adjacent and skipped blocks"""
+        records, timestamps = make_records(100)
+        writer = BlockWriter(self.path, block_records=10)
+        blocks = writer.write_records(records, timestamps)
+        writer.close()
+
+        wanted = [blocks[i].offset for i in (0, 1, 2, 5, 7, 8)]
+        with BlockReader(self.path) as reader:
+            # A small read size forces refills in the middle of blocks
+            result = list(reader.read_sequential(wanted, read_size=100))
+
+        self.assertEqual([offset for offset, _, _ in result], wanted)
+        self.assertEqual(result[3][2], records[50:60])
+        self.assertEqual(result[5][2], records[80:90])
+
+    def test_scan_without_directory(self):
+        """Test that files without a directory are readable and torn blocks are ignored"""
+        records, timestamps = make_records(25)
+        writer = BlockWriter(self.path, block_records=10)
+        blocks = writer.write_records(records, timestamps)
+        writer.flush()
+        writer.file.close()
+
+        # Simulate a crash part way through the last block
+        with open(self.path, 'r+b') as f:
+            f.truncate(blocks[2].end_offset - 4)
+
+        with BlockReader(self.path) as reader:
+            self.assertEqual([b.offset for b in reader.blocks()], [b.offset for b in blocks[:2]])
+
+    def test_rejects_other_files(self):
+        """Test that non-block files are rejected"""
+        self.path.write_bytes(b'\x1f\x8b' + b'\x00' * FILE_HEADER.size)
+        self.assertFalse(is_block_file(self.path))
+        with self.assertRaises(BlockFormatError):
+            BlockReader(self.path)
+
+
+class TestRecorderIndex(unittest.TestCase):
+    """Test recorder indexing and replay over the block format"""
+
+    def setUp(self):
+        try:
+            from services.replay import message_replay
+        except ImportError:
+            self.skipTest("PyZMQ or NumPy not installed")
+        self.replay = message_replay
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def record_session(self, index_mode, count: int = 1000, raw: bool = False, start: float = 1000,
+                       payload=None, segment_size=None):
+        """Record a session directly through the recorder's flush path"""
+        replay = self.replay
+        recorder = replay.MessageRecorder(self.temp_dir, index_mode=index_mode, raw=raw)
+        recorder.buffer_size = 300
+        recorder.segment_size = segment_size
+        recorder._init_database()
+        recorder._open_session()
+
+        for i in range(count):
+            symbol = ['EURUSD', 'GBPUSD', 'USDJPY'][i % 3] if i < count * 0.6 else 'EURUSD'
+            data = payload(i) if payload else {'bid': 1.1 + i / 10000, 'ask': 1.1002 + i / 10000}
+            if not isinstance(data, bytes):
+                data = json.dumps(data).encode()
+            recorder._append_frame(start + i * 0.01, f'tick.{symbol}'.encode(), data)
+            if len(recorder.buffer) >= recorder.buffer_size:
+                asyncio.run(recorder._flush_buffer())
+
+        asyncio.run(recorder.stop())
+        return recorder.session_id
+
+    def replay_session(self, session_id, symbols=None, start_time=None, page_size=1000,
+                       sequential_threshold=0.05):
+        """Replay a session in FAST mode and capture published messages"""
+        replayer = self.replay.MessageReplayer(self.temp_dir, "inproc://replay-test")
+        replayer.reader.page_size = page_size
+        replayer.reader.sequential_threshold = sequential_threshold
+        published = []
+
+        async def capture(batch):
+            published.extend(batch)
+
+        async def run():
+            await replayer.start()
+            replayer._publish_batch = capture
+            if isinstance(session_id, list):
+                replayer.load_sessions(session_id)
+            else:
+                replayer.load_session(session_id)
+            replayer.set_mode(self.replay.ReplayMode.FAST)
+            replayer.set_filters(symbols)
+            await replayer.play(start_time=start_time)
+            await replayer.stop()
+
+        asyncio.run(run())
+        return published
+
+    def test_sparse_index_writes_block_rows_only(self):
+        """Test that sparse mode writes one row per block and no message rows"""
+        session_id = self.record_session(self.replay.IndexMode.SPARSE)
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        message_rows = analyzer.db_conn.execute(
+            "SELECT COUNT(*) FROM message_index WHERE session_id = ?", (session_id,)).fetchone()[0]
+        block_rows = analyzer.db_conn.execute(
+            "SELECT COUNT(*) FROM block_index WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+        self.assertEqual(message_rows, 0)
+        self.assertEqual(block_rows, 4)
+
+    def test_index_modes_replay_identically(self):
+        """Test that full and sparse sessions replay and analyze the same messages"""
+        full_id = self.record_session(self.replay.IndexMode.FULL)
+        sparse_id = self.record_session(self.replay.IndexMode.SPARSE)
+
+        full = self.replay_session(full_id, ['GBPUSD'], start_time=1001)
+        sparse = self.replay_session(sparse_id, ['GBPUSD'], start_time=1001)
+        self.assertEqual(len(full), 167)
+        self.assertEqual(full, sparse)
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        self.assertEqual(analyzer.analyze_session(full_id)['symbols'],
+                         analyzer.analyze_session(sparse_id)['symbols'])
+
+    def test_rollups_written_during_recording(self):
+        """Test that rollups merged across flushes match aggregating the whole session"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, count=1500)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            messages = list(reader.iter_session(session_id))
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+
+        for resolution in self.replay.ROLLUP_RESOLUTIONS:
+            expected = {row[1:3]: row[3:] for row in self.replay.rollup_messages(messages, (resolution,))}
+            stored = {(row['symbol'], row['bucket']): tuple(row[c] for c in self.replay.ROLLUP_COLUMNS)
+                      for row in analyzer.get_rollups(session_id, resolution)}
+            self.assertEqual(stored.keys(), expected.keys())
+            for key, values in expected.items():
+                for stored_value, value in zip(stored[key], values):
+                    self.assertAlmostEqual(stored_value, value)
+
+        # analyze_session answers from the rollups with the same counts as the index
+        analysis = analyzer.analyze_session(session_id)
+        symbols, rates = analyzer._analyze_index([session_id])
+        self.assertEqual(analysis['statistics']['max_rate_per_second'], max(rates))
+        for symbol, stats in symbols.items():
+            self.assertEqual(analysis['symbols'][symbol]['count'], stats['count'])
+            self.assertAlmostEqual(analysis['symbols'][symbol]['max_spread'], 0.0002)
+
+    def test_microstructure_stats(self):
+        """Test vectorized per-symbol statistics against a direct computation"""
+        session_id = self.record_session(self.replay.IndexMode.SPARSE)
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        analyzer.chunk_size = 128
+        stats = analyzer.microstructure_stats(session_id, gap_threshold=0.02)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            messages = list(reader.iter_session(session_id, ['EURUSD']))
+
+        eurusd = stats['EURUSD']
+        timestamps = [m.timestamp for m in messages]
+        intervals = [b - a for a, b in zip(timestamps, timestamps[1:])]
+        self.assertEqual(eurusd['count'], len(messages))
+        self.assertAlmostEqual(eurusd['inter_arrival']['max'], max(intervals))
+        self.assertAlmostEqual(eurusd['spread']['p50'], 0.0002)
+        self.assertEqual(eurusd['gaps']['count'], sum(1 for i in intervals if i > 0.02))
+        self.assertEqual(stats['GBPUSD']['gaps']['count'], 199)
+        self.assertGreater(eurusd['volatility'], 0)
+
+        # Completed sessions are cached
+        self.assertIs(analyzer.microstructure_stats(session_id, gap_threshold=0.02), stats)
+
+    def test_columnar_export(self):
+        """Test that columnar exports keep every field with its type"""
+        def payload(i):
+            data = {'bid': 1.1 + i / 10000, 'ask': 1.1002 + i / 10000}
+            if i >= 500:
+                data['volume'] = i
+            return data
+
+        session_id = self.record_session(self.replay.IndexMode.SPARSE, payload=payload)
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        analyzer.chunk_size = 300
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            expected = [m for m in reader.iter_session(session_id, start_time=1001)]
+
+        formats = ['npz'] + (['parquet', 'arrow'] if self.replay.USE_PYARROW else [])
+        for export_format in formats:
+            for partition in (False, True):
+                output = Path(self.temp_dir) / f"export-{export_format}-{partition}"
+                manifest = analyzer.export_columnar(session_id, output, start_time=1001,
+                                                    export_format=export_format,
+                                                    partition_by_symbol=partition)
+                self.assertEqual(manifest['rows'], len(expected))
+                self.assertEqual(manifest['fields']['volume'], 'float64')
+
+                columns = self.replay.load_export(output, symbols=['USDJPY'])
+                usdjpy = [m for m in expected if m.symbol == 'USDJPY']
+                rows = sorted(zip(columns['timestamp'], columns['bid']))
+                self.assertEqual(rows, [(m.timestamp, m.data['bid']) for m in usdjpy])
+                self.assertEqual(set(columns['symbol']), {'USDJPY'})
+
+        # The CSV header covers fields that first appear late in the session
+        csv_path = Path(self.temp_dir) / "export.csv"
+        analyzer.export_to_csv(session_id, csv_path)
+        with open(csv_path) as f:
+            self.assertEqual(f.readline().strip(), 'timestamp,symbol,bid,ask,volume')
+
+    def test_parallel_batch(self):
+        """Test that batch export and analysis across processes match serial results"""
+        first = self.record_session(self.replay.IndexMode.FULL)
+        second = self.record_session(self.replay.IndexMode.SPARSE, count=600)
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        analyzer.workers = 2
+
+        for split_symbols in (False, True):
+            analysis = analyzer.analyze_sessions([first, second], gap_threshold=0.02,
+                                                 split_symbols=split_symbols)
+            for session_id in (first, second):
+                self.assertEqual(analysis['stats'][session_id],
+                                 analyzer.microstructure_stats(session_id, gap_threshold=0.02))
+            self.assertEqual(analysis['throughput']['messages'], 1600)
+            self.assertEqual(analysis['throughput']['tasks'], 6 if split_symbols else 2)
+
+            output = Path(self.temp_dir) / f"batch-{split_symbols}"
+            export = analyzer.export_sessions([first, second], output, export_format='npz',
+                                              split_symbols=split_symbols)
+            self.assertEqual(sum(w['messages'] for w in export['throughput']['workers'].values()), 1600)
+
+            columns = self.replay.load_export(output / f"session_{second}", symbols=['EURUSD', 'GBPUSD'])
+            self.assertEqual(len(columns['timestamp']), 480)
+
+    def test_catalog_coverage(self):
+        """Test that coverage queries answer from the catalog written on stop"""
+        first = self.record_session(self.replay.IndexMode.FULL)
+        second = self.record_session(self.replay.IndexMode.SPARSE, start=2000)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            coverage = reader.coverage(['USDJPY'])
+            self.assertEqual([row['session_id'] for row in coverage], [first, second])
+            self.assertEqual(coverage[0]['message_count'], 200)
+            self.assertAlmostEqual(coverage[1]['first_timestamp'], 2000.02)
+
+            def find(*args, **kwargs):
+                return [session['id'] for session in reader.find_sessions(*args, **kwargs)]
+
+            # USDJPY stops after 60% of each session while EURUSD carries on
+            self.assertEqual(find(1007, 1500, ['USDJPY']), [])
+            self.assertEqual(find(1007, 1500, ['EURUSD']), [first])
+            self.assertEqual(find(1003, symbols=['USDJPY']), [first, second])
+            self.assertEqual(find(1500), [second])
+
+            merged = list(reader.iter_sessions(None, ['USDJPY'], start_time=1005))
+            self.assertEqual({m.timestamp // 1000 for m in merged}, {1.0, 2.0})
+
+            # Sessions missing from the catalog are matched on their recording times
+            reader.db_conn.execute("DELETE FROM session_catalog WHERE session_id = ?", (first,))
+            self.assertEqual(find(1007, 1500, ['USDJPY']), [])
+            self.assertEqual(find(symbols=['USDJPY']), [first, second])
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        self.assertEqual(analyzer.rebuild_catalog(), 2)
+        self.assertEqual(analyzer.session_symbols(first), ['EURUSD', 'GBPUSD', 'USDJPY'])
+
+    def test_segment_rotation_and_compaction(self):
+        """Test that rotated, merged, recompressed and downsampled segments read consistently"""
+        # A tiny segment size starts a new file on every flush
+        rotated = self.record_session(self.replay.IndexMode.FULL, segment_size=1)
+        plain = self.record_session(self.replay.IndexMode.FULL)
+
+        def segments(session_id):
+            with self.replay.SessionReader(self.temp_dir) as reader:
+                return self.replay.session_segments(reader.db_conn, reader.get_session(session_id))
+
+        def read(session_id):
+            with self.replay.SessionReader(self.temp_dir) as reader:
+                return list(reader.iter_session(session_id, ['GBPUSD'], start_time=1001))
+
+        self.assertEqual([s['message_count'] for s in segments(rotated)], [300, 300, 300, 100])
+        self.assertTrue(all(Path(s['file_path']).exists() for s in segments(rotated)))
+        expected = read(plain)
+        self.assertEqual(len(expected), 167)
+        self.assertEqual(read(rotated), expected)
+        self.assertEqual(self.replay_session(rotated, ['GBPUSD'], start_time=1001, page_size=7), expected)
+        self.assertEqual(self.replay_session(rotated, ['GBPUSD'], start_time=1001,
+                                             sequential_threshold=2), expected)
+
+        compactor = self.replay.SegmentCompactor(self.temp_dir)
+        compactor.cold_after = None
+        old_files = [Path(s['file_path']) for s in segments(rotated)]
+        self.assertEqual(compactor.compact(), {'merged': 4, 'recompressed': 0, 'downsampled': 0})
+        merged = segments(rotated)
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]['message_count'], 1000)
+        self.assertFalse(any(path.exists() for path in old_files))
+        self.assertEqual(read(rotated), expected)
+        self.assertEqual(self.replay_session(rotated, ['GBPUSD'], start_time=1001, page_size=7), expected)
+
+        compactor.cold_after = 0
+        self.assertEqual(compactor.compact()['recompressed'], 2)
+        self.assertEqual(segments(rotated)[0]['compression_level'], 9)
+        self.assertEqual(read(rotated), expected)
+        self.assertEqual(compactor.compact()['recompressed'], 0)
+
+        # Downsampled segments keep their rollups and catalog coverage
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        before = analyzer.analyze_session(rotated)['symbols']
+        compactor.downsample_after = 0
+        self.assertEqual(compactor.compact()['downsampled'], 2)
+        self.assertEqual(segments(rotated)[0]['status'], 'downsampled')
+        self.assertEqual(read(rotated), [])
+        self.assertEqual(analyzer.analyze_session(rotated)['symbols'], before)
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            self.assertEqual(reader.coverage(['USDJPY'])[0]['message_count'], 200)
+
+    def test_crash_recovery(self):
+        """Test that a crashed session is rebuilt from its segment files"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, segment_size=1)
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            expected = list(reader.iter_session(session_id))
+            expected_rollups = self.replay.rollup_messages(expected[:900])
+            last = self.replay.session_segments(reader.db_conn, reader.get_session(session_id))[-1]
+
+            # Lose the directory and half of the last block, the open segment
+            # state and the rows of every segment but the first
+            with BlockReader(last['file_path']) as block_reader:
+                torn_at = block_reader.blocks()[-1].end_offset - 10
+            with open(last['file_path'], 'r+b') as f:
+                f.truncate(torn_at)
+            reader.db_conn.execute("UPDATE segments SET status = 'open' WHERE id = ?", (last['id'],))
+            reader.db_conn.execute("UPDATE recording_sessions SET status = 'recording', end_time = NULL")
+            reader.db_conn.execute("DELETE FROM message_index WHERE timestamp > 1003")
+            reader.db_conn.execute("DELETE FROM block_index WHERE first_timestamp > 1003")
+            reader.db_conn.execute("DELETE FROM rollups WHERE bucket > 1003")
+
+            # Sessions that crashed before their first segment row, one with
+            # no file and one with an empty file
+            empty_path = Path(self.temp_dir) / 'empty.mtrb'
+            empty_path.touch()
+            empty_ids = [reader.db_conn.execute("""
+                INSERT INTO recording_sessions (name, start_time, file_path, status)
+                VALUES (?, 2000, ?, 'recording')
+            """, (name, str(path))).lastrowid
+                for name, path in (('missing', Path(self.temp_dir) / 'missing.mtrb'),
+                                   ('empty', empty_path))]
+            reader.db_conn.commit()
+
+        recovery = self.replay.SessionRecovery(self.temp_dir)
+        recovery.connect()
+        recovery.workers = 2
+        recovery.task_messages = 200
+        stats, *empty_stats = recovery.recover_all()
+        self.assertEqual([result['messages'] for result in empty_stats], [0, 0])
+        self.assertEqual(stats['segments'], 4)
+        # The torn segment has no intact block left to scan
+        self.assertEqual(stats['tasks'], 3)
+        self.assertEqual(stats['messages'], 900)
+        self.assertGreater(stats['truncated_bytes'], 0)
+        self.assertEqual(recovery.recover_all(), [])
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            session = reader.get_session(session_id)
+            self.assertEqual(session['status'], 'completed')
+            self.assertAlmostEqual(session['end_time'], expected[899].timestamp)
+            self.assertEqual(list(reader.iter_session(session_id)), expected[:900])
+            self.assertEqual(reader.coverage(['EURUSD'])[0]['message_count'], 500)
+            for empty_id in empty_ids:
+                self.assertEqual(reader.get_session(empty_id)['status'], 'completed')
+                self.assertEqual(list(reader.iter_session(empty_id)), [])
+            with BlockReader(last['file_path']) as block_reader:
+                self.assertTrue(block_reader.is_sealed())
+
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        stored = {(row['resolution'], row['symbol'], row['bucket']): row['message_count']
+                  for resolution in self.replay.ROLLUP_RESOLUTIONS
+                  for row in analyzer.get_rollups(session_id, resolution)}
+        self.assertEqual(stored, {row[:3]: row[3] for row in expected_rollups})
+        self.assertEqual(self.replay_session(session_id, ['GBPUSD'], start_time=1001, page_size=7),
+                         [m for m in expected[:900] if m.symbol == 'GBPUSD' and m.timestamp >= 1001])
+
+    def test_multi_endpoint_recording(self):
+        """Test that one recorder captures several feeds, tagging each message with its source"""
+        import zmq
+
+        context = zmq.Context()
+        publishers = {}
+        for name in ('broker1', 'broker2'):
+            socket = context.socket(zmq.PUB)
+            port = socket.bind_to_random_port('tcp://127.0.0.1')
+            publishers[name] = (socket, f'tcp://127.0.0.1:{port}')
+
+        async def record(raw):
+            recorder = self.replay.MessageRecorder(
+                self.temp_dir, {name: address for name, (_socket, address) in publishers.items()}, raw=raw)
+            recorder.buffer_size = 50
+            recorder.flush_interval = 0.05
+            received = []
+            append_frame = recorder._append_frame
+
+            def capture(timestamp, topic, payload, source=None):
+                received.append((topic, source))
+                append_frame(timestamp, topic, payload, source)
+
+            recorder._append_frame = capture
+            task = asyncio.create_task(recorder.start())
+
+            # Publish until both subscriptions are live, then send the real ticks
+            while {source for _topic, source in received} != set(publishers):
+                for socket, _address in publishers.values():
+                    socket.send_multipart([b'warmup', b'{}'])
+                await asyncio.sleep(0.01)
+
+            # Frames shaped like a ShardedRecorder front's are malformed on a feed
+            broker1 = publishers['broker1'][0]
+            broker1.send_multipart([b'END_OF_FEED'])
+            broker1.send_multipart([b'tick.EURUSD', b'{}', b'\x00' * 8])
+            broker1.send_multipart([b'tick.EURUSD', b'{}', b'\x00' * 8, b'broker1'])
+            for i in range(100):
+                for name, (socket, _address) in publishers.items():
+                    symbol = 'EURUSD' if name == 'broker1' else 'GBPUSD'
+                    socket.send_multipart([f'tick.{symbol}'.encode(), json.dumps({'bid': i}).encode()])
+            while sum(1 for topic, _source in received if topic.startswith(b'tick.')) < 200:
+                await asyncio.sleep(0.01)
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return recorder.session_id
+
+        try:
+            sessions = [asyncio.run(record(raw)) for raw in (False, True)]
+        finally:
+            for socket, _address in publishers.values():
+                socket.close()
+            context.term()
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            for session_id in sessions:
+                metadata = json.loads(reader.get_session(session_id)['metadata'])
+                self.assertEqual(sorted(metadata['sources']), ['broker1', 'broker2'])
+                self.assertEqual(metadata['messages_malformed'], 3)
+
+                messages = list(reader.iter_session(session_id, ['EURUSD', 'GBPUSD']))
+                self.assertEqual(len(messages), 200)
+                for source, symbol in (('broker1', 'EURUSD'), ('broker2', 'GBPUSD')):
+                    tagged = [m for m in messages if m.source == source]
+                    self.assertEqual({m.symbol for m in tagged}, {symbol})
+                    self.assertEqual([m.data['bid'] for m in tagged], list(range(100)))
+
+    def test_sharded_recording(self):
+        """Test that shard processes record disjoint symbols that replay as one feed"""
+        import zmq
+
+        context = zmq.Context()
+        publisher = context.socket(zmq.PUB)
+        address = f"tcp://127.0.0.1:{publisher.bind_to_random_port('tcp://127.0.0.1')}"
+        symbols = ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD', 'USDCHF', 'NZDUSD']
+
+        async def record():
+            recorder = self.replay.ShardedRecorder(self.temp_dir, address, shards=3)
+            recorder.settings = {'buffer_size': 50, 'flush_interval': 0.05}
+            task = asyncio.create_task(recorder.start())
+
+            while recorder.messages_received == 0:
+                publisher.send_multipart([b'warmup', b'{}'])
+                await asyncio.sleep(0.01)
+            received = recorder.messages_received
+            publisher.send_multipart([b'tick.EURUSD'])
+            for i in range(300):
+                publisher.send_multipart([f'tick.{symbols[i % 6]}'.encode(), json.dumps({'bid': i}).encode()])
+            while recorder.messages_received < received + 300:
+                await asyncio.sleep(0.01)
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return recorder
+
+        try:
+            recorder = asyncio.run(record())
+        finally:
+            publisher.close()
+            context.term()
+
+        self.assertTrue(all(process.exitcode == 0 for process in recorder.processes))
+        self.assertEqual(recorder.get_stats()['messages_malformed'], 1)
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            layout = reader.db_conn.execute(
+                "SELECT shard, shard_count, shard_session_id FROM session_shards WHERE session_id = ?",
+                (recorder.session_id,)).fetchall()
+            self.assertEqual([tuple(row) for row in layout],
+                             [(shard, 3, session) for shard, session in enumerate(recorder.shard_sessions)])
+
+            # Each shard holds exactly the symbols hashing to it
+            for shard, session_id in enumerate(recorder.shard_sessions):
+                self.assertEqual(reader.get_session(session_id)['status'], 'completed')
+                recorded = {m.symbol for m in reader.iter_session(session_id, symbols)}
+                self.assertEqual(recorded, {symbol for symbol in symbols
+                                            if self.replay.symbol_shard(symbol.encode(), 3) == shard})
+
+            front = reader.get_session(recorder.session_id)
+            self.assertEqual(json.loads(front['metadata'])['messages_malformed'], 1)
+            messages = list(reader.iter_session(recorder.session_id, symbols))
+            self.assertEqual([m.data['bid'] for m in messages], list(range(300)))
+            self.assertEqual(len(reader.expand_shards([reader.get_session(recorder.session_id)],
+                                                      ['EURUSD'])), 1)
+
+        self.assertEqual(self.replay_session(recorder.session_id, ['EURUSD', 'USDJPY']),
+                         [m for m in messages if m.symbol in ('EURUSD', 'USDJPY')])
+
+        # The catalog and analyzer present the sharded session as one session
+        analyzer = self.replay.ReplayAnalyzer(self.temp_dir)
+        analyzer.connect()
+        analysis = analyzer.analyze_session(recorder.session_id)
+        self.assertEqual({symbol: stats['count'] for symbol, stats in analysis['symbols'].items()
+                          if symbol in symbols}, {symbol: 50 for symbol in symbols})
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            self.assertEqual([(row['session_id'], row['message_count']) for row in reader.coverage(['EURUSD'])],
+                             [(recorder.session_id, 50)])
+            self.assertEqual([session['id'] for session in reader.find_sessions(symbols=['EURUSD'])],
+                             [recorder.session_id])
+
+            # Recovery rebuilds the shards and then finishes the sharded session
+            recorded = reader.get_session(recorder.session_id)['message_count']
+            self.assertGreaterEqual(recorded, 300)
+            reader.db_conn.execute("UPDATE recording_sessions SET status = 'recording', end_time = NULL, "
+                                   "message_count = 0")
+            reader.db_conn.execute("DELETE FROM symbol_catalog")
+            reader.db_conn.execute("DELETE FROM session_catalog")
+            reader.db_conn.commit()
+
+        recovery = self.replay.SessionRecovery(self.temp_dir)
+        recovery.connect()
+        recovery.workers = 1
+        [stats] = recovery.recover_all()
+        self.assertEqual(stats['session_id'], recorder.session_id)
+        self.assertEqual(stats['shards'], 3)
+        self.assertEqual(stats['messages'], recorded)
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            front = reader.get_session(recorder.session_id)
+            self.assertEqual((front['status'], front['message_count']), ('completed', recorded))
+            self.assertEqual([(row['session_id'], row['message_count']) for row in reader.coverage(['EURUSD'])],
+                             [(recorder.session_id, 50)])
+            self.assertEqual(len(list(reader.iter_session(recorder.session_id, symbols))), 300)
+
+    def test_paged_index_replay(self):
+        """Test that streaming the index in small pages keeps every message in order"""
+        session_id = self.record_session(self.replay.IndexMode.FULL)
+
+        symbols = ['EURUSD', 'USDJPY']
+        paged = self.replay_session(session_id, symbols, start_time=1002, page_size=7,
+                                    sequential_threshold=2)
+        self.assertEqual(len(paged), 667)
+        self.assertEqual([m.timestamp for m in paged], sorted(m.timestamp for m in paged))
+
+        # The sequential block scan yields the same stream
+        self.assertEqual(paged, self.replay_session(session_id, symbols, start_time=1002))
+
+    def test_zero_time_bounds(self):
+        """Test that a start or end time of 0 still bounds the read"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, start=-5)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            blocks = self.replay.query_blocks(reader.db_conn, session_id, end_time=0)
+            self.assertEqual(sum(block['message_count'] for block in blocks), 600)
+
+            session = reader.get_session(session_id)
+            for threshold in (0.05, 2):
+                reader.sequential_threshold = threshold
+                before = list(reader.merge_sessions([session], ['EURUSD'], None, 0))
+                after = list(reader.merge_sessions([session], ['EURUSD'], 0, None))
+                self.assertEqual(len(before), 167)
+                self.assertEqual(len(after), 433)
+                self.assertLessEqual(before[-1].timestamp, 0)
+                self.assertGreaterEqual(after[0].timestamp, 0)
+
+    def test_in_process_iteration(self):
+        """Test that sessions can be iterated without a replay server"""
+        session_id = self.record_session(self.replay.IndexMode.FULL)
+        published = self.replay_session(session_id, ['GBPUSD'], start_time=1001)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            messages = list(reader.iter_session(session_id, ['GBPUSD'], start_time=1001))
+            batches = list(reader.iter_session(session_id, ['GBPUSD'], start_time=1001, batch=50))
+            columns = list(reader.iter_session(session_id, start_time=1001, batch=400, columns=True))
+
+            with self.assertRaises(ValueError):
+                next(reader.iter_session(session_id + 100))
+
+        self.assertEqual(messages, published)
+        self.assertEqual([len(b) for b in batches], [50, 50, 50, 17])
+        self.assertEqual(sum(batches, []), published)
+
+        self.assertEqual([len(c['timestamp']) for c in columns], [400, 400, 100])
+        self.assertEqual(columns[0]['timestamp'].dtype.name, 'float64')
+        self.assertEqual(columns[0]['timestamp'][0], 1001.0)
+        self.assertAlmostEqual(columns[0]['bid'][0], 1.1 + 100 / 10000)
+        self.assertEqual(columns[0]['symbol'][0], 'GBPUSD')
+
+    def test_merged_sessions(self):
+        """Test that several sessions replay as one feed ordered by timestamp"""
+        first = self.record_session(self.replay.IndexMode.FULL, count=500)
+        second = self.record_session(self.replay.IndexMode.SPARSE, count=500, start=1000.005)
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            self.assertEqual([s['id'] for s in reader.find_sessions()], [first, second])
+            merged = list(reader.iter_sessions(symbols=['GBPUSD']))
+
+        self.assertEqual(len(merged), 200)
+        self.assertEqual([m.timestamp for m in merged], sorted(m.timestamp for m in merged))
+        # Messages from the two sessions interleave
+        self.assertAlmostEqual(merged[0].timestamp, 1000.01)
+        self.assertAlmostEqual(merged[1].timestamp, 1000.015)
+
+        # The replayer publishes the same merged stream
+        self.assertEqual(self.replay_session([first, second], ['GBPUSD']), merged)
+
+    def test_seek_and_step(self):
+        """Test that seeks by position and timestamp land where a full replay would be"""
+        full_id = self.record_session(self.replay.IndexMode.FULL)
+        sparse_id = self.record_session(self.replay.IndexMode.SPARSE, start=1000.005)
+        symbols = ['EURUSD', 'USDJPY']
+
+        for session_ids in ([full_id], [sparse_id], [full_id, sparse_id]):
+            with self.replay.SessionReader(self.temp_dir) as reader:
+                expected = list(reader.iter_sessions(session_ids, symbols))
+
+            replayer = self.replay.MessageReplayer(self.temp_dir, "inproc://replay-test")
+            published = []
+
+            async def capture(batch):
+                published.extend(batch)
+
+            async def run():
+                await replayer.start()
+                replayer._publish_batch = capture
+                replayer.load_sessions(session_ids)
+                replayer.set_filters(symbols)
+
+                for position in (500, 0, 299, 300, 301, len(expected) - 2):
+                    self.assertEqual(replayer.seek(position=position), position)
+                    self.assertEqual(await replayer.step(3), expected[position:position + 3])
+                    self.assertEqual(replayer.current_position, min(position + 3, len(expected)))
+
+                timestamp = expected[400].timestamp
+                self.assertEqual(replayer.seek(timestamp=timestamp), 400)
+                self.assertEqual(await replayer.step(), [expected[400]])
+
+                # Stepped mode keeps the position for step() calls
+                replayer.set_mode(self.replay.ReplayMode.STEPPED)
+                await replayer.play()
+                self.assertEqual(await replayer.step(), [expected[401]])
+
+                # Pausing and resuming continues without losing messages
+                published.clear()
+                replayer.seek(position=0)
+                replayer.set_mode(self.replay.ReplayMode.FAST)
+                replayer.batch_size = 100
+
+                async def pause_after_first_batch(batch):
+                    published.extend(batch)
+                    await replayer.pause()
+
+                replayer._publish_batch = pause_after_first_batch
+                await replayer.play()
+                self.assertEqual(replayer.current_position, 100)
+                replayer._publish_batch = capture
+                await replayer.resume()
+                await replayer.stop()
+
+            asyncio.run(run())
+            self.assertEqual(published, expected)
+
+    def test_seek_uses_cached_counts(self):
+        """Test that seeks reuse cached counts and land near position in legacy sessions"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, count=3000)
+        legacy_id = self.record_session(self.replay.IndexMode.FULL, count=3000, start=1000.005)
+        db_conn = sqlite3.connect(os.path.join(self.temp_dir, 'recordings.db'))
+        db_conn.execute("DELETE FROM block_index WHERE session_id = ?", (legacy_id,))
+        db_conn.commit()
+        db_conn.close()
+
+        for session_ids in ([legacy_id], [session_id, legacy_id]):
+            with self.replay.SessionReader(self.temp_dir) as reader:
+                expected = list(reader.iter_sessions(session_ids))
+                index = self.replay.FeedIndex(reader, [reader.get_session(i) for i in session_ids])
+                self.assertEqual(index.total, len(expected))
+
+                position = len(expected) - 10
+                timestamp, skip = index.locate(position)
+                self.assertLess(skip, index.legacy_stride * len(session_ids))
+                self.assertEqual(expected[position - skip].timestamp, timestamp)
+
+                # A repeated seek is answered from the cached counts
+                def no_query(*args):
+                    raise AssertionError("count_before was recomputed")
+
+                index._index_query = no_query
+                self.assertEqual(index.locate(position), (timestamp, skip))
+                index.close()
+
+    def test_replay_stats_keys(self):
+        """Test that replay statistics carry the same keys whatever the mode"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, count=100)
+        replayer = self.replay.MessageReplayer(self.temp_dir, "inproc://replay-test")
+        keys = set(replayer.replay_stats)
+        self.assertIn('hwm_waits', keys)
+
+        async def run():
+            await replayer.start()
+            replayer.load_session(session_id)
+            for mode in (self.replay.ReplayMode.FAST, self.replay.ReplayMode.ACCELERATED):
+                replayer.seek(position=0)
+                replayer.set_mode(mode, speed_multiplier=100)
+                await replayer.play()
+                self.assertEqual(set(replayer.replay_stats), keys)
+                self.assertEqual(replayer.replay_stats['messages_sent'], 100)
+
+            replayer.seek(position=0)
+            await replayer.step(10)
+            self.assertEqual(set(replayer.replay_stats), keys)
+            await replayer.stop()
+
+        asyncio.run(run())
+
+    def test_raw_recording_is_byte_exact(self):
+        """Test that raw sessions replay the original frames verbatim"""
+        session_id = self.record_session(self.replay.IndexMode.SPARSE, raw=True)
+
+        published = self.replay_session(session_id, ['USDJPY'])
+        self.assertEqual(len(published), 200)
+        self.assertIsInstance(published[0], self.replay.RawMessage)
+        self.assertEqual(published[0].raw_topic, b'tick.USDJPY')
+        self.assertEqual(published[0].payload,
+                         json.dumps({'bid': 1.1 + 2 / 10000, 'ask': 1.1002 + 2 / 10000}).encode())
+        self.assertEqual(published[0].data['bid'], 1.1 + 2 / 10000)
+
+    def test_raw_recording_of_binary_payloads(self):
+        """Test that raw sessions record payloads that are not JSON"""
+        session_id = self.record_session(self.replay.IndexMode.FULL, count=250, raw=True,
+                                         payload=lambda i: b'\x00\x01binary-not-json')
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            session = reader.get_session(session_id)
+            self.assertEqual(session['message_count'], 250)
+            self.assertNotIn('write_errors', json.loads(session['metadata']))
+
+            rollups = reader.db_conn.execute("""
+                SELECT message_count, first_timestamp, last_timestamp, bid_open
+                FROM rollups WHERE session_id = ? AND resolution = 60 AND symbol = 'USDJPY'
+            """, (session_id,)).fetchall()
+        self.assertEqual(len(rollups), 1)
+        count, first, last, bid_open = rollups[0]
+        self.assertEqual(count, 50)
+        self.assertAlmostEqual(first, 1000.02)
+        self.assertAlmostEqual(last, 1001.49)
+        self.assertIsNone(bid_open)
+
+        published = self.replay_session(session_id)
+        self.assertEqual(len(published), 250)
+        self.assertEqual(published[0].payload, b'\x00\x01binary-not-json')
+
+    def test_malformed_frame_is_skipped(self):
+        """Test that one malformed payload does not cost the rest of its buffer"""
+        session_id = self.record_session(
+            self.replay.IndexMode.FULL,
+            payload=lambda i: b'{"bid": 1.1, "ask"' if i == 450 else {'bid': 1.1, 'ask': 1.1002})
+
+        with self.replay.SessionReader(self.temp_dir) as reader:
+            session = reader.get_session(session_id)
+            self.assertEqual(session['message_count'], 999)
+            metadata = json.loads(session['metadata'])
+            self.assertEqual(metadata['messages_malformed'], 1)
+            self.assertNotIn('write_errors', metadata)
+
+        self.assertEqual(len(self.replay_session(session_id)), 999)
+
+    def test_failed_write_is_rolled_back(self):
+        """Test that a buffer that fails to write leaves no index rows behind"""
+        db_conn = sqlite3.connect(os.path.join(self.temp_dir, 'recordings.db'))
+        self.replay.init_database(db_conn)
+        # Fail the session update after the index rows of the buffer are
+        # inserted; the second and third buffers would both reach 600
+        db_conn.execute("""
+            CREATE TRIGGER fail_flush BEFORE UPDATE OF message_count ON recording_sessions
+            WHEN NEW.message_count = 600
+            BEGIN SELECT RAISE(ABORT, 'disk I/O error'); END
+        """)
+        db_conn.commit()
+        db_conn.close()
+
+        session_id = self.record_session(self.replay.IndexMode.FULL)
+
+        db_conn = sqlite3.connect(os.path.join(self.temp_dir, 'recordings.db'))
+        message_count, metadata = db_conn.execute(
+            "SELECT message_count, metadata FROM recording_sessions WHERE id = ?",
+            (session_id,)).fetchone()
+        indexed = db_conn.execute(
+            "SELECT COUNT(*) FROM message_index WHERE session_id = ?", (session_id,)).fetchone()[0]
+        blocks = db_conn.execute(
+            "SELECT COALESCE(SUM(message_count), 0) FROM block_index WHERE session_id = ?",
+            (session_id,)).fetchone()[0]
+        db_conn.close()
+
+        self.assertEqual(message_count, 400)
+        self.assertEqual(indexed, 400)
+        self.assertEqual(blocks, 400)
+        self.assertEqual(json.loads(metadata)['write_errors'], 2)
+        self.assertEqual(json.loads(metadata)['messages_failed'], 600)
+        self.assertEqual(len(self.replay_session(session_id)), 400)
+
+
+class TestReplayScheduler(unittest.TestCase):
+    """Test replay deadline scheduling"""
+
+    def setUp(self):
+        try:
+            from services.replay.message_replay import ReplayScheduler
+        except ImportError:
+            self.skipTest("PyZMQ or NumPy not installed")
+        self.scheduler_class = ReplayScheduler
+
+    def test_deadlines_are_absolute(self):
+        """Test that deadlines follow the recording scaled by speed, with long gaps compressed"""
+        scheduler = self.scheduler_class(speed_multiplier=2.0, max_idle_gap=1.0)
+        origin = scheduler.deadline(100.0)
+
+        self.assertAlmostEqual(scheduler.deadline(101.0) - origin, 0.5)
+        self.assertAlmostEqual(scheduler.deadline(102.0) - origin, 1.0)
+        # A 1 hour silence is shortened to max_idle_gap
+        self.assertAlmostEqual(scheduler.deadline(3702.0) - origin, 1.5)
+        self.assertAlmostEqual(scheduler.skipped, 3599.0)
+
+    def test_spin_yields_to_other_tasks(self):
+        """Test that spinning before a deadline does not starve the event loop"""
+        scheduler = self.scheduler_class(coalesce_window=0, spin_threshold=1.0)
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0)
+
+        async def run():
+            task = asyncio.create_task(ticker())
+            await asyncio.sleep(0)
+            deadline = time.perf_counter() + 0.02
+            self.assertTrue(await scheduler.wait_until(deadline))
+            self.assertGreaterEqual(time.perf_counter(), deadline)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertGreater(len(ticks), 10)
+
+    def test_lag_percentiles(self):
+        """Test that lag samples are summarized"""
+        scheduler = self.scheduler_class()
+        for _ in range(10):
+            scheduler.record_lag(time.perf_counter())
+
+        lag = scheduler.lag_percentiles()
+        self.assertEqual(scheduler.lag_count, 10)
+        self.assertLessEqual(lag['p50_ms'], lag['max_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
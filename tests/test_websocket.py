@@ -0,0 +1,720 @@
+#!/usr/bin/env python3
+"""
+Tests for the WebSocket market data server
+"""
+
+import unittest
+import sys
+import os
+import json
+import time
+import types
+import asyncio
+from unittest import mock
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TokenBucket:
+    """Stand-in for the rate limiter's token bucket"""
+
+    def __init__(self, *args):
+        self.args = args
+
+
+class RateLimiter:
+    """Stand-in rate limiter that allows every message"""
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+
+    def check_rate_limit(self, key):
+        return True, {}
+
+
+class RefusingLimiter:
+    """Rate limiter that refuses every message of the keys in refused"""
+
+    def __init__(self):
+        self.refused = set()
+
+    def check_rate_limit(self, key):
+        if key in self.refused:
+            return False, {'retry_after': 2}
+        return True, {}
+
+
+def import_server():
+    """Import the server, stubbing the rate limiter module when it is not available"""
+    try:
+        import services.rate_limiter.rate_limiter  # noqa: F401
+    except ImportError:
+        stub = types.ModuleType('services.rate_limiter.rate_limiter')
+        stub.RateLimiter = RateLimiter
+        stub.TokenBucket = TokenBucket
+        sys.modules.setdefault('services.rate_limiter', types.ModuleType('services.rate_limiter'))
+        sys.modules.setdefault('services.rate_limiter.rate_limiter', stub)
+
+    from services.websocket import websocket_server
+    return websocket_server
+
+
+class FakeWebSocket:
+    """Records frames sent to a client; can be slow or already closed"""
+
+    def __init__(self, port: int, delay: float = 0.0, closed: bool = False):
+        self.remote_address = ('127.0.0.1', port)
+        self.delay = delay
+        self.closed = closed
+        self.sent = []
+        self.sent_at = []
+        self.close_code = None
+
+    async def send(self, frame):
+        if self.closed:
+            import websockets
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(frame)
+        self.sent_at.append(time.monotonic())
+
+    async def close(self, code=1000, reason=''):
+        self.close_code = code
+
+    def frames(self, msg_type=None):
+        """Decoded text frames, optionally of one type"""
+        frames = [json.loads(frame) for frame in self.sent if isinstance(frame, str)]
+        return [frame for frame in frames if msg_type is None or frame['type'] == msg_type]
+
+
+class WebSocketTestCase(unittest.TestCase):
+    """Base class providing the server module and a manager factory"""
+
+    def setUp(self):
+        try:
+            self.server = import_server()
+        except ImportError:
+            self.skipTest("websockets, PyJWT or PyZMQ not installed")
+
+    def make_tick(self, symbol: str = 'EURUSD', i: int = 0):
+        return self.server.MarketTick(symbol, 1.1 + i / 10000, 1.1002 + i / 10000, 0.0002, i, 1000.0 + i)
+
+    async def connect(self, manager, count: int, tier: str = 'unlimited', symbols=('EURUSD',), **options):
+        """Register fake clients and subscribe them"""
+        sockets = []
+        clients = []
+        for i in range(count):
+            socket = FakeWebSocket(10000 + len(manager.clients), **options)
+            client = await manager.register_client(socket, '/')
+            client.tier = tier
+            await manager.subscribe_client(client.id, list(symbols))
+            sockets.append(socket)
+            clients.append(client)
+        return sockets, clients
+
+
+class TestBroadcast(WebSocketTestCase):
+    """Test fan-out of ticks to subscribers"""
+
+    def test_tick_encoded_once_for_all_subscribers(self):
+        """Test that a broadcast serializes the tick once regardless of subscriber count"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            sockets, _ = await self.connect(manager, 20)
+
+            with mock.patch.object(self.server, 'asdict', wraps=self.server.asdict) as encode:
+                await manager.broadcast_market_data(self.make_tick())
+                await asyncio.sleep(0.05)
+
+            self.assertEqual(encode.call_count, 1)
+            for socket in sockets:
+                ticks = socket.frames('tick')
+                self.assertEqual(len(ticks), 1)
+                self.assertEqual(ticks[0]['data']['symbol'], 'EURUSD')
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_slow_and_failing_subscribers_are_isolated(self):
+        """Test that one slow or closed socket does not hold up the broadcast or other subscribers"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            symbols = ('EURUSD', 'GBPUSD')
+            fast, _ = await self.connect(manager, 3, symbols=symbols)
+            (slow,), (slow_client,) = await self.connect(manager, 1, symbols=symbols, delay=1.0)
+            (closed,), (closed_client,) = await self.connect(manager, 1, symbols=symbols)
+            closed.closed = True
+
+            started = time.monotonic()
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await manager.broadcast_market_data(self.make_tick('GBPUSD', 2))
+            self.assertLess(time.monotonic() - started, 0.1)
+
+            await asyncio.sleep(0.05)
+            for socket in fast:
+                self.assertEqual([tick['data']['symbol'] for tick in socket.frames('tick')], list(symbols))
+            self.assertEqual(slow.frames('tick'), [])
+            self.assertNotIn(closed_client.id, manager.clients)
+            self.assertIn(slow_client.id, manager.clients)
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_rate_limited_client_stays_connected(self):
+        """Test that a client refused by the rate limiter is warned, not disconnected"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            limiter = RefusingLimiter()
+            manager.rate_limiters['unlimited'] = limiter
+            (allowed, limited), (_, limited_client) = await self.connect(manager, 2)
+            limiter.refused.add(limited_client.id)
+
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await manager.handle_heartbeat(limited_client.id)
+            await asyncio.sleep(0.01)
+
+            self.assertIn(limited_client.id, manager.clients)
+            self.assertEqual(len(allowed.frames('tick')), 1)
+            # Ticks are paced by the throttle, not the rate limiter
+            self.assertEqual(len(limited.frames('tick')), 1)
+            self.assertEqual(limited.frames('pong'), [])
+            self.assertEqual(limited.frames('rate_limit'), [{'type': 'rate_limit', 'retry_after': 2}])
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+class TestSendQueue(WebSocketTestCase):
+    """Test per-client send queues"""
+
+    def drain(self, queue):
+        async def run():
+            entries = []
+            while len(queue):
+                entries.append(await queue.get())
+            return entries
+
+        return asyncio.run(run())
+
+    def test_ticks_conflate_in_place(self):
+        """Test that a new tick replaces the pending tick of its symbol without moving it"""
+        queue = self.server.SendQueue()
+        queue.put('A1', 'A')
+        queue.put('B1', 'B')
+        queue.put('A2', 'A')
+        queue.put('C1', 'C')
+        queue.put('B2', 'B')
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.conflated, 2)
+        self.assertEqual(self.drain(queue), [('A', 'A2'), ('B', 'B2'), ('C', 'C1')])
+
+    def test_control_frames_are_never_dropped(self):
+        """Test that control frames survive any number of ticks and go out first"""
+        queue = self.server.SendQueue()
+        queue.put('subscribed')
+        for i in range(1000):
+            queue.put(f'tick{i}', f'SYM{i % 400}')
+        queue.put('pong')
+
+        entries = self.drain(queue)
+        self.assertEqual(entries[:2], [(None, 'subscribed'), (None, 'pong')])
+        self.assertEqual(len(entries), 402)
+        self.assertEqual(dict(entries[2:])['SYM0'], 'tick800')
+        self.assertEqual(queue.conflated, 600)
+
+    def test_control_overflow_closes_queue(self):
+        """Test that a control frame beyond maxsize closes the queue instead of growing it"""
+        queue = self.server.SendQueue(maxsize=3)
+        for i in range(3):
+            self.assertTrue(queue.put(f'pong{i}'))
+        self.assertTrue(queue.put('A1', 'A'))
+
+        self.assertFalse(queue.put('pong3'))
+        self.assertTrue(queue.overflowed)
+        self.assertTrue(queue.closed)
+        self.assertEqual(len(queue), 0)
+
+    def test_pop_tick_yields_to_control_frames(self):
+        """Test that batching cannot take ticks ahead of a waiting control frame"""
+        queue = self.server.SendQueue()
+        queue.put('A1', 'A')
+        self.assertEqual(queue.pop_tick(), 'A1')
+        queue.put('B1', 'B')
+        queue.put('auth_success')
+        self.assertIsNone(queue.pop_tick())
+
+    def test_discard_and_close(self):
+        """Test dropping the pending tick of an unsubscribed symbol and closing the queue"""
+        queue = self.server.SendQueue()
+        queue.put('A1', 'A')
+        queue.put('B1', 'B')
+        queue.discard('A')
+        self.assertEqual(self.drain(queue), [('B', 'B1')])
+
+        queue.put('welcome')
+        queue.close()
+        queue.put('A2', 'A')
+        self.assertEqual(len(queue), 0)
+        self.assertIsNone(asyncio.run(queue.get()))
+
+    def test_slow_client_gets_current_prices(self):
+        """Test that a slow client receives the newest tick of every symbol"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            symbols = ['EURUSD', 'GBPUSD', 'USDJPY']
+            (fast,), _ = await self.connect(manager, 1, symbols=symbols)
+            (slow,), (slow_client,) = await self.connect(manager, 1, symbols=symbols, delay=0.02)
+
+            for i in range(90):
+                await manager.broadcast_market_data(self.make_tick(symbols[i % 3], i))
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.2)
+
+            self.assertEqual(len(fast.frames('tick')), 90)
+            latest = {tick['data']['symbol']: tick['data']['volume'] for tick in slow.frames('tick')}
+            self.assertEqual(latest, {'EURUSD': 87, 'GBPUSD': 88, 'USDJPY': 89})
+            self.assertLess(len(slow.frames('tick')), 90)
+            self.assertGreater(manager.get_client_stats(slow_client.id)['conflated'], 0)
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_client_not_reading_is_disconnected(self):
+        """Test that a client whose control frames pile up is unregistered and closed"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            (socket,), (client,) = await self.connect(manager, 1, delay=1.0)
+            client.queue.maxsize = 5
+
+            for i in range(10):
+                await manager.handle_heartbeat(client.id)
+            await asyncio.sleep(0.01)
+
+            self.assertNotIn(client.id, manager.clients)
+            self.assertNotIn('EURUSD', manager.symbol_subscribers)
+            self.assertEqual(socket.close_code, 1008)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+
+class TestThrottle(WebSocketTestCase):
+    """Test throttled tick delivery"""
+
+    def test_timer_wheel_expiry(self):
+        """Test that keys expire after their delay, including delays longer than one turn"""
+        wheel = self.server.TimerWheel(resolution=0.01, slots=8)
+        wheel.schedule('a', 0.03)
+        wheel.schedule('b', 0.08)
+        wheel.schedule('c', 0.2)
+        wheel.schedule('d', 0.001)
+
+        expired = {}
+        for tick in range(1, 30):
+            for key in wheel.advance():
+                expired[key] = tick
+        self.assertEqual(expired, {'d': 1, 'a': 3, 'b': 8, 'c': 20})
+
+    def test_interval_follows_tier_rate(self):
+        """Test that the interval floor shares the tier rate across subscriptions"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            _, (one,) = await self.connect(manager, 1, tier='premium')
+            (many_socket,), (many,) = await self.connect(manager, 1, tier='premium',
+                                                         symbols=[f'SYM{i}' for i in range(50)])
+            _, (basic,) = await self.connect(manager, 1, tier='basic',
+                                             symbols=[f'SYM{i}' for i in range(20)])
+
+            self.assertAlmostEqual(manager.throttle_interval(one, 'EURUSD'), 0.01)
+            self.assertAlmostEqual(manager.throttle_interval(many, 'SYM0'), 0.5)
+            self.assertAlmostEqual(manager.throttle_interval(basic, 'SYM0'), 0.4)
+            await asyncio.sleep(0.01)
+            self.assertEqual(many_socket.frames('subscribed')[0]['throttle_ms'],
+                             {f'SYM{i}': 500 for i in range(50)})
+
+            # The floor follows the subscription count
+            await manager.unsubscribe_client(many.id, [f'SYM{i}' for i in range(25)])
+            self.assertAlmostEqual(manager.throttle_interval(many, 'SYM30'), 0.25)
+
+            # A requested interval applies above the floor only
+            await manager.subscribe_client(one.id, ['EURUSD'], throttle_ms=250)
+            self.assertAlmostEqual(manager.throttle_interval(one, 'EURUSD'), 0.25)
+            await manager.subscribe_client(one.id, ['EURUSD'], throttle_ms=1)
+            self.assertAlmostEqual(manager.throttle_interval(one, 'EURUSD'), 0.01)
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_held_tick_is_released_by_timer(self):
+        """Test that ticks inside the interval are held, conflated and released by the wheel"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            (socket,), (client,) = await self.connect(manager, 1, tier='free')
+            await manager.subscribe_client(client.id, ['EURUSD'], throttle_ms=200)
+
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 2))
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 3))
+            await asyncio.sleep(0.01)
+            self.assertEqual([tick['data']['volume'] for tick in socket.frames('tick')], [1])
+            self.assertIn('"volume": 3', client.throttled['EURUSD'])
+
+            # The held tick is due one interval after the first was sent
+            for slot in range(1, 25):
+                if (client.id, 'EURUSD') in manager.timer_wheel.advance():
+                    break
+            self.assertIn(slot, range(18, 21))
+
+            manager.release_throttled(client.id, 'EURUSD')
+            await asyncio.sleep(0.01)
+            self.assertEqual([tick['data']['volume'] for tick in socket.frames('tick')], [1, 3])
+            self.assertEqual(client.throttled, {})
+
+            # The interval restarts from the released tick
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 4))
+            self.assertIn('EURUSD', client.throttled)
+
+            await manager.unregister_client(client.id)
+            manager.release_throttled(client.id, 'EURUSD')
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_delivery_rate_stays_within_interval(self):
+        """Test that a stream of ticks is delivered at the throttle rate, ending on the latest"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            wheel = asyncio.create_task(manager.run_timer_wheel())
+            (socket,), (client,) = await self.connect(manager, 1, tier='free')
+            await manager.subscribe_client(client.id, ['EURUSD'], throttle_ms=50)
+
+            started = time.monotonic()
+            i = 0
+            while time.monotonic() - started < 0.5:
+                i += 1
+                await manager.broadcast_market_data(self.make_tick('EURUSD', i))
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.1)
+
+            ticks = socket.frames('tick')
+            self.assertGreaterEqual(len(ticks), 6)
+            self.assertLessEqual(len(ticks), 12)
+            self.assertEqual(ticks[-1]['data']['volume'], i)
+
+            sent_at = [at for frame, at in zip(socket.sent, socket.sent_at) if '"tick"' in frame]
+            gaps = [b - a for a, b in zip(sent_at, sent_at[1:])]
+            self.assertGreaterEqual(min(gaps), 0.045)
+
+            wheel.cancel()
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+
+class TestBatching(WebSocketTestCase):
+    """Test micro-batched tick frames"""
+
+    def batches(self, socket):
+        return [(frame['seq'], frame['data']) for frame in socket.frames('ticks')]
+
+    async def batching_client(self, manager, window_ms: int, max_ticks: int, symbols):
+        (socket,), (client,) = await self.connect(manager, 1, symbols=symbols)
+        await manager.set_batching(client.id, window_ms, max_ticks)
+        await asyncio.sleep(0.01)
+        return socket, client
+
+    def test_max_ticks_cutoff_and_seq(self):
+        """Test that batches are cut at max_ticks and numbered consecutively"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            symbols = [f'SYM{i}' for i in range(20)]
+            socket, client = await self.batching_client(manager, 50, 8, symbols)
+
+            for i, symbol in enumerate(symbols):
+                await manager.broadcast_market_data(self.make_tick(symbol, i))
+            await asyncio.sleep(0.1)
+
+            batches = self.batches(socket)
+            self.assertEqual([seq for seq, _ in batches], [1, 2, 3])
+            self.assertEqual([len(ticks) for _, ticks in batches], [8, 8, 4])
+            self.assertEqual([tick['symbol'] for _, ticks in batches for tick in ticks], symbols)
+            self.assertEqual(socket.frames('tick'), [])
+            self.assertEqual(manager.get_client_stats(client.id)['batches_sent'], 3)
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_window_closes_partial_batch(self):
+        """Test that a batch is sent once its window closes even when not full"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            symbols = ['EURUSD', 'GBPUSD', 'USDJPY']
+            socket, client = await self.batching_client(manager, 30, 64, symbols)
+
+            started = time.monotonic()
+            for i, symbol in enumerate(symbols):
+                await manager.broadcast_market_data(self.make_tick(symbol, i))
+            await asyncio.sleep(0.1)
+            for i, symbol in enumerate(symbols[:2]):
+                await manager.broadcast_market_data(self.make_tick(symbol, 10 + i))
+            await asyncio.sleep(0.1)
+
+            batches = self.batches(socket)
+            self.assertEqual([len(ticks) for _, ticks in batches], [3, 2])
+            first_sent = [at for frame, at in zip(socket.sent, socket.sent_at) if '"ticks"' in frame][0]
+            self.assertGreaterEqual(first_sent - started, 0.025)
+            self.assertLess(first_sent - started, 0.09)
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_batch_stops_at_control_frame(self):
+        """Test that a control frame ends the current batch instead of waiting behind it"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            symbols = ['EURUSD', 'GBPUSD', 'USDJPY']
+            socket, client = await self.batching_client(manager, 200, 64, symbols)
+            socket.sent.clear()
+
+            started = time.monotonic()
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await manager.broadcast_market_data(self.make_tick('GBPUSD', 2))
+            await asyncio.sleep(0.01)
+            await manager.handle_heartbeat(client.id)
+            await manager.broadcast_market_data(self.make_tick('USDJPY', 3))
+            await asyncio.sleep(0.05)
+
+            self.assertEqual([frame['type'] for frame in socket.frames()], ['ticks', 'pong'])
+            self.assertLess(time.monotonic() - started, 0.2)
+            self.assertEqual([len(ticks) for _, ticks in self.batches(socket)], [2])
+
+            await asyncio.sleep(0.25)
+            self.assertEqual([frame['type'] for frame in socket.frames()], ['ticks', 'pong', 'ticks'])
+            self.assertEqual([seq for seq, _ in self.batches(socket)], [1, 2])
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_client_unpacks_batches_and_reports_gaps(self):
+        """Test that the client emits every batched tick and logs sequence gaps"""
+        try:
+            from services.websocket.websocket_client import MT4WebSocketClient
+        except ImportError:
+            self.skipTest("aiohttp not installed")
+
+        async def run():
+            client = MT4WebSocketClient()
+            received = []
+            client.on('market_data', received.append)
+
+            with self.assertLogs(client.logger, 'WARNING') as logs:
+                for seq in (1, 2, 4):
+                    await client._handle_message({
+                        'type': 'ticks',
+                        'seq': seq,
+                        'data': [{'symbol': 'EURUSD', 'volume': seq}, {'symbol': 'GBPUSD', 'volume': seq}]
+                    })
+
+            self.assertEqual(len(received), 6)
+            self.assertEqual([tick['volume'] for tick in received], [1, 1, 2, 2, 4, 4])
+            self.assertEqual(len(logs.output), 1)
+            self.assertIn('expected 3, got 4', logs.output[0])
+            self.assertEqual(client.batch_seq, 4)
+
+        asyncio.run(run())
+
+
+class TestProtocols(WebSocketTestCase):
+    """Test binary tick protocols"""
+
+    async def decode(self, socket, protocol: str):
+        """Feed everything a socket received through MT4WebSocketClient"""
+        try:
+            from services.websocket.websocket_client import MT4WebSocketClient
+        except ImportError:
+            self.skipTest("aiohttp not installed")
+
+        client = MT4WebSocketClient(protocol=protocol)
+        ticks = []
+        client.on('market_data', ticks.append)
+        for frame in socket.sent:
+            data = client._decode_binary(frame) if isinstance(frame, bytes) else json.loads(frame)
+            await client._handle_message(data)
+        if client.heartbeat_task:
+            client.heartbeat_task.cancel()
+        return ticks
+
+    async def packed_client(self, manager, symbols):
+        socket = FakeWebSocket(20000 + len(manager.clients))
+        client = await manager.register_client(socket, '/?protocol=packed')
+        client.tier = 'unlimited'
+        await manager.subscribe_client(client.id, list(symbols))
+        return socket, client
+
+    def test_cached_tick_follows_symbol_ids(self):
+        """Test that a packed client can resolve the cached tick sent on subscribe"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 7))
+            socket, client = await self.packed_client(manager, ['EURUSD'])
+            await asyncio.sleep(0.01)
+
+            self.assertEqual([frame['type'] for frame in socket.frames()], ['welcome', 'protocol', 'subscribed'])
+            self.assertIsInstance(socket.sent[-1], bytes)
+            self.assertEqual(len(socket.sent[-1]), self.server.PACKED_HEADER.size + self.server.PACKED_TICK.size)
+
+            ticks = await self.decode(socket, 'packed')
+            self.assertEqual(len(ticks), 1)
+            self.assertEqual(ticks[0]['symbol'], 'EURUSD')
+            self.assertEqual(ticks[0]['volume'], 7)
+            self.assertAlmostEqual(ticks[0]['bid'], self.make_tick('EURUSD', 7).bid)
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_symbol_ids_announced_for_new_feed_symbols(self):
+        """Test that a symbol first seen after subscribing is announced before its tick"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            socket, client = await self.packed_client(manager, ['GBPUSD', 'USDJPY'])
+            self.assertEqual(manager.symbol_ids, {})
+
+            await manager.broadcast_market_data(self.make_tick('GBPUSD', 1))
+            await asyncio.sleep(0.01)
+            await manager.broadcast_market_data(self.make_tick('GBPUSD', 2))
+            await asyncio.sleep(0.01)
+
+            self.assertEqual([frame['type'] for frame in socket.frames()][-1], 'symbol_ids')
+            ticks = await self.decode(socket, 'packed')
+            self.assertEqual([(tick['symbol'], tick['volume']) for tick in ticks], [('GBPUSD', 1), ('GBPUSD', 2)])
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_symbol_ids_only_for_feed_symbols(self):
+        """Test that subscriptions and JSON clients do not create symbol IDs"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            await self.connect(manager, 1, symbols=[f'JUNK{i}' for i in range(100)])
+            await self.packed_client(manager, [f'MORE{i}' for i in range(100)])
+            await manager.broadcast_market_data(self.make_tick('JUNK0', 1))
+
+            self.assertEqual(manager.symbol_ids, {'JUNK0': 1})
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_encode_failure_skips_only_that_protocol(self):
+        """Test that a tick the packed codec cannot encode still reaches JSON clients"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            manager.symbol_ids = {f'SYM{i}': i + 1 for i in range(self.server.MAX_SYMBOL_ID)}
+            (json_socket,), _ = await self.connect(manager, 1, symbols=['EURUSD'])
+            packed_socket, _ = await self.packed_client(manager, ['EURUSD'])
+
+            with self.assertLogs(self.server.logger, 'ERROR') as logs:
+                await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+                await manager.broadcast_market_data(self.make_tick('EURUSD', 2))
+            await asyncio.sleep(0.01)
+
+            # Logged once per symbol, not for every tick
+            self.assertEqual(len(logs.output), 1)
+            self.assertNotIn('EURUSD', manager.symbol_ids)
+            self.assertEqual(len(json_socket.frames('tick')), 1)
+            self.assertFalse(any(isinstance(frame, bytes) for frame in packed_socket.sent))
+
+            for client_id in list(manager.clients):
+                await manager.unregister_client(client_id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_refused_symbol_ids_are_announced_again(self):
+        """Test that symbol IDs refused by the rate limiter are resent before the next tick"""
+        async def run():
+            manager = self.server.WebSocketManager()
+            limiter = RefusingLimiter()
+            manager.rate_limiters['unlimited'] = limiter
+            socket, client = await self.packed_client(manager, ['EURUSD'])
+
+            limiter.refused.add(client.id)
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await asyncio.sleep(0.01)
+            self.assertNotIn('EURUSD', client.symbol_ids_sent)
+            self.assertFalse(any(isinstance(frame, bytes) for frame in socket.sent))
+
+            limiter.refused.clear()
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 2))
+            await asyncio.sleep(0.01)
+
+            self.assertEqual([frame['type'] for frame in socket.frames()][-2:], ['rate_limit', 'symbol_ids'])
+            ticks = await self.decode(socket, 'packed')
+            self.assertEqual([(tick['symbol'], tick['volume']) for tick in ticks], [('EURUSD', 2)])
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+    def test_msgpack_ticks_and_batches(self):
+        """Test that msgpack clients decode single and batched ticks"""
+        if 'msgpack' not in self.server.TICK_CODECS:
+            self.skipTest("msgpack not installed")
+
+        async def run():
+            manager = self.server.WebSocketManager()
+            socket = FakeWebSocket(20000)
+            client = await manager.register_client(socket, '/?protocol=msgpack')
+            client.tier = 'unlimited'
+            await manager.subscribe_client(client.id, ['EURUSD', 'GBPUSD'])
+
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 1))
+            await asyncio.sleep(0.01)
+            await manager.set_batching(client.id, 20, 64)
+            await manager.broadcast_market_data(self.make_tick('EURUSD', 2))
+            await manager.broadcast_market_data(self.make_tick('GBPUSD', 3))
+            await asyncio.sleep(0.05)
+
+            self.assertEqual(sum(isinstance(frame, bytes) for frame in socket.sent), 2)
+            ticks = await self.decode(socket, 'msgpack')
+            self.assertEqual([(tick['symbol'], tick['volume']) for tick in ticks],
+                             [('EURUSD', 1), ('EURUSD', 2), ('GBPUSD', 3)])
+            self.assertAlmostEqual(ticks[0]['bid'], self.make_tick('EURUSD', 1).bid)
+
+            await manager.unregister_client(client.id)
+            manager.zmq_context.term()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()